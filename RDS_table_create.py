@@ -24,6 +24,7 @@ from sqlalchemy.dialects import sqlite
 from sqlalchemy import create_engine
 
 from app.models.schema_sql import DatasetSchemaTemplate, DatasetSchema, Base
+from app.models.version_sql import DatasetVersion, DatasetVersionManifest, Base as VersionBase
 from app.config import ConfigClass
 
 engine = create_engine(ConfigClass.OPS_DB_URI, echo = True)
@@ -31,5 +32,7 @@ engine = create_engine(ConfigClass.OPS_DB_URI, echo = True)
 if __name__ == "__main__":
     print(CreateTable(DatasetSchemaTemplate.__table__).compile(dialect=postgresql.dialect()))
     print(CreateTable(DatasetSchema.__table__).compile(dialect=postgresql.dialect()))
+    print(CreateTable(DatasetVersionManifest.__table__).compile(dialect=postgresql.dialect()))
 
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    VersionBase.metadata.create_all(bind=engine)
\ No newline at end of file
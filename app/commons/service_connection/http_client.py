@@ -0,0 +1,188 @@
+# Copyright 2022 Indoc Research
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+#
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+#
+
+import asyncio
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ...config import ConfigClass
+
+# the downstream services which has its own connection pool
+# so one slow service cannot use up the connections of others
+NEO4J = "neo4j"
+ELASTIC_SEARCH = "elastic_search"
+
+_async_clients = {}
+_client_loop = None
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_async_client(service: str = NEO4J) -> httpx.AsyncClient:
+    '''
+    Summary:
+        return the shared async http client for the service. The
+        client keep the connections alive in pool and is reused by
+        all the requests in same worker, so the api handlers dont
+        need to block the event loop with `requests`
+    Parameter:
+        - service: the name of downstream service, eg. NEO4J
+    Return:
+        httpx.AsyncClient
+    '''
+    global _client_loop
+
+    # the client is bound to the event loop it is created in
+    # if loop is changed(eg. the test client) then recreate them
+    loop = asyncio.get_event_loop()
+    if _client_loop is not loop:
+        _async_clients.clear()
+        _client_loop = loop
+
+    client = _async_clients.get(service)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=ConfigClass.HTTP_CLIENT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=ConfigClass.HTTP_CLIENT_MAX_CONNECTIONS,
+                max_keepalive_connections=ConfigClass.HTTP_CLIENT_MAX_KEEPALIVE,
+            ),
+        )
+        _async_clients[service] = client
+
+    return client
+
+
+async def close_async_clients():
+    '''
+    close all the pooled connections, called on app shutdown
+    '''
+    for client in list(_async_clients.values()):
+        await client.aclose()
+    _async_clients.clear()
+
+
+##########################################################################################
+# the sync session for the background jobs(copy/delete/move...) running in thread pool.
+# The session is shared by whole process so the connections are reused instead of
+# opening a new tcp connection for each call
+
+
+class PooledSession(requests.Session):
+    '''
+    requests session with a default timeout for each call
+    '''
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def _build_retry() -> Retry:
+    # only the idempotent methods will be retried on read error/5xx
+    # the connection error will be retried for all since the request
+    # never reach the server
+    retry_kwargs = {
+        "total": ConfigClass.HTTP_SESSION_RETRIES,
+        "connect": ConfigClass.HTTP_SESSION_RETRIES,
+        "read": ConfigClass.HTTP_SESSION_RETRIES,
+        "status": ConfigClass.HTTP_SESSION_RETRIES,
+        "backoff_factor": ConfigClass.HTTP_SESSION_BACKOFF,
+        "status_forcelist": (502, 503, 504),
+        "raise_on_status": False,
+    }
+    idempotent = frozenset(["HEAD", "GET", "PUT", "DELETE", "OPTIONS"])
+    # urllib3 renamed the parameter in 1.26
+    if "allowed_methods" in Retry.__init__.__code__.co_varnames:
+        retry_kwargs["allowed_methods"] = idempotent
+    else:
+        retry_kwargs["method_whitelist"] = idempotent
+
+    return Retry(**retry_kwargs)
+
+
+def get_session() -> requests.Session:
+    '''
+    Summary:
+        return the process wide pooled session. The pool size should be
+        at least the number of threads(gunicorn threads + background
+        jobs) calling same service at the same time.
+    Return:
+        requests.Session
+    '''
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = PooledSession(ConfigClass.HTTP_SESSION_TIMEOUT)
+                adapter = HTTPAdapter(
+                    pool_connections=ConfigClass.HTTP_SESSION_POOL_CONNECTIONS,
+                    pool_maxsize=ConfigClass.HTTP_SESSION_POOL_MAXSIZE,
+                    max_retries=_build_retry(),
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+
+    return _session
+
+
+def get_pool_metrics() -> list:
+    '''
+    Summary:
+        the metrics of each host pool in the shared session of current
+        worker process.
+    Return:
+        list of dict:
+            - host/port: the downstream service
+            - maxsize: max connections kept for the host
+            - in_use: connections checked out right now
+            - num_connections: connections opened since start
+            - num_requests: requests sent since start
+    '''
+    metrics = []
+    if _session is None:
+        return metrics
+
+    adapters = set(_session.adapters.values())
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            metrics.append({
+                "host": pool.host,
+                "port": pool.port,
+                "maxsize": pool.pool.maxsize,
+                "in_use": pool.pool.maxsize - pool.pool.qsize(),
+                "num_connections": pool.num_connections,
+                "num_requests": pool.num_requests,
+            })
+
+    return metrics
@@ -23,14 +23,355 @@ from minio import Minio
 import os
 import time
 import datetime
+import certifi
+import urllib3
+import math
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 from ...config import ConfigClass
 
 from minio.commonconfig import REPLACE, CopySource
+from minio.datatypes import Part
+from minio.deleteobjects import DeleteObject
 
 from minio.credentials.providers import ClientGrantsProvider
 
+def get_http_client(maxsize:int=10) -> urllib3.PoolManager:
+    '''
+    the same http pool as the minio default but with the given size,
+    so the client can be shared by more threads than 10
+    '''
+    timeout = datetime.timedelta(minutes=5).seconds
+    return urllib3.PoolManager(
+        timeout=urllib3.util.Timeout(connect=timeout, read=timeout),
+        maxsize=maxsize,
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+        retries=urllib3.Retry(
+            total=5,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504]
+        )
+    )
+
+
+def multipart_copy(client:Minio, bucket, obj, source_bucket, source_obj):
+    '''
+    Summary:
+        server side copy of the large object. The source is split into
+        ranged parts and each part is copied by upload-part-copy in the
+        thread pool, so the copy is not limited by the 5GiB of single
+        copy and the parts run in parallel. The upload will be aborted
+        if any of part failed.
+        The public compose_object copies the parts one by one, so the
+        private upload apis of minio 7.0.3(pinned in requirements) are
+        used here
+    Parameter:
+        - client: the minio client
+        - bucket/obj: the destination
+        - source_bucket/source_obj: the source object
+    Return:
+        the complete multipart upload result
+    '''
+    stat = client.stat_object(source_bucket, source_obj)
+    size = stat.size
+    # the node size maybe out of date, so double check the real size
+    if size < ConfigClass.MINIO_MULTIPART_COPY_THRESHOLD:
+        return client.copy_object(bucket, obj, CopySource(source_bucket, source_obj))
+
+    # s3 allow max 10000 parts for one upload
+    part_size = max(ConfigClass.MINIO_MULTIPART_PART_SIZE, math.ceil(size/10000))
+    copy_source = quote("/" + source_bucket + "/" + source_obj)
+    headers = {"Content-Type": stat.content_type or "application/octet-stream"}
+    upload_id = client._create_multipart_upload(bucket, obj, headers)
+
+    def copy_part(part_number, start):
+        end = min(start+part_size, size) - 1
+        part_headers = {
+            "x-amz-copy-source": copy_source,
+            "x-amz-copy-source-range": "bytes=%d-%d"%(start, end),
+        }
+        etag, _ = client._upload_part_copy(bucket, obj, upload_id, part_number, part_headers)
+        return Part(part_number, etag)
+
+    try:
+        with ThreadPoolExecutor(max_workers=ConfigClass.MINIO_MULTIPART_WORKERS) as executor:
+            futures = [executor.submit(copy_part, i+1, start) \
+                for i, start in enumerate(range(0, size, part_size))]
+            parts = [x.result() for x in futures]
+
+        return client._complete_multipart_upload(bucket, obj, upload_id, parts)
+    except Exception as e:
+        client._abort_multipart_upload(bucket, obj, upload_id)
+        raise e
+
+
+
+def bulk_remove_objects(client:Minio, object_keys:list) -> list:
+    '''
+    Summary:
+        remove the objects with multi-object delete. The keys are grouped
+        by bucket and split into batches of 1000(max of one request), the
+        batches run in parallel
+    Parameter:
+        - client: the minio client
+        - object_keys: list of tuple(<bucket>, <object path>)
+    Return:
+        list of the failed keys -> [{"target":<bucket/path>, "err_message":...}]
+    '''
+    buckets = {}
+    for bucket, obj in object_keys:
+        buckets.setdefault(bucket, []).append(obj)
+
+    def remove_batch(bucket, objs):
+        errors = client.remove_objects(bucket, [DeleteObject(x) for x in objs])
+        # the remove_objects is lazy, the request is sent when iterating
+        return [{"target": "%s/%s"%(bucket, x.name), "err_message": "%s: %s"%(x.code, x.message)} \
+            for x in errors]
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=ConfigClass.MINIO_DELETE_WORKERS) as executor:
+        futures = []
+        for bucket, objs in buckets.items():
+            for i in range(0, len(objs), 1000):
+                batch = objs[i:i+1000]
+                futures.append((bucket, batch, executor.submit(remove_batch, bucket, batch)))
+
+        for bucket, batch, future in futures:
+            try:
+                failed += future.result()
+            except Exception as e:
+                failed += [{"target": "%s/%s"%(bucket, x), "err_message": str(e)} for x in batch]
+
+    return failed
+
+
+def get_object_data(client:Minio, bucket, obj, offset=0, length=0) -> bytes:
+    response = client.get_object(bucket, obj, offset=offset, length=length)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def prefetch_objects(client:Minio, objects:list, workers:int, byte_budget:int):
+    '''
+    Summary:
+        download the objects ahead of the caller in a thread pool and yield
+        them in the same order as the input, so the output is deterministic.
+        The bytes downloaded but not consumed yet stay under byte_budget.
+        The object larger than the budget or with unknown size is not
+        prefetched, its data is None and the caller should stream it
+    Parameter:
+        - client: the minio client
+        - objects: list of tuple(<bucket>, <object path>, <size>)
+        - workers: the number of parallel downloads
+        - byte_budget: max bytes held in memory
+    Return:
+        generator of tuple(<object>, <data or None>)
+    '''
+    pending = deque()
+    remaining = iter(objects)
+    state = {"next": next(remaining, None), "in_flight": 0}
+    # the empty files do not count in budget so cap the look ahead as well
+    max_ahead = workers * 16
+
+    def fill():
+        while state["next"] is not None and len(pending) < max_ahead:
+            bucket, obj, size = state["next"]
+            # the size from neo4j may be missing, do not trust it with the
+            # budget and let the caller stream the object instead
+            if size is None or size < 0 or size > byte_budget:
+                pending.append((state["next"], None, 0))
+            elif state["in_flight"] + size <= byte_budget:
+                future = executor.submit(get_object_data, client, bucket, obj)
+                pending.append((state["next"], future, size))
+                state["in_flight"] += size
+            else:
+                return
+            state["next"] = next(remaining, None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            fill()
+            while pending:
+                item, future, size = pending.popleft()
+                data = future.result() if future else None
+                yield item, data
+                del data
+                state["in_flight"] -= size
+                fill()
+        finally:
+            # the caller stop early, do not download the rest
+            for _, future, _ in pending:
+                if future:
+                    future.cancel()
+
+
+# s3 limits of the multipart upload
+MIN_PART_SIZE = 5*1024*1024
+MAX_PART_SIZE = 5*1024*1024*1024
+
+
+class MultipartUploadStream():
+    '''
+    A write only file object which uploads the data as a multipart upload
+    while it is written. The data is cut into parts of part_size and at
+    most `workers` parts are uploading at the same time, so the memory is
+    bounded by (workers+1)*part_size. It has no seek so zipfile will write
+    the archive in streaming mode(data descriptor after each member)
+    '''
+    def __init__(self, client:Minio, bucket, obj, part_size:int, workers:int=4, \
+        content_type="application/octet-stream"):
+        self.client = client
+        self.bucket = bucket
+        self.obj = obj
+        # s3 require all the parts except the last one larger than 5MiB
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.upload_id = client._create_multipart_upload(bucket, obj, {"Content-Type": content_type})
+        self.buffer = bytearray()
+        self.position = 0
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.Semaphore(workers)
+        self.closed = False
+
+    def _upload_part(self, part_number, data):
+        try:
+            etag = self.client._upload_part(self.bucket, self.obj, data, None, \
+                self.upload_id, part_number)
+            return Part(part_number, etag)
+        finally:
+            self.slots.release()
+
+    def _copy_part(self, part_number, source_bucket, source_obj, start, end):
+        try:
+            headers = {
+                "x-amz-copy-source": quote("/" + source_bucket + "/" + source_obj),
+                "x-amz-copy-source-range": "bytes=%d-%d"%(start, end-1),
+            }
+            etag, _ = self.client._upload_part_copy(self.bucket, self.obj, self.upload_id, \
+                part_number, headers)
+            return Part(part_number, etag)
+        finally:
+            self.slots.release()
+
+    def _submit(self, func, *args):
+        # block the writer when all the slots are uploading
+        self.slots.acquire()
+        # stop writing early if any part already failed
+        for future in self.futures:
+            if future.done() and future.exception():
+                self.slots.release()
+                raise future.exception()
+        part_number = len(self.futures) + 1
+        self.futures.append(self.executor.submit(func, part_number, *args))
+
+    def _flush_buffer(self):
+        self._submit(self._upload_part, bytes(self.buffer))
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._submit(self._upload_part, bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+        return len(data)
+
+    def copy_range(self, source_bucket, source_obj, start, end):
+        '''
+        Summary:
+            append the bytes [start, end) of another object. The range is
+            copied on server side by upload-part-copy, only the pieces too
+            small to be a part on its own(<5MiB) are downloaded
+        Parameter:
+            - source_bucket/source_obj: the source object
+            - start/end: the byte range, end is exclusive
+        '''
+        if end - start < MIN_PART_SIZE:
+            self.write(get_object_data(self.client, source_bucket, source_obj, start, end-start))
+            return
+
+        # the buffered data has to go as a part before the copied ones,
+        # top it up to the min part size with the head of range
+        if self.buffer:
+            need = MIN_PART_SIZE - len(self.buffer)
+            if need > 0:
+                self.write(get_object_data(self.client, source_bucket, source_obj, start, need))
+                start += need
+            # the write may have sent the full buffer as a part already
+            if self.buffer:
+                self._flush_buffer()
+            if end - start < MIN_PART_SIZE:
+                if end > start:
+                    self.write(get_object_data(self.client, source_bucket, source_obj, \
+                        start, end-start))
+                return
+
+        # split evenly so every copied part is between 5MiB and 5GiB
+        parts = math.ceil((end - start) / MAX_PART_SIZE)
+        step = math.ceil((end - start) / parts)
+        for part_start in range(start, end, step):
+            part_end = min(part_start+step, end)
+            self._submit(self._copy_part, source_bucket, source_obj, part_start, part_end)
+            self.position += part_end - part_start
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        '''
+        upload the rest of data and complete the upload
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buffer or not self.futures:
+                self._flush_buffer()
+            parts = [x.result() for x in self.futures]
+            self.executor.shutdown(wait=True)
+            return self.client._complete_multipart_upload(self.bucket, self.obj, \
+                self.upload_id, parts)
+        except Exception as e:
+            self.abort()
+            raise e
+
+    def abort(self):
+        self.closed = True
+        self.executor.shutdown(wait=True)
+        try:
+            self.client._abort_multipart_upload(self.bucket, self.obj, self.upload_id)
+        except Exception:
+            pass
+
+
+class LockedClientGrantsProvider(ClientGrantsProvider):
+    '''
+    the provider only exchange the token when the credential is expired.
+    Lock it so the threads sharing one client will not exchange the
+    token at the same time
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def retrieve(self):
+        with self._lock:
+            return super().retrieve()
+
+
 class Minio_Client_():
-    def __init__(self, access_token, refresh_token):
+    def __init__(self, access_token, refresh_token, http_client=None):
         # preset the tokens for refreshing
         self.access_token = access_token
         self.refresh_token = refresh_token
@@ -41,7 +382,8 @@ class Minio_Client_():
         self.client = Minio(
             ConfigClass.MINIO_ENDPOINT, 
             credentials=c,
-            secure=ConfigClass.MINIO_HTTPS)
+            secure=ConfigClass.MINIO_HTTPS,
+            http_client=http_client)
 
 
     # function helps to get new token/refresh the token
@@ -75,14 +417,18 @@ class Minio_Client_():
     def get_provider(self):
         minio_http = ("https://" if ConfigClass.MINIO_HTTPS else "http://") + ConfigClass.MINIO_ENDPOINT
         # print(minio_http)
-        provider = ClientGrantsProvider(
+        provider = LockedClientGrantsProvider(
             self._get_jwt,
             minio_http,
         )
 
         return provider
 
-    def copy_object(self, bucket, obj, source_bucket, source_obj):
+    def copy_object(self, bucket, obj, source_bucket, source_obj, size=-1):
+        # the large object will be copied by parts in parallel
+        if size and size >= ConfigClass.MINIO_MULTIPART_COPY_THRESHOLD:
+            return multipart_copy(self.client, bucket, obj, source_bucket, source_obj)
+
         result = self.client.copy_object(
             bucket,
             obj,
@@ -94,6 +440,9 @@ class Minio_Client_():
         result = self.client.remove_object(bucket, obj)
         return result
 
+    def delete_objects(self, object_keys:list) -> list:
+        return bulk_remove_objects(self.client, object_keys)
+
     # this will first call the copy api and delete the source
     def move_object(self, bucket, obj, source_bucket, source_obj):
         result = self.copy_object(bucket, obj, source_bucket, source_obj)
@@ -102,6 +451,91 @@ class Minio_Client_():
 
 
 
+# the clients by token, so the whole job(and the jobs of same user) reuse
+# the exchanged credential instead of token exchange for each file
+_client_cache = OrderedDict()
+_client_cache_lock = threading.Lock()
+
+
+def get_minio_client(access_token, refresh_token) -> Minio_Client_:
+    '''
+    Summary:
+        return the cached client of the token. The credential of client
+        is exchanged once and refreshed by the provider only when it is
+        expired. The cached client is dropped after MINIO_CLIENT_CACHE_TTL
+        or when the cache is full
+    Parameter:
+        - access_token: the user token
+        - refresh_token: the user refresh token
+    Return:
+        Minio_Client_
+    '''
+    # the internal calls have no user token, the client is not cached
+    # and its token exchange fails in the caller like before
+    if not access_token:
+        return Minio_Client_(access_token, refresh_token, \
+            http_client=get_http_client(max(10, ConfigClass.MINIO_COPY_WORKERS)))
+
+    key = hashlib.sha256(access_token.encode()).hexdigest()
+    now = time.time()
+
+    with _client_cache_lock:
+        cached = _client_cache.get(key)
+        if cached and now - cached[0] < ConfigClass.MINIO_CLIENT_CACHE_TTL:
+            _client_cache.move_to_end(key)
+            return cached[1]
+
+        # the client is shared by the copy threads so the pool is sized for them
+        client = Minio_Client_(access_token, refresh_token, \
+            http_client=get_http_client(max(10, ConfigClass.MINIO_COPY_WORKERS)))
+        _client_cache[key] = (now, client)
+        while len(_client_cache) > ConfigClass.MINIO_CLIENT_CACHE_SIZE:
+            _client_cache.popitem(last=False)
+
+    return client
+
+
+class MinioCopyPool():
+    '''
+    Run the minio server side copy in a bounded thread pool, so the
+    import of many small files is not bound by the round trip of each
+    copy. The copies are grouped by `group`(eg. the first level geid of
+    the job) so the caller can report the failures per job
+    '''
+    def __init__(self, access_token, refresh_token, max_workers=None):
+        max_workers = max_workers or ConfigClass.MINIO_COPY_WORKERS
+        self.mc = get_minio_client(access_token, refresh_token)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.group = None
+        self.futures = []
+
+    def copy_object(self, bucket, obj, source_bucket, source_obj, size=-1):
+        future = self.executor.submit(self.mc.copy_object, bucket, obj, source_bucket, \
+            source_obj, size)
+        self.futures.append((self.group, "%s/%s"%(bucket, obj), future))
+        return future
+
+    def wait(self) -> dict:
+        '''
+        Summary:
+            wait for all the submitted copies
+        Return:
+            the failed copies by group -> {group: [{"target":..., "err_message":...}]}
+        '''
+        failures = {}
+        for group, target, future in self.futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures.setdefault(group, []).append({"target": target, "err_message": str(e)})
+        self.futures = []
+
+        return failures
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
 class Minio_Client():
 
     def __init__(self):
@@ -113,7 +547,11 @@ class Minio_Client():
             secret_key=ConfigClass.MINIO_SECRET_KEY,
             secure=ConfigClass.MINIO_HTTPS)
     
-    def copy_object(self, bucket, obj, source_bucket, source_obj):
+    def copy_object(self, bucket, obj, source_bucket, source_obj, size=-1):
+        # the large object will be copied by parts in parallel
+        if size and size >= ConfigClass.MINIO_MULTIPART_COPY_THRESHOLD:
+            return multipart_copy(self.client, bucket, obj, source_bucket, source_obj)
+
         result = self.client.copy_object(
             bucket,
             obj,
@@ -125,6 +563,9 @@ class Minio_Client():
         result = self.client.remove_object(bucket, obj)
         return result
 
+    def delete_objects(self, object_keys:list) -> list:
+        return bulk_remove_objects(self.client, object_keys)
+
     # this will first call the copy api and delete the source
     def move_object(self, bucket, obj, source_bucket, source_obj):
         result = self.copy_object(bucket, obj, source_bucket, source_obj)
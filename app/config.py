@@ -97,6 +97,105 @@ class Settings(BaseSettings):
 
     MAX_PREVIEW_SIZE: int = 500000
 
+    # max number of geids sent to neo4j in one bulk query
+    NEO4J_BATCH_SIZE: int = 500
+    # create the copied nodes and relations level by level in batches,
+    # only used when the neo4j service has the batch node/relation apis
+    NEO4J_BULK_CREATE: bool = False
+
+    # async http client pool for downstream services
+    HTTP_CLIENT_TIMEOUT: int = 30
+    HTTP_CLIENT_MAX_CONNECTIONS: int = 100
+    HTTP_CLIENT_MAX_KEEPALIVE: int = 20
+
+    # sync pooled session for background jobs
+    HTTP_SESSION_TIMEOUT: int = 60
+    HTTP_SESSION_POOL_CONNECTIONS: int = 10
+    HTTP_SESSION_POOL_MAXSIZE: int = 20
+    HTTP_SESSION_RETRIES: int = 3
+    HTTP_SESSION_BACKOFF: float = 0.3
+
+    # max number of resource keys in one bulk lock/unlock call
+    RESOURCE_LOCK_BATCH_SIZE: int = 500
+    # lock the top folder only and treat it as lock of the whole subtree,
+    # only supported by the redis and local lock backend
+    RESOURCE_LOCK_HIERARCHICAL: bool = False
+    # where the locks are kept: dataops, local or redis
+    RESOURCE_LOCK_BACKEND: str = "dataops"
+    # the locks are held by a lease renewed by heartbeat, the expired
+    # leases(eg. the worker was killed) are released by the sweeper.
+    # it needs redis for the lease journal
+    RESOURCE_LOCK_LEASE: bool = False
+    # lease of the lock in redis backend, in seconds
+    RESOURCE_LOCK_TTL: int = 3600
+    # the lease and the redis lock TTL when the heartbeat renews them
+    RESOURCE_LOCK_LEASE_TTL: int = 120
+    RESOURCE_LOCK_HEARTBEAT: int = 30
+    RESOURCE_LOCK_SWEEP_INTERVAL: int = 60
+
+    # number of minio copies running at the same time in one import
+    MINIO_COPY_WORKERS: int = 8
+    # the object larger than threshold is copied by parts in parallel
+    MINIO_MULTIPART_COPY_THRESHOLD: int = 1024*1024*1024
+    MINIO_MULTIPART_PART_SIZE: int = 256*1024*1024
+    MINIO_MULTIPART_WORKERS: int = 8
+    # number of multi-object delete requests running at the same time
+    MINIO_DELETE_WORKERS: int = 4
+    # the minio clients cached by user token
+    MINIO_CLIENT_CACHE_TTL: int = 3600
+    MINIO_CLIENT_CACHE_SIZE: int = 64
+
+    # where the geids come from: service(prefetched in blocks) or local
+    GEID_ALLOCATOR: str = "service"
+    GEID_BLOCK_SIZE: int = 1000
+    # fetch next block in background when the pool is under watermark
+    GEID_REFILL_WATERMARK: int = 200
+    # the geid carries the time the service made it, so the ids kept in
+    # pool longer than the seconds are dropped instead of handed out
+    GEID_POOL_MAX_AGE: int = 300
+
+    # send the file job status and notifications from a background thread,
+    # the failed flush is retried on next interval up to the max retries
+    JOB_STATUS_BUFFERED: bool = False
+    JOB_STATUS_FLUSH_INTERVAL: float = 0.5
+    JOB_STATUS_MAX_RETRIES: int = 5
+
+    # max activity logs packed into one queue message
+    ACTIVITY_LOG_BATCH_SIZE: int = 500
+    # how the consumer acks the activity log messages:
+    # batch: index the logs in micro batch of size or timeout(seconds)
+    # manual: index the messages one by one in the worker pool
+    ACTIVITY_LOG_CONSUMER_MODE: str = "batch"
+    ACTIVITY_LOG_CONSUMER_BATCH_SIZE: int = 500
+    ACTIVITY_LOG_CONSUMER_BATCH_TIMEOUT: float = 1.0
+    # the failed messages are retried after the delay(seconds) which is
+    # doubled on each failure up to the max delay
+    CONSUMER_RETRY_DELAY: float = 1.0
+    CONSUMER_RETRY_MAX_DELAY: float = 60
+    # the failed message is moved to dead letter queue after the number
+    # of retries
+    CONSUMER_MAX_RETRIES: int = 5
+    # the manual mode consumer: unacked messages, worker pool size
+    CONSUMER_PREFETCH_COUNT: int = 50
+    CONSUMER_WORKERS: int = 4
+    # seconds to wait before reconnect to the queue
+    CONSUMER_RECONNECT_DELAY: float = 5
+
+    # publish the version by streaming the zip to minio without local staging
+    VERSION_PUBLISH_STREAMING: bool = False
+    VERSION_UPLOAD_PART_SIZE: int = 64*1024*1024
+    VERSION_UPLOAD_WORKERS: int = 4
+    VERSION_STREAM_CHUNK_SIZE: int = 1024*1024
+    # parallel downloads of the dataset files and the max bytes prefetched
+    VERSION_DOWNLOAD_WORKERS: int = 8
+    VERSION_PREFETCH_BYTES: int = 256*1024*1024
+    # reuse the unchanged files from the archive of last version(streaming)
+    VERSION_PUBLISH_INCREMENTAL: bool = False
+    # the files already compressed are stored in the version archive, the
+    # others are deflated with the level
+    VERSION_ZIP_STORE_EXTENSIONS: str = ".gz,.tgz,.zip,.bz2,.xz,.zst,.7z,.rar,.tif,.tiff,.png,.jpg,.jpeg,.gif,.h5,.hdf5,.mp4,.avi,.mov,.mp3"
+    VERSION_ZIP_COMPRESS_LEVEL: int = 6
+
     # dataset schema default
     ESSENTIALS_NAME: str = "essential.schema.json"
     ESSENTIALS_TPL_NAME: str = "Essential"
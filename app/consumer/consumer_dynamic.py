@@ -19,8 +19,43 @@
 # 
 
 import threading, time, json
+import functools
 import requests
+import pika
+from concurrent.futures import ThreadPoolExecutor
 from .rabbit_operator import RabbitConnection
+from ..config import ConfigClass
+
+def retry_delay(failures:int) -> float:
+    '''
+    the backoff before the n-th retry, doubled on each failure
+    '''
+    delay = ConfigClass.CONSUMER_RETRY_DELAY * 2 ** min(max(failures-1, 0), 16)
+    return min(delay, ConfigClass.CONSUMER_RETRY_MAX_DELAY)
+
+
+def get_retries(properties) -> int:
+    '''
+    the times the message has been retried. The count is kept in the
+    `x-retry` header since `redelivered` is also set after broker restart
+    '''
+    headers = (properties.headers if properties else None) or {}
+    return int(headers.get("x-retry", 0))
+
+
+def publish_copy(channel, routing_key, properties, body, headers:dict):
+    '''
+    publish the copy of message to the queue with the extra headers
+    '''
+    copy_headers = dict(properties.headers or {}) if properties else {}
+    copy_headers.update(headers)
+    channel.basic_publish(
+        exchange='',
+        routing_key=routing_key,
+        body=body,
+        properties=pika.BasicProperties(delivery_mode=2, headers=copy_headers)
+    )
+
 
 class ConsumerDynamic(threading.Thread):
     def __init__(self, unique_name,
@@ -32,9 +67,44 @@ class ConsumerDynamic(threading.Thread):
         self.exchange_name = exchange_name
         self.exchange_type = exchange_type
         self.__callback = None
+        self.__raw_callback = None
+        self.__batch_callback = None
+        self.__context = None
+        self.batch_size = 1
+        self.batch_timeout = 0
+        self.manual_ack = False
+        self.prefetch_count = 1
+        self.workers = 1
+        self.__connection = None
+        self.__channel = None
+        self.__stopped = threading.Event()
         threading.Thread.__init__(self, name=unique_name)
 
-    def set_callback(self, callback, context=None):
+    def set_callback(self, callback, context=None, manual_ack=False, prefetch_count=None, \
+        workers=None):
+        '''
+        Summary:
+            consume the messages one by one. By default the message is acked
+            on delivery. With manual_ack the callbacks run in a worker pool
+            and the message is acked after the callback return. The failed
+            message is published again with its retry count in the `x-retry`
+            header after a backoff. After CONSUMER_MAX_RETRIES it goes to the
+            dead letter queue `<queue>.dead`
+        Parameter:
+            - callback: function(channel, method, properties, body, context),
+                in manual_ack mode it runs in the worker thread so it should
+                not use the channel
+            - context: the context pass to the callback
+            - manual_ack: ack after the callback succeed
+            - prefetch_count: max unacked messages deliver to consumer
+            - workers: the size of worker pool
+        '''
+        self.__raw_callback = callback
+        self.__context = context
+        self.manual_ack = manual_ack
+        self.prefetch_count = prefetch_count or ConfigClass.CONSUMER_PREFETCH_COUNT
+        self.workers = workers or ConfigClass.CONSUMER_WORKERS
+
         def wrapper(*args):
             try:
                 print("=================Consumer {} is consuming.".format(self.unique_name))
@@ -44,19 +114,181 @@ class ConsumerDynamic(threading.Thread):
                 pass
         self.__callback = wrapper
 
-    def run(self):
+    def set_batch_callback(self, callback, context=None, batch_size=100, batch_timeout=1.0):
+        '''
+        Summary:
+            consume the messages in micro batch. The callback is called with
+            the bodies once there are batch_size messages or batch_timeout
+            seconds after the first message of batch. It runs in a worker
+            thread so the connection keeps its heartbeats, and the batch is
+            acked after the callback return. If callback raise, the batch is
+            held for a backoff(CONSUMER_RETRY_DELAY, doubled on each failure
+            in a row), then each message is published again with its retry
+            count in the `x-retry` header, or to the dead letter queue
+            `<queue>.dead` after CONSUMER_MAX_RETRIES
+        Parameter:
+            - callback: function(channel, bodies:list, context), it should
+                not use the channel since it is not in the connection thread
+            - context: the context pass to the callback
+            - batch_size: max messages in one batch
+            - batch_timeout: max seconds to wait before the batch is handled
+        '''
+        self.__batch_callback = callback
+        self.__context = context
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+
+    def _consume_batch(self, connection, channel, queue):
+        dead_queue = queue + ".dead"
+        channel.queue_declare(queue=dead_queue)
+        executor = ThreadPoolExecutor(max_workers=1)
+        # the messages waiting for next batch -> list of tuple(<tag>, <properties>, <body>)
+        pending = []
+        # busy: one batch is in the worker or in the backoff
+        state = {"timer": None, "failures": 0, "busy": False}
+
+        def schedule():
+            if pending and not state["busy"] and state["timer"] is None:
+                state["timer"] = connection.call_later(self.batch_timeout, on_timeout)
+
+        def flush():
+            if state["timer"] is not None:
+                connection.remove_timeout(state["timer"])
+                state["timer"] = None
+            if not pending or state["busy"]:
+                return
+
+            batch = pending[:self.batch_size]
+            del pending[:len(batch)]
+            state["busy"] = True
+            executor.submit(work, batch)
+
+        def work(batch):
+            error = None
+            try:
+                print("=================Consumer {} is consuming {} messages."\
+                    .format(self.unique_name, len(batch)))
+                self.__batch_callback(channel, [x[2] for x in batch], self.__context)
+            except Exception as exce:
+                error = exce
+            try:
+                connection.add_callback_threadsafe(functools.partial(settle, batch, error))
+            except Exception as exce:
+                # the connection is dropped, the messages will be redelivered
+                print(str(exce))
+
+        def settle(batch, error):
+            # pika channel is not thread safe so this runs in connection thread
+            if error is None:
+                channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+                state["failures"] = 0
+                resume()
+                return
+
+            # hold the batch until the backoff is over, so the consumer will
+            # not spin on it when the downstream(eg. elastic search) is down
+            state["failures"] += 1
+            delay = retry_delay(state["failures"])
+            print("{}, retry the batch in {} seconds".format(str(error), delay))
+            connection.call_later(delay, functools.partial(retry, batch, error))
+
+        def retry(batch, error):
+            for _, properties, body in batch:
+                retries = get_retries(properties) + 1
+                if retries > ConfigClass.CONSUMER_MAX_RETRIES:
+                    # the poison message is parked in dead letter queue
+                    publish_copy(channel, dead_queue, properties, body, {"x-error": str(error)})
+                else:
+                    publish_copy(channel, queue, properties, body, {"x-retry": retries})
+            channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+            resume()
+
+        def resume():
+            state["busy"] = False
+            # the messages arrived during the last batch
+            if len(pending) >= self.batch_size:
+                flush()
+            else:
+                schedule()
+
+        def on_timeout():
+            state["timer"] = None
+            flush()
+
+        def on_message(ch, method, properties, body):
+            pending.append((method.delivery_tag, properties, body))
+            if state["busy"]:
+                return
+            if len(pending) >= self.batch_size:
+                flush()
+            else:
+                schedule()
+
+        # let broker deliver the next batch while one is in the worker
+        channel.basic_qos(prefetch_count=self.batch_size*2)
+        channel.basic_consume(queue=queue, on_message_callback=on_message, auto_ack=False)
+        return executor
+
+    def _consume_manual(self, connection, channel, queue):
+        dead_queue = queue + ".dead"
+        channel.queue_declare(queue=dead_queue)
+
+        def retry(method, properties, body, retries):
+            # publish the copy with the retry count to the tail of queue
+            publish_copy(channel, queue, properties, body, {"x-retry": retries})
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+
+        def settle(method, properties, body, error):
+            # pika channel is not thread safe so this runs in connection thread
+            if error is None:
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+                return
+
+            retries = get_retries(properties) + 1
+            if retries > ConfigClass.CONSUMER_MAX_RETRIES:
+                # the poison message is parked in dead letter queue
+                publish_copy(channel, dead_queue, properties, body, {"x-error": str(error)})
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+            else:
+                # hold the message until the backoff is over
+                connection.call_later(retry_delay(retries), \
+                    functools.partial(retry, method, properties, body, retries))
+
+        def work(ch, method, properties, body):
+            error = None
+            try:
+                print("=================Consumer {} is consuming.".format(self.unique_name))
+                self.__raw_callback(ch, method, properties, body, self.__context)
+            except Exception as exce:
+                print(str(exce))
+                error = exce
+            try:
+                connection.add_callback_threadsafe(functools.partial(settle, method, properties, body, error))
+            except Exception as exce:
+                # the connection is dropped, the message will be redelivered
+                print(str(exce))
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        def on_message(ch, method, properties, body):
+            executor.submit(work, ch, method, properties, body)
+
+        channel.basic_qos(prefetch_count=self.prefetch_count)
+        channel.basic_consume(queue=queue, on_message_callback=on_message, auto_ack=False)
+        return executor
+
+    def _consume(self):
+        queue = self.queue
+        exchange_name = self.exchange_name
+        exchange_type = self.exchange_type
+        routing_key = self.routing_key
+        executor = None
+        my_rabbit = RabbitConnection()
+        connection_instance = my_rabbit.init_connection()
+        self.__connection = connection_instance
         try:
-            if not self.__callback:
-                raise Exception(
-                    '[Fatal] callback not set for consumer: {}'.format(self.unique_name))
-            queue = self.queue
-            exchange_name = self.exchange_name
-            exchange_type = self.exchange_type
-            routing_key = self.routing_key
-            callback = self.__callback
-            my_rabbit = RabbitConnection()
-            connection_instance = my_rabbit.init_connection()
             channel = connection_instance.channel()
+            self.__channel = channel
             channel.queue_declare(queue=queue)
             channel.exchange_declare(
                 exchange=exchange_name,
@@ -65,12 +297,47 @@ class ConsumerDynamic(threading.Thread):
                     exchange=exchange_name,
                     queue=queue,
                     routing_key=routing_key)
-            channel.basic_consume(
-                queue=queue, on_message_callback=callback, auto_ack=True)
+            if self.__batch_callback:
+                executor = self._consume_batch(connection_instance, channel, queue)
+            elif self.manual_ack:
+                executor = self._consume_manual(connection_instance, channel, queue)
+            else:
+                channel.basic_consume(
+                    queue=queue, on_message_callback=self.__callback, auto_ack=True)
             channel.start_consuming()
-        except Exception as exce:
-            # prevent from blocking other thredings
-            print(str(exce))
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+            if connection_instance.is_open:
+                try:
+                    connection_instance.close()
+                except Exception:
+                    pass
+
+    def run(self):
+        if not self.__callback and not self.__batch_callback:
+            print('[Fatal] callback not set for consumer: {}'.format(self.unique_name))
+            return
+
+        # reconnect when the connection drops instead of ending the thread
+        while not self.__stopped.is_set():
+            try:
+                self._consume()
+            except Exception as exce:
+                # prevent from blocking other thredings
+                print(str(exce))
+            if self.__stopped.wait(ConfigClass.CONSUMER_RECONNECT_DELAY):
+                break
+            print("=================Consumer {} is reconnecting.".format(self.unique_name))
+
+    def stop(self):
+        '''
+        stop consuming and do not reconnect
+        '''
+        self.__stopped.set()
+        connection, channel = self.__connection, self.__channel
+        if connection and channel and connection.is_open:
+            connection.add_callback_threadsafe(channel.stop_consuming)
 
 # threading consumer example
 class Consumer(threading.Thread):
@@ -20,7 +20,9 @@
 
 from .consumer_dynamic import ConsumerDynamic
 from .rabbit_operator import RabbitConnection
-from ..resources.es_helper import insert_one_by_id, get_one_by_id
+from ..config import ConfigClass
+from ..resources.es_helper import bulk_create
+from ..models.import_data_model import BATCH_EVENT_TYPE
 import ast
 import pika
 import json
@@ -51,37 +53,72 @@ def publish(queue, routing_key, body,
     my_rabbit.close_connection()
 
 
-def callback(ch, method, properties, body, ctx_context):
-    msg = json.loads(body)
-    payload = msg['payload']
-
-    # insert activity log to elastic search
-    es_body = {
+def build_es_body(event_type, create_timestamp, payload):
+    return {
         "global_entity_id": payload['act_geid'],
-        "create_timestamp": int(msg['create_timestamp']),
+        "create_timestamp": int(create_timestamp),
         "operator": payload['operator'],
         "dataset_geid": payload['dataset_geid'],
-        "event_type": msg['event_type'],
+        "event_type": event_type,
         "action": payload['action'],
         "resource": payload['resource'],
         "detail": payload['detail'],
     }
 
-    check_es_res = get_one_by_id('activity-logs', '_doc', payload['act_geid'])
-    if check_es_res['found']:
+
+def message_to_docs(msg):
+    '''
+    return the activity logs of the message as list of tuple(<id>, <es body>),
+    the batch message is expanded into one log per event
+    '''
+    if msg['event_type'] == BATCH_EVENT_TYPE:
+        return [(x['act_geid'], build_es_body(x['event_type'], msg['create_timestamp'], x)) \
+            for x in msg['payload']['events']]
+
+    payload = msg['payload']
+    return [(payload['act_geid'], build_es_body(msg['event_type'], msg['create_timestamp'], payload))]
+
+
+def bulk_callback(ch, bodies, ctx_context):
+    '''
+    Summary:
+        index the activity logs of a micro batch of messages with one bulk
+        request. The logs already exist(eg. redelivered message) are skipped
+        by the create op instead of the check before insert. If elastic
+        search is unavailable the exception let the consumer retry batch
+    Parameter:
+        - ch: the channel, not used since it runs in the worker thread
+        - bodies: list of message body
+        - ctx_context: the context of consumer
+    '''
+    docs = []
+    for body in bodies:
+        try:
+            docs += message_to_docs(json.loads(body))
+        except Exception as e:
+            # the malformed message will never succeed so just drop it
+            print('Skip the invalid activity log message %s: %s'%(str(body), str(e)))
+    if not docs:
         return
 
-    create_es_res = insert_one_by_id('_doc', 'activity-logs',
-                                     es_body, payload['act_geid'])
-    print(create_es_res)
-    if create_es_res['result'] == 'created':
-        print('Publish a “DATASET_ACTLOG_SUCCEED“ event')
-        msg['event_type'] = 'DATASET_ACTLOG_SUCCEED'
-    else:
-        print('publish a “DATASET_ACTLOG_TERMINATED“ message')
-        msg['event_type'] = '“DATASET_ACTLOG_TERMINATED“'
-    # publish(ctx_context['queue'], ctx_context['routing_key'], msg,
-    #         ctx_context['exchange_name'], ctx_context['exchange_type'])
+    create_es_res = bulk_create('activity-logs', docs)
+    if 'items' not in create_es_res:
+        raise Exception('Bulk index activity logs failed: %s'%str(create_es_res))
+
+    # 409 means the log is already indexed
+    statuses = [x['create'].get('status', 0) for x in create_es_res['items']]
+    if any(x == 429 or x >= 500 for x in statuses):
+        raise Exception('Elastic search rejected the activity logs, retry later')
+
+    failed = [x['create'] for x in create_es_res['items'] \
+        if x['create'].get('status') not in (201, 409)]
+    if failed:
+        print('publish a “DATASET_ACTLOG_TERMINATED“ message: %s'%str(failed))
+    print('Publish a “DATASET_ACTLOG_SUCCEED“ event of %d logs'%(len(docs)-len(failed)))
+
+
+def callback(ch, method, properties, body, ctx_context):
+    bulk_callback(ch, [body], ctx_context)
 
 
 def dataset_consumer():
@@ -94,11 +131,20 @@ def dataset_consumer():
         'exchange_type': 'fanout'
     }
 
+    mode = ConfigClass.ACTIVITY_LOG_CONSUMER_MODE
+    if mode not in ("batch", "manual"):
+        raise ValueError('Unknown ACTIVITY_LOG_CONSUMER_MODE: %s'%mode)
+
     # start consumer
     consumer = ConsumerDynamic(
         'dataset_activity_logger', 'dataset_actlog',
         routing_key='',
         exchange_name='DATASET_ACTS',
         exchange_type='fanout')
-    consumer.set_callback(callback, sub_content)
+    if mode == "batch":
+        consumer.set_batch_callback(bulk_callback, sub_content,
+            batch_size=ConfigClass.ACTIVITY_LOG_CONSUMER_BATCH_SIZE,
+            batch_timeout=ConfigClass.ACTIVITY_LOG_CONSUMER_BATCH_TIMEOUT)
+    else:
+        consumer.set_callback(callback, sub_content, manual_ack=True)
     consumer.start()
@@ -28,6 +28,8 @@ from .config import ConfigClass, SRV_NAMESPACE
 from .api_registry import api_registry
 from .consumer.consumers import dataset_consumer
 from app.resources.error_handler import APIException
+from app.commons.service_connection.http_client import close_async_clients
+from app.resources.lock_lease import start_lease_sweeper
 # from app.models.schema_sql import engine
 
 from opentelemetry import trace
@@ -67,6 +69,12 @@ def create_app():
     if os.environ.get("env", "test") != "test":
         print("test")
         dataset_consumer()
+        if ConfigClass.RESOURCE_LOCK_LEASE:
+            start_lease_sweeper()
+
+    @app.on_event("shutdown")
+    async def shutdown_http_clients():
+        await close_async_clients()
 
     @app.exception_handler(APIException)
     async def http_exception_handler(request: Request, exc: APIException):
@@ -23,6 +23,7 @@ import requests
 
 from ..config import ConfigClass
 from ..commons.logger_services.logger_factory_service import SrvLoggerFactory
+from ..resources.geid_allocator import allocate_geid, generate_local_geid
 
 class ImportDataPost(BaseModel):
     '''
@@ -128,18 +129,56 @@ class SrvDatasetFileMgr():
         return res
 
 
+    def batch(self) -> "ActivityLogBatch":
+        '''
+        return a batch to collect the move/rename/delete events and send
+        them in one message
+        '''
+        return ActivityLogBatch(self)
+
+
+    def _build_event(self, geid:str, operator:str, action:str, detail:dict, 
+        act_geid:str=None) -> dict:
+        return {
+            "dataset_geid": geid,
+            "act_geid": act_geid or get_geid(),
+            "operator": operator,
+            "action": action,
+            "resource": "Dataset",
+            "detail": detail
+        }
+
+
     def _message_send(self, geid:str, operator:str, action:str, event_type:str, 
         detail:dict) -> dict:
+        payload = self._build_event(geid, operator, action, detail)
+        return self._publish(event_type, payload)
+
+
+    def _message_send_batch(self, events:list) -> list:
+        '''
+        Summary:
+            send the events as messages of DATASET_ACTLOG_BATCH, each message
+            holds at most ACTIVITY_LOG_BATCH_SIZE events. The consumer will
+            expand them back into the activity logs
+        Parameter:
+            - events: list of event payload with its event_type
+        Return:
+            list of the queue responses
+        '''
+        results = []
+        batch_size = ConfigClass.ACTIVITY_LOG_BATCH_SIZE
+        for i in range(0, len(events), batch_size):
+            payload = {"events": events[i:i+batch_size]}
+            results.append(self._publish(BATCH_EVENT_TYPE, payload))
+
+        return results
+
+
+    def _publish(self, event_type:str, payload:dict) -> dict:
         post_json = {
             "event_type": event_type,
-            "payload": {
-                "dataset_geid": geid,
-                "act_geid": get_geid(),
-                "operator": operator,
-                "action": action,
-                "resource": "Dataset",
-                "detail": detail
-            },
+            "payload": payload,
             "queue": "dataset_actlog",
             "routing_key": "",
             "exchange": {
@@ -154,15 +193,52 @@ class SrvDatasetFileMgr():
         return res.json()
 
 
+# the event type of the message which packs many activity logs
+BATCH_EVENT_TYPE = "DATASET_ACTLOG_BATCH"
+
+
+class ActivityLogBatch():
+    '''
+    Collect the activity logs of one file operation and send them together.
+    The act geids are generated locally so there is no call to common
+    service per event. Each event still shows as one log(eg. one per moved
+    file/folder) after the consumer expand them
+    '''
+
+    def __init__(self, file_mgr:SrvDatasetFileMgr):
+        self.file_mgr = file_mgr
+        self.events = []
+
+    def _add(self, geid, username, event_type, detail):
+        action = self.file_mgr.event_action_map.get(event_type)
+        message_event = event_type+"_SUCCEED"
+        event = self.file_mgr._build_event(geid, username, action, detail, \
+            act_geid=generate_local_geid())
+        event["event_type"] = message_event
+        self.events.append(event)
+
+    def on_delete_event(self, geid, username, source_list):
+        self._add(geid, username, "DATASET_FILE_DELETE", {"source_list": source_list})
+
+    def on_move_event(self, geid, username, source, target):
+        self._add(geid, username, "DATASET_FILE_MOVE", {"from": source, "to": target})
+
+    def on_rename_event(self, geid, username, source, target):
+        self._add(geid, username, "DATASET_FILE_RENAME", {"from": source, "to": target})
+
+    def send(self) -> list:
+        events, self.events = self.events, []
+        if not events:
+            return []
+
+        return self.file_mgr._message_send_batch(events)
+
+
 
 #########################################################################
 def get_geid():
     '''
     get geid
     '''
-    url = ConfigClass.COMMON_SERVICE + "utility/id"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()['result']
-    else:
-        raise Exception('get_geid {}: {}'.format(response.status_code, url))
+    # the geid is taken from the prefetched pool(or generated locally)
+    return allocate_geid()
@@ -22,6 +22,8 @@ from ..config import ConfigClass
 from ..commons.logger_services.logger_factory_service import SrvLoggerFactory
 from ..commons.service_connection.minio_client import Minio_Client
 from ..commons.service_connection.dataset_policy_template import create_dataset_policy_template
+from ..commons.service_connection.http_client import get_async_client, NEO4J
+from ..resources.geid_allocator import allocate_geid
 from app.models.schema_sql import DatasetSchemaTemplate, DatasetSchema
 from minio.sseconfig import Rule, SSEConfig
 from fastapi_sqlalchemy import db
@@ -125,6 +127,22 @@ class SrvDatasetMgr():
         response = requests.post(node_query_url, json=payload)
         return response
 
+    async def get_bygeid_async(self, geid):
+        payload = {
+            "global_entity_id": geid
+        }
+        node_query_url = ConfigClass.NEO4J_SERVICE + "nodes/Dataset/query"
+        response = await get_async_client(NEO4J).post(node_query_url, json=payload)
+        return response
+
+    async def get_bycode_async(self, code):
+        payload = {
+            "code": code
+        }
+        node_query_url = ConfigClass.NEO4J_SERVICE + "nodes/Dataset/query"
+        response = await get_async_client(NEO4J).post(node_query_url, json=payload)
+        return response
+
 
     def __create_atlas_node(self, geid, username):
         res = create_atlas_dataset(geid, username)
@@ -183,12 +201,8 @@ def get_geid():
     '''
     get geid
     '''
-    url = ConfigClass.COMMON_SERVICE + "utility/id"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()['result']
-    else:
-        raise Exception('get_geid {}: {}'.format(response.status_code, url))
+    # the geid is taken from the prefetched pool(or generated locally)
+    return allocate_geid()
 
 
 def http_post_node(node_dict: dict, geid=None):
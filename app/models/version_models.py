@@ -38,4 +38,8 @@ class VersionRequest(BaseModel):
 
 class VersionListRequest(PaginationRequest):
     sorting: str = "created_at"
-    
+
+class VersionManifestRequest(PaginationRequest):
+    version: str = ""
+    path: str = ""
+    sorting: str = "path"
@@ -19,7 +19,7 @@
 # 
 
 from fastapi_sqlalchemy import db
-from sqlalchemy import Column, String, Date, DateTime, Integer, Boolean, ForeignKey
+from sqlalchemy import Column, String, Date, DateTime, Integer, BigInteger, Boolean, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from app.config import ConfigClass
 
@@ -57,3 +57,43 @@ class DatasetVersion(Base):
         return result
 
 
+class DatasetVersionManifest(Base):
+    '''
+    the files in the version archive, used to diff with the next version
+    and to locate single member in the archive(header_offset/compress_size
+    of the member in zip)
+    '''
+    __tablename__ = 'dataset_version_manifest'
+    __table_args__ = {"schema":ConfigClass.RDS_SCHEMA_DEFAULT}
+    id = Column(Integer, unique=True, primary_key=True)
+    version_id = Column(Integer, ForeignKey(ConfigClass.RDS_SCHEMA_DEFAULT + ".dataset_version.id", \
+        ondelete="CASCADE"), index=True)
+    dataset_geid = Column(String())
+    path = Column(String())
+    size = Column(BigInteger())
+    etag = Column(String())
+    source_geid = Column(String())
+    header_offset = Column(BigInteger())
+    compress_size = Column(BigInteger())
+    compress_type = Column(Integer)
+
+    def __init__(self, version_id, dataset_geid, path, size, etag, source_geid=None, \
+        header_offset=None, compress_size=None, compress_type=None):
+        self.version_id = version_id
+        self.dataset_geid = dataset_geid
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.source_geid = source_geid
+        self.header_offset = header_offset
+        self.compress_size = compress_size
+        self.compress_type = compress_type
+
+    def to_dict(self):
+        # the columns are already str/int, the missing etag/source_geid
+        # is kept as null instead of "None"
+        result = {}
+        for field in ["id", "version_id", "dataset_geid", "path", "size", "etag", "source_geid", \
+                "header_offset", "compress_size", "compress_type"]:
+            result[field] = getattr(self, field)
+        return result
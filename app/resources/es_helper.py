@@ -18,8 +18,10 @@
 # permissions and limitations under the Licence.
 # 
 
+import json
 import requests
 from ..config import ConfigClass
+from ..commons.service_connection.http_client import get_async_client, ELASTIC_SEARCH
 from ..commons.logger_services.logger_factory_service import SrvLoggerFactory
 
 __logger = SrvLoggerFactory('es_helper').get_logger()
@@ -43,6 +45,32 @@ def insert_one_by_id(es_type, es_index, data, id):
     return res.json()
 
 
+def bulk_create(es_index, docs):
+    '''
+    Summary:
+        index the documents with one _bulk request. The op_type is create
+        so the document already exists(same id) is skipped by elastic
+        search with 409 instead of overwritten
+    Parameter:
+        - es_index: the index name
+        - docs: list of tuple(<id>, <document>)
+    Return:
+        the _bulk response
+    '''
+    url = ConfigClass.ELASTIC_SEARCH_SERVICE + '{}/_bulk'.format(es_index)
+    lines = []
+    for doc_id, doc in docs:
+        lines.append(json.dumps({"create": {"_id": doc_id}}))
+        lines.append(json.dumps(doc))
+    # the ndjson body must end with newline
+    data = "\n".join(lines) + "\n"
+
+    res = requests.post(url, data=data.encode("utf-8"),
+        headers={"Content-Type": "application/x-ndjson"})
+
+    return res.json()
+
+
 def get_one_by_id(es_index, es_type, id):
     url = ConfigClass.ELASTIC_SEARCH_SERVICE + \
         '{}/{}/{}'.format(es_index, es_type, id)
@@ -54,6 +82,24 @@ def get_one_by_id(es_index, es_type, id):
 
 def search(es_index, page, page_size, data, sort_by=None, sort_type=None):
     url = ConfigClass.ELASTIC_SEARCH_SERVICE + '{}/_search'.format(es_index)
+    search_params = build_search_params(page, page_size, data, sort_by, sort_type)
+    __logger.info("elastic search url: {}".format(url))
+    __logger.info("elastic search params: {}".format(str(search_params)))
+    res = requests.get(url, json=search_params)
+    return res.json()
+
+
+async def search_async(es_index, page, page_size, data, sort_by=None, sort_type=None):
+    url = ConfigClass.ELASTIC_SEARCH_SERVICE + '{}/_search'.format(es_index)
+    search_params = build_search_params(page, page_size, data, sort_by, sort_type)
+    __logger.info("elastic search url: {}".format(url))
+    __logger.info("elastic search params: {}".format(str(search_params)))
+    # httpx doesnot allow body in GET shortcut so use the request
+    res = await get_async_client(ELASTIC_SEARCH).request("GET", url, json=search_params)
+    return res.json()
+
+
+def build_search_params(page, page_size, data, sort_by=None, sort_type=None):
 
     search_fields = []
 
@@ -177,7 +223,4 @@ def search(es_index, page, page_size, data, sort_by=None, sort_type=None):
             {sort_by: sort_type}
         ]
     }
-    __logger.info("elastic search url: {}".format(url))
-    __logger.info("elastic search params: {}".format(str(search_params)))
-    res = requests.get(url, json=search_params)
-    return res.json()
+    return search_params
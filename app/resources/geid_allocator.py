@@ -0,0 +1,167 @@
+# Copyright 2022 Indoc Research
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+#
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+#
+
+import time
+import uuid
+import threading
+from collections import deque
+
+from app.config import ConfigClass
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.service_connection.http_client import get_session
+
+logger = SrvLoggerFactory('geid_allocator').get_logger()
+
+# where the geids come from
+SERVICE = "service"
+LOCAL = "local"
+
+
+def generate_local_geid() -> str:
+    '''
+    same format as the common service: <uuid4>-<timestamp>
+    '''
+    return str(uuid.uuid4()) + "-" + str(int(time.time()))
+
+
+class GeidAllocator:
+    '''
+    Hand out the geids from an in memory pool. The pool is filled with
+    blocks of ids from common service. When the pool is under the
+    watermark a background thread fetches next block, so the callers
+    only wait for the service when the pool is empty.
+    The timestamp in geid is when the service made it, so a prefetched
+    id is older than the node using it. The ids kept in pool longer than
+    GEID_POOL_MAX_AGE are dropped to bound the drift.
+    '''
+
+    def __init__(self, block_size:int, watermark:int):
+        self.block_size = block_size
+        self.watermark = watermark
+        # tuple(<fetch time>, <geid>) in the order of fetch
+        self.pool = deque()
+        self.mutex = threading.Lock()
+        self.refilling = False
+
+    def _fetch_block(self, number:int) -> list:
+        url = ConfigClass.COMMON_SERVICE + "utility/id/batch"
+        response = get_session().get(url, params={"number": number})
+        if response.status_code != 200:
+            raise Exception('get_geid {}: {}'.format(response.status_code, url))
+
+        return response.json()['result']
+
+    def _add(self, geids:list):
+        now = time.time()
+        self.pool.extend((now, x) for x in geids)
+
+    def _take(self, number:int) -> list:
+        expire = time.time() - ConfigClass.GEID_POOL_MAX_AGE
+        while self.pool and self.pool[0][0] < expire:
+            self.pool.popleft()
+
+        taken = []
+        while self.pool and len(taken) < number:
+            taken.append(self.pool.popleft())
+
+        return taken
+
+    def _refill(self):
+        try:
+            geids = self._fetch_block(self.block_size)
+            with self.mutex:
+                self._add(geids)
+        except Exception as e:
+            logger.error("Error when refill the geid pool: %s"%str(e))
+        finally:
+            self.refilling = False
+
+    def get_many(self, number:int) -> list:
+        '''
+        Summary:
+            take the number of geids from pool. If the pool is dry then
+            fetch from service directly
+        Parameter:
+            - number: how many geids
+        Return:
+            list of geid
+        '''
+        with self.mutex:
+            taken = self._take(number)
+        geids = [x[1] for x in taken]
+
+        if len(geids) < number:
+            need = number - len(geids)
+            try:
+                block = self._fetch_block(max(self.block_size, need))
+            except Exception as e:
+                # put the taken ids back to the head so they are not lost
+                with self.mutex:
+                    self.pool.extendleft(reversed(taken))
+                raise e
+            geids += block[:need]
+            with self.mutex:
+                self._add(block[need:])
+
+        with self.mutex:
+            if len(self.pool) < self.watermark and not self.refilling:
+                self.refilling = True
+                threading.Thread(target=self._refill, daemon=True).start()
+
+        return geids
+
+    def get(self) -> str:
+        return self.get_many(1)[0]
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_allocator() -> GeidAllocator:
+    global _allocator
+
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = GeidAllocator(ConfigClass.GEID_BLOCK_SIZE, ConfigClass.GEID_REFILL_WATERMARK)
+
+    return _allocator
+
+
+def allocate_geids(number:int) -> list:
+    '''
+    Summary:
+        return the number of new geids. With GEID_ALLOCATOR=local the ids
+        are generated in process in the same format, otherwise they are
+        taken from the pool prefetched from common service
+    Return:
+        list of geid
+    '''
+    if number <= 0:
+        return []
+    if ConfigClass.GEID_ALLOCATOR == LOCAL:
+        return [generate_local_geid() for _ in range(number)]
+
+    return get_allocator().get_many(number)
+
+
+def allocate_geid() -> str:
+    return allocate_geids(1)[0]
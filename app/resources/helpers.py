@@ -19,15 +19,12 @@
 # 
 
 from app.config import ConfigClass
+from app.resources.geid_allocator import allocate_geid
 import requests
 import time
 
 
 def get_geid():
-    url = ConfigClass.COMMON_SERVICE + "utility/id"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()['result']
-    else:
-        raise Exception('get_geid {}: {}'.format(response.status_code, url))
+    # the geid is taken from the prefetched pool(or generated locally)
+    return allocate_geid()
 
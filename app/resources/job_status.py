@@ -0,0 +1,181 @@
+# Copyright 2022 Indoc Research
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+#
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+#
+
+import time
+import uuid
+import threading
+
+from app.config import ConfigClass
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.service_connection.http_client import get_session
+
+logger = SrvLoggerFactory('job_status').get_logger()
+
+# kind of the buffered events
+CREATE = "create"
+UPDATE = "update"
+NOTIFY = "notify"
+
+
+class JobStatusPipeline:
+    '''
+    Send the job status writes and the socketio notifications of one
+    task(a batch file operation) from a background thread on a short
+    interval, so the file worker does not wait for each call:
+        - each event goes to the same api as the unbuffered mode and in
+            the order it was added
+        - of the transitions of same key in one flush only the first and
+            the last one are sent, the ones in between are skipped
+        - if a call failed, the rest of events are kept and retried by the
+            next flush. After JOB_STATUS_MAX_RETRIES failed flushes in a
+            row they are logged and dropped
+    '''
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.events = []
+        # the events left by the failed flush
+        self.pending = []
+        self.failures = 0
+        self.mutex = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, kind:str, key:str, body:dict):
+        '''
+        Parameter:
+            - kind: create/update/notify
+            - key: the job id or source geid, the events of same key
+                in one flush are coalesced
+            - body: the json for the task api or the queue message
+        '''
+        with self.mutex:
+            self.events.append((kind, key, body))
+
+    def _run(self):
+        while not self.stopped.wait(ConfigClass.JOB_STATUS_FLUSH_INTERVAL):
+            self.flush()
+
+    def _coalesce(self, events:list) -> list:
+        # keep the first and the last event of each key
+        first, last = {}, {}
+        for i, (kind, key, _) in enumerate(events):
+            first.setdefault((kind, key), i)
+            last[(kind, key)] = i
+
+        return [x for i, x in enumerate(events) if i in (first[x[:2]], last[x[:2]])]
+
+    def _send(self, kind:str, body:dict):
+        if kind == NOTIFY:
+            res = get_session().post(ConfigClass.QUEUE_SERVICE + "broker/pub", json=body)
+            if res.status_code != 200:
+                raise Exception('send_notification() {}: {}'.format(res.status_code, res.text))
+            return
+
+        task_url = ConfigClass.DATA_UTILITY_SERVICE + "tasks"
+        if kind == CREATE:
+            res = get_session().post(task_url, json=body)
+        else:
+            res = get_session().put(task_url, json=body)
+        if res.status_code != 200:
+            raise Exception('save redis error {}: {}'.format(res.status_code, res.text))
+
+    def flush(self) -> bool:
+        '''
+        Summary:
+            send the buffered events
+        Return:
+            False if some of events are kept for retry
+        '''
+        with self.mutex:
+            events, self.events = self.events, []
+        events = self._coalesce(self.pending + events)
+
+        for i, (kind, key, body) in enumerate(events):
+            try:
+                self._send(kind, body)
+            except Exception as e:
+                self.failures += 1
+                if self.failures <= ConfigClass.JOB_STATUS_MAX_RETRIES:
+                    logger.warning("Error when flush the job status of %s, retry later: %s"% \
+                        (self.task_id, str(e)))
+                    self.pending = events[i:]
+                    return False
+
+                logger.error("Drop %d job status events of %s after %d retries: %s"% \
+                    (len(events)-i, self.task_id, self.failures-1, str(e)))
+                break
+
+        self.pending = []
+        self.failures = 0
+        return True
+
+    def close(self):
+        '''
+        stop the interval flush and send everything left
+        '''
+        self.stopped.set()
+        self.thread.join()
+        while not self.flush():
+            time.sleep(ConfigClass.JOB_STATUS_FLUSH_INTERVAL)
+
+
+# {pipeline_id: JobStatusPipeline}
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def open_pipeline(task_id) -> str:
+    '''
+    Summary:
+        start buffering the job status of the task
+    Parameter:
+        - task_id: the task of batch file operation
+    Return:
+        the pipeline id. The task id can be shared by the jobs started
+        at the same second so the pipeline has its own unique id
+    '''
+    pipeline_id = uuid.uuid4().hex
+    pipeline = JobStatusPipeline(task_id)
+    with _pipelines_lock:
+        _pipelines[pipeline_id] = pipeline
+
+    return pipeline_id
+
+
+def get_pipeline(pipeline_id):
+    '''
+    return the pipeline by id, None if the task is not buffered
+    '''
+    if pipeline_id is None:
+        return None
+
+    return _pipelines.get(pipeline_id)
+
+
+def close_pipeline(pipeline_id):
+    if pipeline_id is None:
+        return
+
+    with _pipelines_lock:
+        pipeline = _pipelines.pop(pipeline_id, None)
+    if pipeline:
+        pipeline.close()
@@ -0,0 +1,413 @@
+# Copyright 2022 Indoc Research
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+#
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+#
+
+import threading
+from redis import Redis
+
+from app.config import ConfigClass
+from app.commons.service_connection.http_client import get_session
+from app.resources.lock_trie import PrefixLockTrie
+
+# the backends can be selected by RESOURCE_LOCK_BACKEND
+DATA_OPS = "dataops"
+LOCAL = "local"
+REDIS = "redis"
+
+
+def _batches(keys:list, batch_size:int):
+    for i in range(0, len(keys), batch_size):
+        yield keys[i:i+batch_size]
+
+
+class DataOpsLockBackend:
+    '''
+    the lock store in the data ops utility service
+    '''
+
+    def __init__(self):
+        self.url = ConfigClass.DATA_UTILITY_SERVICE_v2 + 'resource/lock/bulk'
+        self.batch_size = ConfigClass.RESOURCE_LOCK_BATCH_SIZE
+
+    def lock(self, groups:dict, on_locked=None):
+        '''
+        Summary:
+            lock the keys batch by batch. If one of batch failed the
+            locked batches will be released and the exception is raised
+        Parameter:
+            - groups: {<read/write>: [resource_key]}
+            - on_locked: optional callback(operation, keys) called after
+                each batch is locked, eg. to record it in the lease
+        '''
+        locked = {}
+        try:
+            for operation, keys in groups.items():
+                for batch in _batches(keys, self.batch_size):
+                    post_json = {
+                        "resource_keys": batch,
+                        "operation": operation
+                    }
+                    response = get_session().post(self.url, json=post_json)
+                    if response.status_code != 200:
+                        raise Exception("resource already in used: %s"%response.text)
+
+                    locked.setdefault(operation, []).extend(batch)
+                    if on_locked:
+                        on_locked(operation, batch)
+        except Exception as e:
+            self.unlock(locked)
+            raise e
+
+    def unlock(self, groups:dict) -> list:
+        '''
+        Summary:
+            unlock the keys batch by batch, keep going if some failed
+        Parameter:
+            - groups: {<read/write>: [resource_key]}
+        Return:
+            list of the pairs failed to unlock
+        '''
+        failed = []
+        for operation, keys in groups.items():
+            for batch in _batches(keys, self.batch_size):
+                post_json = {
+                    "resource_keys": batch,
+                    "operation": operation
+                }
+                try:
+                    response = get_session().delete(self.url, json=post_json)
+                    if response.status_code != 200:
+                        raise Exception(response.text)
+                except Exception as e:
+                    print("====== Error when unlock resources:", str(e))
+                    failed += [(x, operation) for x in batch]
+
+        return failed
+
+    def renew(self, groups:dict):
+        # the data ops lock has no expiry, the lease journal takes care of it
+        return
+
+
+class LocalLockBackend:
+    '''
+    In process lock store with the same semantics as data ops service:
+    many readers or one writer per key. Used for single node deployment
+    and the load test without the data ops service
+    '''
+
+    def __init__(self):
+        # {resource_key: [number of readers, number of writers]}
+        self.locks = {}
+        self.mutex = threading.Lock()
+        # in hierarchical mode the paths are kept in the prefix trie
+        self.trie = PrefixLockTrie() if ConfigClass.RESOURCE_LOCK_HIERARCHICAL else None
+
+    def _conflict(self, resource_key:str, operation:str) -> bool:
+        readers, writers = self.locks.get(resource_key, (0, 0))
+        if operation == "write":
+            return readers > 0 or writers > 0
+        return writers > 0
+
+    def _update(self, resource_key:str, operation:str, delta:int):
+        state = self.locks.setdefault(resource_key, [0, 0])
+        index = 1 if operation == "write" else 0
+        # never go below zero if the key is unlocked more than locked
+        state[index] = max(state[index] + delta, 0)
+        if state[0] == 0 and state[1] == 0:
+            del self.locks[resource_key]
+
+    def lock(self, groups:dict, on_locked=None):
+        if self.trie is not None:
+            if not self.trie.acquire([(x, op) for op, keys in groups.items() for x in keys]):
+                raise Exception("resource already in used by its parent or child path")
+            return
+
+        # take the keys one by one so the read and write on the same
+        # key in one request will also conflict with each other
+        with self.mutex:
+            acquired = []
+            for operation, keys in groups.items():
+                for resource_key in keys:
+                    if self._conflict(resource_key, operation):
+                        for x, op in acquired:
+                            self._update(x, op, -1)
+                        raise Exception("resource %s already in used"%resource_key)
+
+                    self._update(resource_key, operation, 1)
+                    acquired.append((resource_key, operation))
+
+    def unlock(self, groups:dict) -> list:
+        if self.trie is not None:
+            self.trie.release([(x, op) for op, keys in groups.items() for x in keys])
+            return []
+
+        with self.mutex:
+            for operation, keys in groups.items():
+                for resource_key in keys:
+                    if resource_key in self.locks:
+                        self._update(resource_key, operation, -1)
+
+        return []
+
+    def renew(self, groups:dict):
+        # the in process locks are gone with the process
+        return
+
+
+# KEYS: the lock keys, ARGV[1]: read/write, ARGV[2]: ttl in seconds
+# check all the keys first so the batch is all-or-nothing
+_REDIS_LOCK_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if ARGV[1] == 'write' then
+        if redis.call('EXISTS', key) == 1 then
+            return i
+        end
+    elseif tonumber(redis.call('HGET', key, 'w') or '0') > 0 then
+        return i
+    end
+end
+for i, key in ipairs(KEYS) do
+    if ARGV[1] == 'write' then
+        redis.call('HSET', key, 'w', 1)
+    else
+        redis.call('HINCRBY', key, 'r', 1)
+    end
+    redis.call('EXPIRE', key, ARGV[2])
+end
+return 0
+"""
+
+_REDIS_UNLOCK_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if ARGV[1] == 'write' then
+        redis.call('HDEL', key, 'w')
+    elseif redis.call('HINCRBY', key, 'r', -1) <= 0 then
+        redis.call('HDEL', key, 'r')
+    end
+    if redis.call('HLEN', key) == 0 then
+        redis.call('DEL', key)
+    end
+end
+return 0
+"""
+
+
+# the hierarchical version: each path in the tree is a hash with the
+# counters of its own locks(r/w) and the locks under it(sr/sw), same as
+# PrefixLockTrie but shared by all the workers. The ancestor keys are
+# derived from the path so the resource keys are passed in ARGV
+# ARGV[1]: read/write, ARGV[2]: ttl, ARGV[3]: key prefix, ARGV[4..]: resource keys
+_REDIS_TREE_COMMON = """
+local op, ttl, prefix = ARGV[1], ARGV[2], ARGV[3]
+local own, sub = 'r', 'sr'
+if op == 'write' then
+    own, sub = 'w', 'sw'
+end
+
+local function paths(resource_key)
+    local result, current = {}, nil
+    for part in string.gmatch(resource_key, '[^/]+') do
+        current = current and (current .. '/' .. part) or part
+        table.insert(result, prefix .. current)
+    end
+    return result
+end
+
+local function count(key, field)
+    return tonumber(redis.call('HGET', key, field) or '0')
+end
+
+local function conflict(path)
+    for j = 1, #path do
+        if count(path[j], 'w') > 0 or (op == 'write' and count(path[j], 'r') > 0) then
+            return true
+        end
+    end
+    local last = path[#path]
+    return count(last, 'sw') > 0 or (op == 'write' and count(last, 'sr') > 0)
+end
+
+local function update(path, delta)
+    -- release the path which is not locked, so the counters never go below zero
+    if delta < 0 and count(path[#path], own) <= 0 then
+        return
+    end
+    for j = 1, #path do
+        local field = sub
+        if j == #path then
+            field = own
+        end
+        if redis.call('HINCRBY', path[j], field, delta) <= 0 then
+            redis.call('HDEL', path[j], field)
+        end
+        if redis.call('HLEN', path[j]) == 0 then
+            redis.call('DEL', path[j])
+        elseif delta > 0 then
+            redis.call('EXPIRE', path[j], ttl)
+        end
+    end
+end
+"""
+
+# take the keys one by one so the keys in the same batch are also
+# checked against each other, roll back the batch on conflict
+_REDIS_TREE_LOCK_SCRIPT = _REDIS_TREE_COMMON + """
+local acquired = {}
+for i = 4, #ARGV do
+    local path = paths(ARGV[i])
+    if #path > 0 then
+        if conflict(path) then
+            for _, locked in ipairs(acquired) do
+                update(locked, -1)
+            end
+            return i - 3
+        end
+        update(path, 1)
+        table.insert(acquired, path)
+    end
+end
+return 0
+"""
+
+_REDIS_TREE_UNLOCK_SCRIPT = _REDIS_TREE_COMMON + """
+for i = 4, #ARGV do
+    local path = paths(ARGV[i])
+    if #path > 0 then
+        update(path, -1)
+    end
+end
+return 0
+"""
+
+
+def _ancestors(resource_key:str) -> list:
+    # the path itself and all its parent paths
+    parts = [x for x in resource_key.split("/") if x]
+    return ["/".join(parts[:i]) for i in range(1, len(parts)+1)]
+
+
+class RedisLockBackend:
+    '''
+    Lock store in redis so it can be shared by all the workers. Each
+    key is a hash of reader/writer counters with a TTL lease, so the
+    lock will be expired if the worker crashed and never unlock it
+    '''
+
+    prefix = "dataset_resource_lock:"
+    # the keys are released by TTL, the sweeper leaves them alone
+    self_expiring = True
+
+    def __init__(self):
+        self.client = Redis(
+            host=ConfigClass.REDIS_HOST,
+            port=ConfigClass.REDIS_PORT,
+            password=ConfigClass.REDIS_PASSWORD,
+            db=ConfigClass.REDIS_DB,
+        )
+        self.batch_size = ConfigClass.RESOURCE_LOCK_BATCH_SIZE
+        # the short TTL is only safe when the heartbeat keeps renewing the keys
+        self.ttl = ConfigClass.RESOURCE_LOCK_LEASE_TTL if ConfigClass.RESOURCE_LOCK_LEASE \
+            else ConfigClass.RESOURCE_LOCK_TTL
+        self.hierarchical = ConfigClass.RESOURCE_LOCK_HIERARCHICAL
+        if self.hierarchical:
+            self.lock_script = self.client.register_script(_REDIS_TREE_LOCK_SCRIPT)
+            self.unlock_script = self.client.register_script(_REDIS_TREE_UNLOCK_SCRIPT)
+        else:
+            self.lock_script = self.client.register_script(_REDIS_LOCK_SCRIPT)
+            self.unlock_script = self.client.register_script(_REDIS_UNLOCK_SCRIPT)
+
+    def _run(self, script, operation:str, batch:list, ttl:int=None):
+        if self.hierarchical:
+            return script(args=[operation, ttl or 0, self.prefix]+batch)
+        return script(keys=[self.prefix+x for x in batch], args=[operation]+([ttl] if ttl else []))
+
+    def lock(self, groups:dict, on_locked=None):
+        locked = {}
+        try:
+            for operation, keys in groups.items():
+                for batch in _batches(keys, self.batch_size):
+                    res = self._run(self.lock_script, operation, batch, ttl=self.ttl)
+                    if res:
+                        raise Exception("resource %s already in used"%batch[res-1])
+
+                    locked.setdefault(operation, []).extend(batch)
+                    if on_locked:
+                        on_locked(operation, batch)
+        except Exception as e:
+            self.unlock(locked)
+            raise e
+
+    def unlock(self, groups:dict) -> list:
+        failed = []
+        for operation, keys in groups.items():
+            for batch in _batches(keys, self.batch_size):
+                try:
+                    self._run(self.unlock_script, operation, batch)
+                except Exception as e:
+                    print("====== Error when unlock resources:", str(e))
+                    failed += [(x, operation) for x in batch]
+
+        return failed
+
+    def renew(self, groups:dict):
+        # extend the TTL of keys so the long running job keeps its locks
+        pipe = self.client.pipeline()
+        for keys in groups.values():
+            for resource_key in keys:
+                # the parent paths hold the sub counters of the key
+                paths = _ancestors(resource_key) if self.hierarchical else [resource_key]
+                for path in paths:
+                    pipe.expire(self.prefix+path, self.ttl)
+        pipe.execute()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_lock_backend():
+    '''
+    Summary:
+        return the lock backend selected by RESOURCE_LOCK_BACKEND
+        - dataops: the data ops utility service(default)
+        - local: in process lock, only for single process deployment
+        - redis: shared lock in redis with TTL lease
+        The hierarchical mode(RESOURCE_LOCK_HIERARCHICAL) is checked by
+        the lock store, the data ops service only knows the exact keys
+        so it cannot be used in this mode
+    '''
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if ConfigClass.RESOURCE_LOCK_HIERARCHICAL and ConfigClass.RESOURCE_LOCK_BACKEND == DATA_OPS:
+                    raise Exception("hierarchical resource lock needs the redis or local lock backend")
+                backends = {
+                    DATA_OPS: DataOpsLockBackend,
+                    LOCAL: LocalLockBackend,
+                    REDIS: RedisLockBackend,
+                }
+                backend_class = backends.get(ConfigClass.RESOURCE_LOCK_BACKEND)
+                if backend_class is None:
+                    raise Exception("Unknown lock backend %s"%ConfigClass.RESOURCE_LOCK_BACKEND)
+                _backend = backend_class()
+
+    return _backend
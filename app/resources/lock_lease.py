@@ -0,0 +1,212 @@
+# Copyright 2022 Indoc Research
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+#
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+#
+
+import json
+import time
+import uuid
+import threading
+from redis import Redis
+
+from app.config import ConfigClass
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.resources.lock_backends import get_lock_backend
+
+logger = SrvLoggerFactory('lock_lease').get_logger()
+
+# sorted set of <lease_id> scored by the expiry time
+_LEASES_KEY = "dataset_resource_lock:leases"
+# the lock groups held by the lease
+_LEASE_RECORD = "dataset_resource_lock:lease:{}"
+
+
+class LockLeaseManager:
+    '''
+    Keep the journal of the locks held by each job in redis. The process
+    holding the locks renews its leases by the heartbeat thread. If the
+    process is killed the leases will not be renewed, and the sweeper in
+    any of the workers will release the locks once the lease is expired
+    '''
+
+    def __init__(self):
+        self.client = Redis(
+            host=ConfigClass.REDIS_HOST,
+            port=ConfigClass.REDIS_PORT,
+            password=ConfigClass.REDIS_PASSWORD,
+            db=ConfigClass.REDIS_DB,
+        )
+        self.ttl = ConfigClass.RESOURCE_LOCK_LEASE_TTL
+        # the leases opened by this process {lease_id: groups}
+        self.held = {}
+        self.mutex = threading.Lock()
+        self.heartbeat = None
+
+    def open_lease(self) -> str:
+        '''
+        Summary:
+            open an empty lease before the locks are taken. The locked
+            batches are added by `add_locks` one by one, so the sweeper
+            only releases the keys really held by the job even the
+            process crashed in the middle
+        Return:
+            lease id
+        '''
+        lease_id = uuid.uuid4().hex
+        self.client.zadd(_LEASES_KEY, {lease_id: time.time()+self.ttl})
+
+        with self.mutex:
+            self.held[lease_id] = {}
+            self._start_heartbeat()
+
+        return lease_id
+
+    def add_locks(self, lease_id:str, operation:str, keys:list):
+        '''
+        Summary:
+            record the keys which have been locked under the lease
+        Parameter:
+            - lease_id: returned by open_lease
+            - operation: read/write
+            - keys: list of resource key
+        '''
+        self.client.rpush(_LEASE_RECORD.format(lease_id), json.dumps([operation, keys]))
+
+        with self.mutex:
+            if lease_id in self.held:
+                self.held[lease_id].setdefault(operation, []).extend(keys)
+
+    def _read_record(self, lease_id:str) -> dict:
+        groups = {}
+        for item in self.client.lrange(_LEASE_RECORD.format(lease_id), 0, -1):
+            operation, keys = json.loads(item)
+            groups.setdefault(operation, []).extend(keys)
+
+        return groups
+
+    def close_lease(self, lease_id:str) -> bool:
+        '''
+        Summary:
+            remove the lease from journal
+        Return:
+            False if the lease has been expired and claimed by sweeper
+            which means the locks were released already
+        '''
+        with self.mutex:
+            self.held.pop(lease_id, None)
+
+        claimed = self.client.zrem(_LEASES_KEY, lease_id)
+        self.client.delete(_LEASE_RECORD.format(lease_id))
+        if not claimed:
+            logger.warning("Lease %s has been released by sweeper"%lease_id)
+
+        return bool(claimed)
+
+    def renew(self, release_backend):
+        '''
+        extend all the leases held by this process
+        '''
+        with self.mutex:
+            held = dict(self.held)
+
+        now = time.time()
+        for lease_id, groups in held.items():
+            # the keys of expired lease may be taken by other job already,
+            # so it is not extended even the sweeper has not claimed it yet
+            current = self.client.zscore(_LEASES_KEY, lease_id)
+            # XX only update the existing one, the swept lease will not come back
+            if current is None or current < now or \
+                not self.client.zadd(_LEASES_KEY, {lease_id: now+self.ttl}, xx=True, ch=True):
+                logger.error("Lease %s has been expired before renewal"%lease_id)
+                continue
+            release_backend.renew(groups)
+
+    def sweep(self, release_backend) -> int:
+        '''
+        Summary:
+            release the locks of the expired leases. The lease is claimed
+            by ZREM first so only one of the sweepers will release it.
+            The keys of self expiring backend(redis) are gone by TTL with
+            the lease and may be held by another job now, they are not
+            unlocked since it would release the lock of that job
+        Return:
+            number of leases released
+        '''
+        swept = 0
+        expired = self.client.zrangebyscore(_LEASES_KEY, 0, time.time())
+        for lease_id in expired:
+            lease_id = lease_id.decode() if isinstance(lease_id, bytes) else lease_id
+            if not self.client.zrem(_LEASES_KEY, lease_id):
+                continue
+
+            failed = []
+            if not getattr(release_backend, "self_expiring", False):
+                failed = release_backend.unlock(self._read_record(lease_id))
+            self.client.delete(_LEASE_RECORD.format(lease_id))
+            logger.info("Released expired lease %s, failed keys: %s"%(lease_id, failed))
+            swept += 1
+
+        return swept
+
+    def _start_heartbeat(self):
+        if self.heartbeat and self.heartbeat.is_alive():
+            return
+
+        def beat():
+            while True:
+                time.sleep(ConfigClass.RESOURCE_LOCK_HEARTBEAT)
+                try:
+                    self.renew(get_lock_backend())
+                except Exception as e:
+                    logger.error("Error when renew the leases: %s"%str(e))
+
+        self.heartbeat = threading.Thread(target=beat, daemon=True)
+        self.heartbeat.start()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_lease_manager() -> LockLeaseManager:
+    global _manager
+
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = LockLeaseManager()
+
+    return _manager
+
+
+def start_lease_sweeper():
+    '''
+    start the background thread to release the locks of the crashed jobs
+    '''
+    def sweeper():
+        while True:
+            try:
+                get_lease_manager().sweep(get_lock_backend())
+            except Exception as e:
+                logger.error("Error when sweep the leases: %s"%str(e))
+            time.sleep(ConfigClass.RESOURCE_LOCK_SWEEP_INTERVAL)
+
+    thread = threading.Thread(target=sweeper, daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,133 @@
+# Copyright 2022 Indoc Research
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+#
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+#
+
+import threading
+
+
+class _TrieNode:
+    def __init__(self):
+        self.children = {}
+        # the locks on this exact path
+        self.readers = 0
+        self.writers = 0
+        # the locks on the paths under this node
+        self.sub_readers = 0
+        self.sub_writers = 0
+
+
+class PrefixLockTrie:
+    '''
+    In process trie of the locked paths. A lock on `bucket/a` covers
+    every path under it, so:
+        - a read lock conflicts with the write lock on any ancestor,
+            the path itself or any descendant
+        - a write lock conflicts with any lock on those paths
+    '''
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.mutex = threading.Lock()
+
+    @staticmethod
+    def _split(resource_key:str) -> list:
+        return [x for x in resource_key.split("/") if x]
+
+    def _conflict(self, parts:list, operation:str) -> bool:
+        node = self.root
+        for part in parts:
+            node = node.children.get(part)
+            # nothing locked on or under this path
+            if node is None:
+                return False
+            # ancestor or the path itself
+            if node.writers or (operation == "write" and node.readers):
+                return True
+
+        # the descendants of the path
+        if node.sub_writers or (operation == "write" and node.sub_readers):
+            return True
+
+        return False
+
+    def _update(self, parts:list, operation:str, delta:int):
+        node = self.root
+        path = [node]
+        for part in parts:
+            node = node.children.get(part) if delta < 0 else node.children.setdefault(part, _TrieNode())
+            # release the path which is not locked, nothing to do
+            if node is None:
+                return
+            path.append(node)
+
+        # same for the path with no lock of this operation, so the
+        # counters never go below zero
+        if delta < 0 and not (node.writers if operation == "write" else node.readers):
+            return
+
+        if operation == "write":
+            node.writers += delta
+        else:
+            node.readers += delta
+
+        # every ancestor keeps count of the locks under it
+        for parent in path[:-1]:
+            if operation == "write":
+                parent.sub_writers += delta
+            else:
+                parent.sub_readers += delta
+
+        # clean up the empty branch after release
+        if delta < 0:
+            for i in range(len(parts), 0, -1):
+                child = path[i]
+                if child.readers or child.writers or child.sub_readers or child.sub_writers:
+                    break
+                del path[i-1].children[parts[i-1]]
+
+    def acquire(self, lock_pairs:list) -> bool:
+        '''
+        Summary:
+            lock all the pairs or none of them
+        Parameter:
+            - lock_pairs: list of tuple(<resource_key>, <read/write>)
+        Return:
+            True if all the pairs are locked
+        '''
+        with self.mutex:
+            acquired = []
+            for resource_key, operation in lock_pairs:
+                parts = self._split(resource_key)
+                if self._conflict(parts, operation):
+                    for x, op in acquired:
+                        self._update(x, op, -1)
+                    return False
+
+                self._update(parts, operation, 1)
+                acquired.append((parts, operation))
+
+        return True
+
+    def release(self, lock_pairs:list):
+        '''
+        release the pairs locked by `acquire`
+        '''
+        with self.mutex:
+            for resource_key, operation in lock_pairs:
+                self._update(self._split(resource_key), operation, -1)
@@ -22,11 +22,17 @@ import requests
 from typing import Union
 
 from app.config import ConfigClass
-from app.resources.neo4j_helper import get_children_nodes
+from app.resources.tree_walker import get_subtree
+from app.resources.lock_backends import get_lock_backend, DATA_OPS, LOCAL
+from app.resources.lock_lease import get_lease_manager
 
 def lock_resource(resource_key:str, operation:str) -> dict:
     # operation can be either read or write
     print("====== Lock resource:", resource_key)
+    if ConfigClass.RESOURCE_LOCK_BACKEND != DATA_OPS:
+        get_lock_backend().lock({operation: [resource_key]})
+        return {"resource_key": resource_key, "operation": operation}
+
     url = ConfigClass.DATA_UTILITY_SERVICE_v2 + 'resource/lock'
     post_json = {
         "resource_key": resource_key,
@@ -43,6 +49,10 @@ def lock_resource(resource_key:str, operation:str) -> dict:
 def unlock_resource(resource_key:str, operation:str) -> dict:
     # operation can be either read or write
     print("====== Unlock resource:", resource_key)
+    if ConfigClass.RESOURCE_LOCK_BACKEND != DATA_OPS:
+        get_lock_backend().unlock({operation: [resource_key]})
+        return {"resource_key": resource_key, "operation": operation}
+
     url = ConfigClass.DATA_UTILITY_SERVICE_v2 + 'resource/lock'
     post_json = {
         "resource_key": resource_key,
@@ -56,9 +66,99 @@ def unlock_resource(resource_key:str, operation:str) -> dict:
     return response.json()
 
 
+def _group_by_operation(lock_pairs:list) -> dict:
+    # the bulk api takes one operation per call so group the keys
+    # by read/write. Also remove the duplicate key so the same tree
+    # will not be blocked by itself
+    groups, seen = {}, set()
+    for resource_key, operation in lock_pairs:
+        if (resource_key, operation) in seen:
+            continue
+        seen.add((resource_key, operation))
+        groups.setdefault(operation, []).append(resource_key)
+
+    return groups
+
+
+class LeasedLocks(list):
+    '''
+    the list of locked pairs with the lease id, so the unlock can
+    close the lease together
+    '''
+    lease_id = None
+
+
+def _use_lease() -> bool:
+    # the in process locks are gone with the process, no lease needed
+    return ConfigClass.RESOURCE_LOCK_LEASE and ConfigClass.RESOURCE_LOCK_BACKEND != LOCAL
+
+
+def bulk_lock_resource(lock_pairs:list) -> list:
+    '''
+    Summary:
+        lock a list of resources as all-or-nothing. The keys are sent to
+        the lock backend(RESOURCE_LOCK_BACKEND) in batches. If any of batch
+        failed, the batches which have been locked will be rolled back and
+        the exception is raised.
+        In hierarchical mode the lock store also checks the keys against
+        the locked parent/child paths.
+        With RESOURCE_LOCK_LEASE the locks are held by a lease which is
+        renewed by heartbeat, if the process is killed the sweeper will
+        release them after the lease expired
+    Parameter:
+        - lock_pairs: list of tuple(<resource_key>, <read/write>)
+    Return:
+        LeasedLocks: list of the locked pairs
+    '''
+    groups = _group_by_operation(lock_pairs)
+    pairs = [(x, operation) for operation, keys in groups.items() for x in keys]
+
+    locked_node = LeasedLocks(pairs)
+    on_locked = None
+    try:
+        # open the lease before lock and record each locked batch, so
+        # the crash in the middle will still be cleaned up by the sweeper
+        # and the sweeper will not release the keys never held
+        if _use_lease():
+            manager = get_lease_manager()
+            lease_id = locked_node.lease_id = manager.open_lease()
+            on_locked = lambda operation, keys: manager.add_locks(lease_id, operation, keys)
+
+        # the backend will rollback the partial acquisition itself
+        get_lock_backend().lock(groups, on_locked=on_locked)
+    except Exception as e:
+        if locked_node.lease_id:
+            get_lease_manager().close_lease(locked_node.lease_id)
+        raise e
+
+    return locked_node
+
+
+def bulk_unlock_resource(lock_pairs:list) -> list:
+    '''
+    Summary:
+        unlock a list of resources in batches. The function will try
+        all the batches even some of them failed, so one bad key will
+        not keep the rest of tree locked
+    Parameter:
+        - lock_pairs: list of tuple(<resource_key>, <read/write>) returned
+            by bulk_lock_resource
+    Return:
+        list of the pairs failed to unlock
+    '''
+    groups = _group_by_operation(lock_pairs)
+
+    lease_id = getattr(lock_pairs, "lease_id", None)
+    if lease_id and not get_lease_manager().close_lease(lease_id):
+        # the lease was expired and the locks were released by sweeper
+        return []
+
+    return get_lock_backend().unlock(groups)
+
+
 
 # TODO somehow do the factory here?
-def recursive_lock(code:str, nodes, root_path, new_name:str=None) -> Union[list, Exception]:
+def recursive_lock(code:str, nodes, root_path, new_name:str=None, tree=None) -> Union[list, Exception]:
     locked_node, err = [], None
 
     def recur_walker(currenct_nodes, current_root_path, new_name=None):
@@ -78,13 +178,16 @@ def recursive_lock(code:str, nodes, root_path, new_name:str=None) -> Union[list,
             # open the next recursive loop if it is folder
             if 'Folder' in ff_object.get("labels"):
                 next_root = current_root_path+"/"+(new_name if new_name else ff_object.get("name"))
-                children_nodes = get_children_nodes(ff_object.get("global_entity_id", None))
+                children_nodes = tree.get_children(ff_object.get("global_entity_id", None))
                 recur_walker(children_nodes, next_root)
 
         return
 
     # start here
     try:
+        # fetch the whole tree once if caller doesnot provide it
+        if tree is None:
+            tree = get_subtree(nodes)
         recur_walker(nodes, root_path, new_name)
     except Exception as e:
         err = e
@@ -228,7 +331,7 @@ class lock_factory:
 
 
 
-def recursive_lock_import(dataset_code, nodes, root_path):
+def recursive_lock_import(dataset_code, nodes, root_path, tree=None):
     '''
     the function will recursively lock the node tree OR
     unlock the tree base on the parameter.
@@ -241,6 +344,8 @@ def recursive_lock_import(dataset_code, nodes, root_path):
     # case will be copy the same node, if we unlock the whole tree in exception
     # then it will affect the processing one.
     locked_node, err = [], None
+    lock_pairs = []
+    hierarchical = ConfigClass.RESOURCE_LOCK_HIERARCHICAL
 
     def recur_walker(currenct_nodes, current_root_path, new_name=None):
         '''
@@ -266,39 +371,46 @@ def recursive_lock_import(dataset_code, nodes, root_path):
                         ff_object.get('name'))
                 # source is from project 
                 source_key = "{}/{}".format(bucket, minio_obj_path)
-                lock_resource(source_key, "read")
-                locked_node.append((source_key, "read"))
+                lock_pairs.append((source_key, "read"))
 
                 # destination is in the dataset
                 target_key = "{}/{}/{}".format(dataset_code, current_root_path, 
                     new_name if new_name else ff_object.get("name"))
-                lock_resource(target_key, "write")
-                locked_node.append((target_key,"write"))
+                lock_pairs.append((target_key, "write"))
 
             # open the next recursive loop if it is folder
-            if 'Folder' in ff_object.get("labels"):
+            # in hierarchical mode the lock of folder already covers its children
+            if 'Folder' in ff_object.get("labels") and not \
+                (hierarchical and ff_object.get("display_path") != ff_object.get("uploader")):
                 next_root = current_root_path+"/"+(new_name if new_name else ff_object.get("name"))
-                children_nodes = get_children_nodes(ff_object.get("global_entity_id", None))
+                children_nodes = tree.get_children(ff_object.get("global_entity_id", None))
                 recur_walker(children_nodes, next_root)
 
         return
 
     # start here
     try:
+        # fetch the whole tree once if caller doesnot provide it
+        if tree is None:
+            tree = get_subtree(nodes)
         recur_walker(nodes, root_path)
+        # lock all the collected keys in one go
+        locked_node = bulk_lock_resource(lock_pairs)
     except Exception as e:
         err = e
 
     return locked_node, err
 
 
-def recursive_lock_delete(nodes, new_name=None):
+def recursive_lock_delete(nodes, new_name=None, tree=None):
  
     # this is for crash recovery, if something trigger the exception
     # we will unlock the locked node only. NOT the whole tree. The example
     # case will be copy the same node, if we unlock the whole tree in exception
     # then it will affect the processing one.
     locked_node, err = [], None
+    lock_pairs = []
+    hierarchical = ConfigClass.RESOURCE_LOCK_HIERARCHICAL
 
     def recur_walker(currenct_nodes, new_name=None):
         '''
@@ -324,33 +436,41 @@ def recursive_lock_delete(nodes, new_name=None):
                         ff_object.get('name'))
 
                 source_key = "{}/{}".format(bucket, minio_obj_path)
-                lock_resource(source_key, "write")
-                locked_node.append((source_key, "write"))
+                lock_pairs.append((source_key, "write"))
 
             # open the next recursive loop if it is folder
-            if 'Folder' in ff_object.get("labels"):
+            # in hierarchical mode the lock of folder already covers its children
+            if 'Folder' in ff_object.get("labels") and not \
+                (hierarchical and ff_object.get("display_path") != ff_object.get("uploader")):
                 # next_root = current_root_path+"/"+(new_name if new_name else ff_object.get("name"))
-                children_nodes = get_children_nodes(ff_object.get("global_entity_id", None))
+                children_nodes = tree.get_children(ff_object.get("global_entity_id", None))
                 recur_walker(children_nodes)
 
         return
 
     # start here
     try:
+        # fetch the whole tree once if caller doesnot provide it
+        if tree is None:
+            tree = get_subtree(nodes)
         recur_walker(nodes, new_name)
+        # lock all the collected keys in one go
+        locked_node = bulk_lock_resource(lock_pairs)
     except Exception as e:
         err = e
 
     return locked_node, err
 
 
-def recursive_lock_move_rename(nodes, root_path, new_name=None):
+def recursive_lock_move_rename(nodes, root_path, new_name=None, tree=None):
     
     # this is for crash recovery, if something trigger the exception
     # we will unlock the locked node only. NOT the whole tree. The example
     # case will be copy the same node, if we unlock the whole tree in exception
     # then it will affect the processing one.
     locked_node, err = [], None
+    lock_pairs = []
+    hierarchical = ConfigClass.RESOURCE_LOCK_HIERARCHICAL
 
     # TODO lock 
 
@@ -377,38 +497,45 @@ def recursive_lock_move_rename(nodes, root_path, new_name=None):
                     minio_obj_path = "%s/%s"%(ff_object.get('folder_relative_path'), 
                         ff_object.get('name'))
                 source_key = "{}/{}".format(bucket, minio_obj_path)
-                lock_resource(source_key, "write")
-                locked_node.append((source_key, "write"))
+                lock_pairs.append((source_key, "write"))
 
                 target_key = "{}/{}/{}".format(bucket, current_root_path, 
                     new_name if new_name else ff_object.get("name"))
-                lock_resource(target_key, "write")
-                locked_node.append((target_key,"write"))
+                lock_pairs.append((target_key, "write"))
 
             # open the next recursive loop if it is folder
-            if 'Folder' in ff_object.get("labels"):
+            # in hierarchical mode the lock of folder already covers its children
+            if 'Folder' in ff_object.get("labels") and not \
+                (hierarchical and ff_object.get("display_path") != ff_object.get("uploader")):
                 next_root = current_root_path+"/"+(new_name if new_name else ff_object.get("name"))
-                children_nodes = get_children_nodes(ff_object.get("global_entity_id", None))
+                children_nodes = tree.get_children(ff_object.get("global_entity_id", None))
                 recur_walker(children_nodes, next_root)
 
         return
 
     # start here
     try:
+        # fetch the whole tree once if caller doesnot provide it
+        if tree is None:
+            tree = get_subtree(nodes)
         recur_walker(nodes, root_path, new_name)
+        # lock all the collected keys in one go
+        locked_node = bulk_lock_resource(lock_pairs)
     except Exception as e:
         err = e
 
     return locked_node, err
 
 
-def recursive_lock_publish(nodes):
+def recursive_lock_publish(nodes, tree=None, dataset_code=None):
     
     # this is for crash recovery, if something trigger the exception
     # we will unlock the locked node only. NOT the whole tree. The example
     # case will be copy the same node, if we unlock the whole tree in exception
     # then it will affect the processing one.
     locked_node, err = [], None
+    lock_pairs = []
+    hierarchical = ConfigClass.RESOURCE_LOCK_HIERARCHICAL
 
     def recur_walker(currenct_nodes):
         '''
@@ -434,20 +561,30 @@ def recursive_lock_publish(nodes):
                         ff_object.get('name'))
 
                 source_key = "{}/{}".format(bucket, minio_obj_path)
-                lock_resource(source_key, "read")
-                locked_node.append((source_key, "read"))
+                lock_pairs.append((source_key, "read"))
 
             # open the next recursive loop if it is folder
-            if 'Folder' in ff_object.get("labels"):
+            # in hierarchical mode the lock of folder already covers its children
+            if 'Folder' in ff_object.get("labels") and not \
+                (hierarchical and ff_object.get("display_path") != ff_object.get("uploader")):
                 # next_root = current_root_path+"/"+(new_name if new_name else ff_object.get("name"))
-                children_nodes = get_children_nodes(ff_object.get("global_entity_id", None))
+                children_nodes = tree.get_children(ff_object.get("global_entity_id", None))
                 recur_walker(children_nodes)
 
         return
 
     # start here
     try:
-        recur_walker(nodes)
+        # in hierarchical mode one read lock on the dataset covers all the files
+        if hierarchical and dataset_code:
+            lock_pairs.append((dataset_code, "read"))
+        else:
+            # fetch the whole tree once if caller doesnot provide it
+            if tree is None:
+                tree = get_subtree(nodes)
+            recur_walker(nodes)
+        # lock all the collected keys in one go
+        locked_node = bulk_lock_resource(lock_pairs)
     except Exception as e:
         err = e
 
@@ -18,52 +18,99 @@
 # permissions and limitations under the Licence.
 # 
 
-import requests
 from app.resources.error_handler import APIException
 from app.models.base_models import EAPIResponseCode
 
 from ..commons.logger_services.logger_factory_service import SrvLoggerFactory
-from ..commons.service_connection.minio_client import Minio_Client_
+from ..commons.service_connection.minio_client import get_minio_client
+from ..commons.service_connection.http_client import get_async_client, get_session, NEO4J
+from .geid_allocator import allocate_geid, allocate_geids
 
 from ..config import ConfigClass
 
 logger = SrvLoggerFactory('api_dataset_import').get_logger()
 
 
+_NODE_API = "neo4j node API"
+_RELATION_API = "neo4j relation query API"
+
+
+class Neo4jCall:
+    '''
+    Summary:
+        one request to the neo4j service. The sync and async helpers
+        are built from the same call so the payload and the parsing
+        only live in one place.
+    Parameter:
+        - method: http method
+        - url: full url of neo4j api
+        - kwargs: the json/params passed to the request
+        - api_name: used in the error message
+        - parse: function to turn the response into the return value
+        - check: if False, the status code is not checked and the
+            exception is not wrapped(the legacy helpers)
+        - check_status: if False, only the exception is wrapped and the
+            response of any status is parsed
+    '''
+    def __init__(self, method, path, api_name, parse=None, check=True, check_status=True, **kwargs):
+        self.method = method
+        self.url = ConfigClass.NEO4J_SERVICE + path
+        self.kwargs = kwargs
+        self.api_name = api_name
+        self.parse = parse or (lambda response: response.json())
+        self.check = check
+        self.check_status = check_status
+
+    def handle(self, response):
+        if not self.check:
+            return self.parse(response)
+        try:
+            if self.check_status and response.status_code != 200:
+                raise APIException(
+                    error_msg=f"Error calling {self.api_name}: {response.text}",
+                    status_code=response.status_code
+                )
+            return self.parse(response)
+        except Exception as e:
+            raise self.error(e)
 
-def create_relation(label, payload):
-    try:
-        response = requests.post(ConfigClass.NEO4J_SERVICE + "relations/own", json=payload)
-        if response.status_code != 200:
-            raise APIException(
-                error_msg=f"Error calling neo4j node API: {response.json()}", 
-                status_code=response.status_code
-            )
-    except Exception as e:
-        raise APIException(
-            error_msg=f"Error calling neo4j node API: {str(e)}", 
+    def error(self, e):
+        return APIException(
+            error_msg=f"Error calling {self.api_name}: {str(e)}",
             status_code=EAPIResponseCode.internal_error.value
         )
-    return response.json()
 
-def create_node(label, payload):
+
+def _call(call: Neo4jCall):
     try:
-        response = requests.post(ConfigClass.NEO4J_SERVICE + f"nodes/{label}", json=payload)
-        if response.status_code != 200:
-            raise APIException(
-                error_msg=f"Error calling neo4j node API: {response.json()}", 
-                status_code=response.status_code
-            )
-        created_node = response.json()[0]
+        response = get_session().request(call.method, call.url, **call.kwargs)
     except Exception as e:
-        raise APIException(
-            error_msg=f"Error calling neo4j node API: {str(e)}", 
-            status_code=EAPIResponseCode.internal_error.value
-        )
-    return created_node
+        if not call.check:
+            raise
+        raise call.error(e)
+    return call.handle(response)
 
 
-def query_relation(relation_label, start_label, end_label, start_params={}, end_params={}):
+async def _call_async(call: Neo4jCall):
+    try:
+        response = await get_async_client(NEO4J).request(call.method, call.url, **call.kwargs)
+    except Exception as e:
+        if not call.check:
+            raise
+        raise call.error(e)
+    return call.handle(response)
+
+
+def _create_relation_call(label, payload):
+    return Neo4jCall("POST", "relations/own", _NODE_API, json=payload)
+
+
+def _create_node_call(label, payload):
+    return Neo4jCall("POST", f"nodes/{label}", _NODE_API,
+        parse=lambda response: response.json()[0], json=payload)
+
+
+def _query_relation_call(relation_label, start_label, end_label, start_params, end_params):
     payload = {
         "label": relation_label,
         "start_label": start_label,
@@ -71,71 +118,167 @@ def query_relation(relation_label, start_label, end_label, start_params={}, end_
         "end_label": end_label,
         "end_params": end_params,
     }
-    try:
-        response = requests.post(ConfigClass.NEO4J_SERVICE + "relations/query", json=payload)
-        if response.status_code != 200:
-            raise APIException(
-                error_msg=f"Error calling neo4j relation query API: {response.json()}", 
-                status_code=response.status_code
-            )
-    except Exception as e:
-        raise APIException(
-            error_msg=f"Error calling neo4j relation query API: {str(e)}", 
-            status_code=EAPIResponseCode.internal_error.value
-        )
-    return response.json()
-
-def get_node_by_geid(geid, label: str = None):
-    try:
-        response = None
-        # since we have new api to directly fetch by label
-        if label:
-            payload = {
-                'global_entity_id': geid,
-            }
-            node_query_url = ConfigClass.NEO4J_SERVICE + "nodes/%s/query"%(label)
-            response = requests.post(node_query_url, json=payload)
-        else:
-            node_query_url = ConfigClass.NEO4J_SERVICE + "nodes/geid/%s"%(geid)
-            response = requests.get(node_query_url)
-
-        # here if we dont find any node then return None
-        if len(response.json()) == 0:
-            return None
-
-        return response.json()[0]
-    except Exception as e:
-        raise APIException(f"Error calling neo4j API: {str(e)}", EAPIResponseCode.internal_error.value)
-
-
-def get_parent_node(current_node):
+    return Neo4jCall("POST", "relations/query", _RELATION_API, json=payload)
+
+
+def _get_node_by_geid_call(geid, label):
+    # here if we dont find any node then return None
+    def parse(response):
+        nodes = response.json()
+        return nodes[0] if len(nodes) else None
+
+    # the status is not checked, the empty result of any status is None
+    # since we have new api to directly fetch by label
+    if label:
+        return Neo4jCall("POST", "nodes/%s/query"%(label), "neo4j API", parse=parse,
+            check_status=False, json={'global_entity_id': geid})
+    return Neo4jCall("GET", "nodes/geid/%s"%(geid), "neo4j API", parse=parse, check_status=False)
+
+
+def _get_nodes_by_geids_calls(geids):
+    batch_size = ConfigClass.NEO4J_BATCH_SIZE
+    # the same geid is only queried once
+    geids = list(dict.fromkeys(geids))
+    return [
+        Neo4jCall("POST", "nodes/query/geids", "neo4j API",
+            parse=lambda response: response.json().get("result", []),
+            json={"geids": geids[i:i+batch_size]})
+        for i in range(0, len(geids), batch_size)
+    ]
+
+
+def _get_connected_geids_calls(root_geid, root_label, geids):
+    batch_size = ConfigClass.NEO4J_BATCH_SIZE
+    geids = list(dict.fromkeys(geids))
+    return [
+        Neo4jCall("POST", "relations/query", _RELATION_API,
+            parse=lambda response: [x.get("end_node", {}).get("global_entity_id") for x in response.json()],
+            json={
+                "label": "own*",
+                "start_label": root_label,
+                "start_params": {"global_entity_id": root_geid},
+                "end_params": {"global_entity_id": geids[i:i+batch_size]}
+            })
+        for i in range(0, len(geids), batch_size)
+    ]
+
+
+def _get_parent_node_call(current_node):
     # here we have to find the parent node and delete the relationship
-    relation_query_url = ConfigClass.NEO4J_SERVICE + "relations/query"
     query_payload = {
         "label": "own",
         "end_label": current_node.get("labels")[0],
         "end_params": {"id":current_node.get("id")}
     }
-    response = requests.post(relation_query_url, json=query_payload)
-    # print(response.json()[0])
-    parent_node_id = response.json()[0].get("start_node")
-
-    return parent_node_id
+    return Neo4jCall("POST", "relations/query", _RELATION_API, check=False,
+        parse=lambda response: response.json()[0].get("start_node"), json=query_payload)
 
 
-def get_children_nodes(start_geid, start_label="Folder"):
-
+def _get_children_nodes_call(start_geid, start_label):
     payload = {
         "label": "own",
         "start_label": start_label,
         "start_params": {"global_entity_id":start_geid},
     }
+    return Neo4jCall("POST", "relations/query", _RELATION_API, check=False,
+        parse=lambda response: [x.get("end_node") for x in response.json()], json=payload)
+
+
+def _get_children_nodes_batch_calls(start_geids, start_label):
+    batch_size = ConfigClass.NEO4J_BATCH_SIZE
+    # each call returns the list of tuple(<parent geid>, <child node>)
+    return [
+        Neo4jCall("POST", "relations/query", _RELATION_API,
+            parse=lambda response: [(x.get("start_node", {}).get("global_entity_id"), x.get("end_node")) \
+                for x in response.json()],
+            json={
+                "label": "own",
+                "start_label": start_label,
+                "start_params": {"global_entity_id": start_geids[i:i+batch_size]},
+            })
+        for i in range(0, len(start_geids), batch_size)
+    ]
+
+
+def create_relation(label, payload):
+    return _call(_create_relation_call(label, payload))
+
+def create_node(label, payload):
+    return _call(_create_node_call(label, payload))
+
+
+def query_relation(relation_label, start_label, end_label, start_params={}, end_params={}):
+    return _call(_query_relation_call(relation_label, start_label, end_label, start_params, end_params))
+
+def get_node_by_geid(geid, label: str = None):
+    return _call(_get_node_by_geid_call(geid, label))
+
+
+def get_nodes_by_geids(geids: list) -> list:
+    '''
+    Summary:
+        fetch the nodes by list of geid. The query will be chunked
+        by NEO4J_BATCH_SIZE so the number of calls does not grow with
+        each geid.
+    Parameter:
+        - geids: list of global_entity_id
+    Return:
+        list of found nodes, missing geid will be ignored and the
+        duplicate geid is only returned once
+    '''
+    nodes = []
+    for call in _get_nodes_by_geids_calls(geids):
+        nodes += _call(call)
+
+    return nodes
+
+
+def get_connected_geids(root_geid: str, root_label: str, geids: list) -> set:
+    '''
+    Summary:
+        check which of the geids are under the root node by any
+        depth of "own" relationship. Same as the per node "own*"
+        query, but all geids are sent in one query(per chunk).
+    Parameter:
+        - root_geid: the geid of root node(Dataset/Container/Folder)
+        - root_label: label of the root node
+        - geids: list of global_entity_id to check
+    Return:
+        set of geid which is connected to the root
+    '''
+    connected = set()
+    for call in _get_connected_geids_calls(root_geid, root_label, geids):
+        connected.update(_call(call))
+
+    return connected
+
+
+def get_parent_node(current_node):
+    return _call(_get_parent_node_call(current_node))
+
+
+def get_children_nodes(start_geid, start_label="Folder"):
+    return _call(_get_children_nodes_call(start_geid, start_label))
 
-    node_query_url = ConfigClass.NEO4J_SERVICE + "relations/query"
-    response = requests.post(node_query_url, json=payload)
-    ffs = [x.get("end_node") for x in response.json()]
 
-    return ffs
+def get_children_nodes_batch(start_geids: list, start_label="Folder") -> dict:
+    '''
+    Summary:
+        fetch the direct children of multiple nodes in one relation query
+        (chunked by NEO4J_BATCH_SIZE) instead of one query per node.
+    Parameter:
+        - start_geids: list of parent geid
+        - start_label: label of the parent nodes
+    Return:
+        dict of {parent_geid: [child nodes]}, the parent without child
+        will not be in the dict
+    '''
+    children = {}
+    for call in _get_children_nodes_batch_calls(start_geids, start_label):
+        for parent_geid, child in _call(call):
+            children.setdefault(parent_geid, []).append(child)
+
+    return children
 
 
 def delete_relation_bw_nodes(start_id, end_id):
@@ -145,26 +288,33 @@ def delete_relation_bw_nodes(start_id, end_id):
         "start_id": start_id,
         "end_id": end_id,
     }
-    response = requests.delete(relation_delete_url, params=delete_params)
+    response = get_session().delete(relation_delete_url, params=delete_params)
     return response
 
 
-def delete_node(target_node, access_token, refresh_token):
+def delete_node(target_node, access_token, refresh_token, object_keys=None):
+    '''
+    delete the node. if object_keys is given the minio object of file
+    is added into it and the caller will remove them in batch
+    '''
 
     node_label = target_node.get('labels')[0]
     node_id = target_node.get('id')
     node_delete_url = ConfigClass.NEO4J_SERVICE + "nodes/%s/node/%s"%(node_label, node_id)
-    response = requests.delete(node_delete_url)
+    response = get_session().delete(node_delete_url)
 
     # delete the file in minio if it is the file
     if node_label == "File":
         try:
-            mc = Minio_Client_(access_token, refresh_token)
-
             # minio location is minio://http://<end_point>/bucket/user/object_path
             minio_path = target_node.get('location').split("//")[-1]
             _, bucket, obj_path = tuple(minio_path.split("/", 2))
 
+            if object_keys is not None:
+                object_keys.append((bucket, obj_path))
+                return
+
+            mc = get_minio_client(access_token, refresh_token)
             mc.delete_object(bucket, obj_path)
             logger.info("Minio %s/%s Delete Success"%(bucket, obj_path))
 
@@ -172,11 +322,10 @@ def delete_node(target_node, access_token, refresh_token):
             logger.error("error when deleting: "+str(e))
 
 
-def create_file_node(dataset_code, source_file, operator, parent_id, relative_path, \
-    access_token, refresh_token, new_name=None):
-
-    # fecth the geid from common service
-    geid = requests.get(ConfigClass.COMMON_SERVICE+"utility/id").json().get("result")
+def build_file_attribute(dataset_code, source_file, operator, relative_path, geid, new_name=None):
+    '''
+    the attribute of the copied file node under the dataset
+    '''
     file_name = new_name if new_name else source_file.get("name")
     # generate minio object path
     fuf_path = relative_path+"/"+file_name
@@ -184,8 +333,7 @@ def create_file_node(dataset_code, source_file, operator, parent_id, relative_pa
     minio_http = ("https://" if ConfigClass.MINIO_HTTPS else "http://") + ConfigClass.MINIO_ENDPOINT
     location = "minio://%s/%s/%s"%(minio_http, dataset_code, fuf_path)
 
-    # then copy the node under the dataset
-    file_attribute = {
+    return {
         "file_size": source_file.get("file_size", -1), # if the folder then it is -1
         "operator": operator,
         "name": file_name,
@@ -195,16 +343,53 @@ def create_file_node(dataset_code, source_file, operator, parent_id, relative_pa
         "display_path": fuf_path,
     }
 
+
+def build_folder_attribute(dataset_code, source_folder, operator, parent_node, relative_path, \
+    geid, new_name=None):
+    '''
+    the attribute of the copied folder node under the dataset
+    '''
+    folder_name = new_name if new_name else source_folder.get("name")
+
+    return {
+        "create_by": operator,
+        "name": folder_name,
+        "global_entity_id": geid,
+        "folder_relative_path": relative_path,
+        "folder_level": parent_node.get("folder_level", -1)+1,
+        "dataset_code": dataset_code,
+        "display_path": relative_path+"/"+folder_name,
+    }
+
+
+def create_file_node(dataset_code, source_file, operator, parent_id, relative_path, \
+    access_token, refresh_token, new_name=None, copy_pool=None):
+
+    # take the geid from allocator
+    geid = allocate_geid()
+
+    # then copy the node under the dataset
+    file_attribute = build_file_attribute(dataset_code, source_file, operator, relative_path, \
+        geid, new_name)
+    fuf_path = file_attribute.get("display_path")
+
     new_file_node, new_relation = create_node_with_parent("File", file_attribute, parent_id)
 
+    # minio location is minio://http://<end_point>/bucket/user/object_path
+    minio_path = source_file.get('location').split("//")[-1]
+    _, bucket, obj_path = tuple(minio_path.split("/", 2))
+
+    # if the copy pool is given, the copy runs in the pool and the
+    # caller will collect the result from pool
+    if copy_pool:
+        copy_pool.copy_object(dataset_code, fuf_path, bucket, obj_path, \
+            source_file.get("file_size", -1))
+        return new_file_node, new_relation
+
     # make minio copy
     try:
-        mc = Minio_Client_(access_token, refresh_token)
-        # minio location is minio://http://<end_point>/bucket/user/object_path
-        minio_path = source_file.get('location').split("//")[-1]
-        _, bucket, obj_path = tuple(minio_path.split("/", 2))
-
-        mc.copy_object(dataset_code, fuf_path, bucket, obj_path)
+        mc = get_minio_client(access_token, refresh_token)
+        mc.copy_object(dataset_code, fuf_path, bucket, obj_path, source_file.get("file_size", -1))
         logger.info("Minio Copy %s/%s Success"%(dataset_code, fuf_path))
     except Exception as e:
         logger.error("error when uploading: "+str(e))
@@ -213,25 +398,121 @@ def create_file_node(dataset_code, source_file, operator, parent_id, relative_pa
 
 
 def create_folder_node(dataset_code, source_folder, operator, parent_node, relative_path, new_name=None):
-    # fecth the geid from common service
-    geid = requests.get(ConfigClass.COMMON_SERVICE+"utility/id").json().get("result")
-    folder_name = new_name if new_name else source_folder.get("name")
+    # take the geid from allocator
+    geid = allocate_geid()
 
     # then copy the node under the dataset
-    folder_attribute = {
-        "create_by": operator,
-        "name": folder_name,
-        "global_entity_id": geid,
-        "folder_relative_path": relative_path,
-        "folder_level": parent_node.get("folder_level", -1)+1,
-        "dataset_code": dataset_code,
-        "display_path": relative_path+"/"+folder_name,
-    }
+    folder_attribute = build_folder_attribute(dataset_code, source_folder, operator, parent_node, \
+        relative_path, geid, new_name)
     folder_node, relation = create_node_with_parent("Folder", folder_attribute, parent_node.get('id'))
 
     return folder_node, relation
 
 
+def get_geid_batch(number:int) -> list:
+    '''
+    take the number of geids from allocator at once
+    '''
+    return allocate_geids(number)
+
+
+_bulk_create_supported = None
+
+
+def bulk_create_supported() -> bool:
+    '''
+    Summary:
+        check once if the neo4j service has the batch apis used by
+        create_nodes_with_parent_batch(nodes/<label>/batch and
+        relations/own/batch). An empty batch is sent to each of them,
+        the service without the api answers 404/405 and the copy falls
+        back to one call per node
+    Return:
+        True if both apis exist
+    '''
+    global _bulk_create_supported
+
+    if _bulk_create_supported is None:
+        try:
+            supported = True
+            for path in ["nodes/File/batch", "relations/own/batch"]:
+                response = get_session().post(ConfigClass.NEO4J_SERVICE + path, json={"data": []})
+                if response.status_code in [404, 405]:
+                    logger.warning("neo4j service has no %s, bulk create is disabled"%path)
+                    supported = False
+        except Exception as e:
+            # do not keep the result, check again next time
+            logger.error("Error when checking the neo4j batch api: %s"%str(e))
+            return False
+        _bulk_create_supported = supported
+
+    return _bulk_create_supported
+
+
+def _delete_created_nodes(node_label, nodes:list):
+    # remove the nodes left without parent by a failed batch
+    for node in nodes:
+        try:
+            node_delete_url = ConfigClass.NEO4J_SERVICE + "nodes/%s/node/%s"%(node_label, node.get("id"))
+            get_session().delete(node_delete_url)
+        except Exception as e:
+            logger.error("Error when deleting %s node %s: %s"%(node_label, node.get("id"), str(e)))
+
+
+def create_nodes_with_parent_batch(node_label, node_properties:list, parent_ids:list) -> list:
+    '''
+    Summary:
+        the batch version of create_node_with_parent. The nodes are
+        created with one call per batch and then connected to their
+        parent with "own" relationship in one call per batch. If any
+        call failed, the nodes created by this function are deleted so
+        no node is left without parent
+    Parameter:
+        - node_label: File/Folder
+        - node_properties: list of node attribute
+        - parent_ids: the neo4j id of parent for each node in same order
+    Return:
+        list of new nodes in the same order as node_properties
+    '''
+    if len(node_properties) != len(parent_ids):
+        raise APIException(
+            error_msg="Error when create %s nodes: %d nodes but %d parents"% \
+                (node_label, len(node_properties), len(parent_ids)),
+            status_code=EAPIResponseCode.internal_error.value
+        )
+
+    new_nodes = []
+    batch_size = ConfigClass.NEO4J_BATCH_SIZE
+    try:
+        for i in range(0, len(node_properties), batch_size):
+            batch = node_properties[i:i+batch_size]
+            response = _call(Neo4jCall("POST", "nodes/%s/batch"%node_label, _NODE_API, \
+                json={"data": batch}))
+            # the result may not keep the order of request, so map it back
+            # by the geid and make sure every node is created
+            created_map = {x.get("global_entity_id"): x for x in response}
+            new_nodes += created_map.values()
+            created = [created_map.get(x.get("global_entity_id")) for x in batch]
+            if len(created_map) != len(batch) or None in created:
+                raise APIException(
+                    error_msg="Error when create %s nodes: %d requested but %d created"% \
+                        (node_label, len(batch), len(created_map)),
+                    status_code=EAPIResponseCode.internal_error.value
+                )
+
+            # the parent can be two possible: 1.dataset 2.folder under it
+            relations = [{"start_id": parent_id, "end_id": node.get("id")} \
+                for parent_id, node in zip(parent_ids[i:i+batch_size], created)]
+            _call(Neo4jCall("POST", "relations/own/batch", _NODE_API, json={"data": relations}))
+    except Exception as e:
+        _delete_created_nodes(node_label, new_nodes)
+        raise e
+
+    # keep the order of node_properties
+    created_map = {x.get("global_entity_id"): x for x in new_nodes}
+    return [created_map.get(x.get("global_entity_id")) for x in node_properties]
+
+
 # this function will help to create a target node
 # and connect to parent with "own" relationship
 def create_node_with_parent(node_label, node_property, parent_id):
@@ -242,12 +523,65 @@ def create_node_with_parent(node_label, node_property, parent_id):
     # - create_time: neo4j timeobject (API will create but not passed in api)
     # - location: indicate the minio location as minio://http://<domain>/object
     create_node_url = ConfigClass.NEO4J_SERVICE + 'nodes/' + node_label
-    response = requests.post(create_node_url, json=node_property)
+    response = get_session().post(create_node_url, json=node_property)
     new_node = response.json()[0]
 
     # now create the relationship
     # the parent can be two possible: 1.dataset 2.folder under it
     create_node_url = ConfigClass.NEO4J_SERVICE + 'relations/own'
-    new_relation = requests.post(create_node_url, json={"start_id":parent_id, "end_id":new_node.get("id")})
+    new_relation = get_session().post(create_node_url, json={"start_id":parent_id, "end_id":new_node.get("id")})
 
     return new_node, new_relation
+
+##########################################################################################
+# the async version of the helpers above. They use the pooled async client so the api
+# handlers will not block the event loop. The background jobs are running in the thread
+# pool so they still use the sync version
+
+async def query_relation_async(relation_label, start_label, end_label, start_params={}, end_params={}):
+    return await _call_async(_query_relation_call(relation_label, start_label, end_label, start_params, end_params))
+
+
+async def create_relation_async(label, payload):
+    return await _call_async(_create_relation_call(label, payload))
+
+
+async def create_node_async(label, payload):
+    return await _call_async(_create_node_call(label, payload))
+
+
+async def get_node_by_geid_async(geid, label: str = None):
+    return await _call_async(_get_node_by_geid_call(geid, label))
+
+
+async def get_nodes_by_geids_async(geids: list) -> list:
+    nodes = []
+    for call in _get_nodes_by_geids_calls(geids):
+        nodes += await _call_async(call)
+
+    return nodes
+
+
+async def get_connected_geids_async(root_geid: str, root_label: str, geids: list) -> set:
+    connected = set()
+    for call in _get_connected_geids_calls(root_geid, root_label, geids):
+        connected.update(await _call_async(call))
+
+    return connected
+
+
+async def get_parent_node_async(current_node):
+    return await _call_async(_get_parent_node_call(current_node))
+
+
+async def get_children_nodes_async(start_geid, start_label="Folder"):
+    return await _call_async(_get_children_nodes_call(start_geid, start_label))
+
+
+async def get_children_nodes_batch_async(start_geids: list, start_label="Folder") -> dict:
+    children = {}
+    for call in _get_children_nodes_batch_calls(start_geids, start_label):
+        for parent_geid, child in await _call_async(call):
+            children.setdefault(parent_geid, []).append(child)
+
+    return children
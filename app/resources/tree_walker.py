@@ -0,0 +1,109 @@
+# Copyright 2022 Indoc Research
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+#
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+#
+
+from .neo4j_helper import get_children_nodes, get_children_nodes_batch
+
+
+class NodeTree:
+    '''
+    In memory snapshot of the folder tree. The children of all the
+    folders are fetched level by level, so the walkers(copy/delete/lock
+    /publish) can go through the tree without calling neo4j per folder
+    '''
+
+    def __init__(self):
+        # {folder_geid: [child nodes]}
+        self.children = {}
+
+    def get_children(self, geid) -> list:
+        return self.children.get(geid, [])
+
+    def get_files(self, nodes, skip_archived=False) -> list:
+        '''
+        return all the file nodes in the list and under the folders
+        of the list
+        '''
+        files = []
+        stack = list(reversed(nodes))
+        while stack:
+            node = stack.pop()
+            if skip_archived and node.get("archived", False):
+                continue
+            if "File" in node.get("labels", []):
+                files.append(node)
+            elif "Folder" in node.get("labels", []):
+                stack += list(reversed(self.get_children(node.get("global_entity_id"))))
+
+        return files
+
+
+def get_subtree(nodes, skip_archived=False) -> NodeTree:
+    '''
+    Summary:
+        fetch the whole subtree under the nodes level by level. Each
+        level is one batched relation query so the number of calls is
+        the depth of the tree instead of the number of folders.
+    Parameter:
+        - nodes: the root file/folder nodes
+        - skip_archived: if true, the archived nodes will not be in the
+            tree and their children will not be fetched
+    Return:
+        NodeTree
+    '''
+    tree = NodeTree()
+    visited = set()
+
+    level = [x for x in nodes if "Folder" in x.get("labels", [])]
+    while level:
+        geids = []
+        for node in level:
+            geid = node.get("global_entity_id")
+            if geid in visited or (skip_archived and node.get("archived", False)):
+                continue
+            visited.add(geid)
+            geids.append(geid)
+
+        children_map = get_children_nodes_batch(geids)
+        level = []
+        for geid in geids:
+            children = children_map.get(geid, [])
+            if skip_archived:
+                children = [x for x in children if not x.get("archived", False)]
+            tree.children[geid] = children
+            level += [x for x in children if "Folder" in x.get("labels", [])]
+
+    return tree
+
+
+def get_subtree_by_root(root_geid, root_label="Folder", skip_archived=False):
+    '''
+    Summary:
+        same as get_subtree but start from the root(Dataset/Folder) geid
+    Return:
+        tuple of (first level nodes under root, NodeTree)
+    '''
+    level1_nodes = get_children_nodes(root_geid, start_label=root_label)
+    if skip_archived:
+        level1_nodes = [x for x in level1_nodes if not x.get("archived", False)]
+
+    tree = get_subtree(level1_nodes, skip_archived=skip_archived)
+    tree.children[root_geid] = level1_nodes
+
+    return level1_nodes, tree
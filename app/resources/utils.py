@@ -19,30 +19,17 @@
 # 
 
 from ..config import ConfigClass
+from .tree_walker import get_subtree_by_root
 import requests
 import os
 import json
 
 
-def get_files_recursive(folder_geid, all_files=[]):
-    query = {
-        "start_label": "Folder",
-        "end_labels": ["File", "Folder"],
-        "query": {
-            "start_params": {
-                "global_entity_id": folder_geid,
-            },
-            "end_params": {
-            }
-        }
-    }
-    resp = requests.post(ConfigClass.NEO4J_SERVICE_V2 +
-                         "relations/query", json=query)
-    for node in resp.json()["results"]:
-        if "File" in node["labels"]:
-            all_files.append(node)
-        else:
-            get_files_recursive(node["global_entity_id"], all_files=all_files)
+def get_files_recursive(folder_geid, all_files=None):
+    # the tree is fetched level by level instead of query per folder
+    all_files = [] if all_files is None else all_files
+    level1_nodes, tree = get_subtree_by_root(folder_geid, root_label="Folder")
+    all_files += tree.get_files(level1_nodes)
     return all_files
 
 
@@ -0,0 +1,214 @@
+# Copyright 2022 Indoc Research
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+#
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+#
+
+import io
+import os
+import struct
+import zipfile
+
+from minio import Minio
+
+from app.config import ConfigClass
+from app.commons.service_connection.minio_client import get_object_data
+
+
+def get_compression(name:str) -> tuple:
+    '''
+    Summary:
+        the compression of member by file type. The already compressed
+        files(VERSION_ZIP_STORE_EXTENSIONS) are stored as they are since
+        deflate them again only burns cpu, others are deflated with
+        VERSION_ZIP_COMPRESS_LEVEL
+    Return:
+        tuple(<compress type>, <compress level>)
+    '''
+    extensions = [x.strip().lower() for x in ConfigClass.VERSION_ZIP_STORE_EXTENSIONS.split(",") if x.strip()]
+    if name.lower().endswith(tuple(extensions)):
+        return zipfile.ZIP_STORED, None
+
+    return zipfile.ZIP_DEFLATED, ConfigClass.VERSION_ZIP_COMPRESS_LEVEL
+
+
+def build_zip_info(name:str, date_time:tuple) -> zipfile.ZipInfo:
+    '''
+    return the ZipInfo of member with the compression by file type
+    '''
+    zinfo = zipfile.ZipInfo(name, date_time=date_time)
+    zinfo.compress_type, level = get_compression(name)
+    # ZipFile.open(zinfo, "w") takes the level from the ZipInfo only
+    zinfo._compresslevel = level
+    return zinfo
+
+
+def zip_folder(zip_path:str, folder:str):
+    '''
+    Summary:
+        zip the folder with the compression by file type, the members are
+        added in sorted order so the layout is reproducible. Zip64 is on
+        so the archive and members can be larger than 4GB
+    Parameter:
+        - zip_path: the archive to write
+        - folder: the folder to zip, the names are relative to it
+    '''
+    with zipfile.ZipFile(zip_path, "w", allowZip64=True) as archive:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                arcname = os.path.relpath(path, folder)
+                compress_type, level = get_compression(arcname)
+                archive.write(path, arcname, compress_type=compress_type, compresslevel=level)
+
+
+class MinioRangeReader(io.RawIOBase):
+    '''
+    A seekable read only file object of minio object, each read is a range
+    request. zipfile only reads the end records and central directory of
+    the archive so the members are never downloaded
+    '''
+    def __init__(self, client:Minio, bucket, obj):
+        self.client = client
+        self.bucket = bucket
+        self.obj = obj
+        self.size = client.stat_object(bucket, obj).size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if end <= self.position:
+            return b""
+        data = get_object_data(self.client, self.bucket, self.obj, self.position, \
+            end - self.position)
+        self.position += len(data)
+        return data
+
+
+def read_archive_members(client:Minio, bucket, obj):
+    '''
+    Summary:
+        read the central directory of the zip in minio
+    Return:
+        tuple(<members sorted by offset>, <offset of central directory>)
+    '''
+    with zipfile.ZipFile(MinioRangeReader(client, bucket, obj)) as archive:
+        members = sorted(archive.infolist(), key=lambda x: x.header_offset)
+        return members, archive.start_dir
+
+
+def plan_reuse(members:list, start_dir:int, reusable:set) -> list:
+    '''
+    Summary:
+        group the reusable members into runs of continuous bytes in the
+        archive, each run can be copied as one range. The range of member
+        is from its local header to the next member(or central directory)
+    Parameter:
+        - members: the members sorted by header_offset
+        - start_dir: the offset of central directory
+        - reusable: the name of members to reuse
+    Return:
+        list of tuple(<start>, <end>, <members>)
+    '''
+    runs = []
+    current = None
+    for i, zinfo in enumerate(members):
+        end = members[i+1].header_offset if i+1 < len(members) else start_dir
+        if zinfo.filename not in reusable:
+            current = None
+        elif current and current[1] == zinfo.header_offset:
+            current[1] = end
+            current[2].append(zinfo)
+        else:
+            current = [zinfo.header_offset, end, [zinfo]]
+            runs.append(current)
+
+    return [tuple(x) for x in runs]
+
+
+def strip_zip64_extra(extra:bytes) -> bytes:
+    '''
+    remove the zip64 field(header id 0x0001) from the extra of member. It
+    holds the sizes/offset in the previous archive, zipfile will write a
+    new one into central directory if the member still needs it
+    '''
+    result = b""
+    i = 0
+    while i + 4 <= len(extra):
+        header_id, length = struct.unpack("<HH", extra[i:i+4])
+        if header_id != 1:
+            result += extra[i:i+4+length]
+        i += 4 + length
+
+    return result + extra[i:]
+
+
+def append_raw_members(archive:zipfile.ZipFile, upload, source_bucket, source_obj, \
+    start:int, end:int, members:list):
+    '''
+    Summary:
+        append the members of another archive without recompress. The local
+        headers and data do not hold any offset so the bytes are copied as
+        they are, only the offsets in central directory are moved
+    Parameter:
+        - archive: the zipfile writing to the upload
+        - upload: the MultipartUploadStream
+        - source_bucket/source_obj: the previous archive
+        - start/end/members: the run from plan_reuse
+    '''
+    base = upload.tell()
+    upload.copy_range(source_bucket, source_obj, start, end)
+    for zinfo in members:
+        zinfo.header_offset = base + zinfo.header_offset - start
+        zinfo.extra = strip_zip64_extra(zinfo.extra)
+        archive.filelist.append(zinfo)
+        archive.NameToInfo[zinfo.filename] = zinfo
+    # the next member and the central directory go after copied bytes
+    archive.start_dir = upload.tell()
+
+
+def list_object_stats(client:Minio, bucket, prefix) -> dict:
+    '''
+    Summary:
+        list the objects under prefix
+    Return:
+        dict of {<object path>: tuple(<size>, <etag>)}
+    '''
+    stats = {}
+    for obj in client.list_objects(bucket, prefix=prefix, recursive=True):
+        stats[obj.object_name] = (obj.size, (obj.etag or "").strip('"'))
+
+    return stats
@@ -18,8 +18,10 @@
 # permissions and limitations under the Licence.
 # 
 
+import os
 from fastapi import APIRouter
 from ..config import ConfigClass
+from ..commons.service_connection.http_client import get_pool_metrics
 
 router = APIRouter()
 
@@ -30,3 +32,12 @@ async def root():
     For testing if service's up
     '''
     return {"message": "Service Dataset On, Version: " + ConfigClass.version}
+
+
+@router.get("/pool-metrics")
+async def pool_metrics():
+    '''
+    the connection pool usage of the current worker process,
+    use it to size the pool against gunicorn workers/threads
+    '''
+    return {"pid": os.getpid(), "pools": get_pool_metrics()}
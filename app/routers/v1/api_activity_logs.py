@@ -25,7 +25,7 @@ from fastapi_sqlalchemy import db
 from requests.api import post
 from ...commons.logger_services.logger_factory_service import SrvLoggerFactory
 from ...resources.error_handler import catch_internal
-from ...resources.es_helper import search
+from ...resources.es_helper import search_async
 from ...models.base_models import APIResponse, EAPIResponseCode
 from app.models.version_sql import DatasetVersion
 import json
@@ -86,7 +86,7 @@ class ActivityLogs:
                     }
                     search_params.append(filed_params)
 
-            res = search('activity-logs', page, page_size,
+            res = await search_async('activity-logs', page, page_size,
                          search_params, sort_by, sort_type)
 
             self.__logger.info("activity logs result: {}".format(res))
@@ -162,7 +162,7 @@ class ActivityLogs:
         })
 
         try:
-            res = search('activity-logs', page, page_size,
+            res = await search_async('activity-logs', page, page_size,
                          search_params, 'create_timestamp', 'desc')
         except Exception as e:
             self.__logger.error("Elastic Search Error: " + str(e))
@@ -21,12 +21,14 @@
 from fastapi import APIRouter
 from fastapi.responses import StreamingResponse
 from fastapi_utils import cbv
+from starlette.concurrency import run_in_threadpool
 
 from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
 from app.models.base_models import APIResponse, EAPIResponseCode
 from app.models.folder_models import FolderResponse, FolderRequest
 from app.resources.helpers import get_geid
-from app.resources.neo4j_helper import get_node_by_geid, query_relation, create_node, create_relation
+from app.resources.neo4j_helper import get_node_by_geid_async, query_relation_async, create_node_async, \
+    create_relation_async
 from app.resources.error_handler import APIException
 from app.config import ConfigClass
 import requests
@@ -45,7 +47,7 @@ class DatasetFolder:
     @router.post("/v1/dataset/{dataset_geid}/folder", tags=["V1 DATASET"], response_model=FolderResponse, summary="Create an empty folder")
     async def create_folder(self, dataset_geid: str, data: FolderRequest):
         api_response = FolderResponse()
-        dataset_node = get_node_by_geid(dataset_geid, label="Dataset")
+        dataset_node = await get_node_by_geid_async(dataset_geid, label="Dataset")
 
         # length 1-20, exclude invalid character, ensure start & end aren't a space
         folder_pattern = re.compile("^(?=.{1,20}$)([^\s\/:?*<>|”]{1})+([^\/:?*<>|”])+([^\s\/:?*<>|”]{1})$")
@@ -63,7 +65,7 @@ class DatasetFolder:
         if data.parent_folder_geid:
             # Folder is being added as a subfolder
             start_label = "Folder"
-            folder_node = get_node_by_geid(data.parent_folder_geid, label="Folder")
+            folder_node = await get_node_by_geid_async(data.parent_folder_geid, label="Folder")
             if not folder_node:
                 logger.error(f"Folder not found: {data.parent_folder_geid}")
                 raise APIException(error_msg="Folder not found", status_code=EAPIResponseCode.not_found.value)
@@ -76,7 +78,7 @@ class DatasetFolder:
             parent_node = dataset_node
 
         # Duplicate name check
-        result = query_relation(
+        result = await query_relation_async(
             "own",
             start_label,
             "Folder",
@@ -89,24 +91,25 @@ class DatasetFolder:
             logger.error(api_response.error_msg)
             return api_response.json_response()
 
-        # create node in neo4j
+        # create node in neo4j, the geid call is blocking so keep it off the event loop
+        folder_geid = await run_in_threadpool(get_geid)
         payload = {
             "name": data.folder_name,
             "create_by": data.username,
-            "global_entity_id": get_geid(),
+            "global_entity_id": folder_geid,
             "dataset_code": dataset_node["code"],
             "folder_relative_path": folder_relative_path,
             "folder_level": parent_node.get("folder_level", -1) + 1,
             "archived": False,
         }
-        folder_node = create_node("Folder", payload)
+        folder_node = await create_node_async("Folder", payload)
 
         # Create relation between folder and parent
         relation_payload = {
             "start_id": parent_node["id"],
             "end_id": folder_node["id"],
         }
-        result = create_relation("own", relation_payload)
+        result = await create_relation_async("own", relation_payload)
         api_response.result = folder_node
         return api_response.json_response()
 
@@ -25,8 +25,8 @@ from ...commons.logger_services.logger_factory_service import SrvLoggerFactory
 from ...resources.error_handler import catch_internal
 from ...models.base_models import APIResponse, EAPIResponseCode
 from ...models.reqres_dataset import DatasetListForm, DatasetListResponse
+from ...commons.service_connection.http_client import get_async_client, NEO4J
 from ...config import ConfigClass
-import requests
 import math
 
 router = APIRouter()
@@ -68,7 +68,8 @@ class DatasetList:
             }
         }
         try:
-            response = requests.post(ConfigClass.NEO4J_SERVICE_V2 + "nodes/query", json=query_payload)
+            client = get_async_client(NEO4J)
+            response = await client.post(ConfigClass.NEO4J_SERVICE_V2 + "nodes/query", json=query_payload)
             if response.status_code != 200:
                 error_msg = response.json()
                 res.code = EAPIResponseCode.internal_error
@@ -25,6 +25,7 @@ from ...models.validator_dataset import DatasetValidator
 from fastapi import APIRouter, Header
 from fastapi_utils import cbv
 from fastapi_sqlalchemy import db
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
 
 import json
@@ -66,7 +67,7 @@ class DatasetRestful:
 
         srv_dataset = SrvDatasetMgr()
 
-        check_created = srv_dataset.get_bycode(request_payload.code)
+        check_created = await srv_dataset.get_bycode_async(request_payload.code)
         if check_created.status_code == 200:
             if len(check_created.json()) > 0:
                 res.result = None
@@ -86,7 +87,10 @@ class DatasetRestful:
                     res.error_msg = "Invalid {}".format(k)
                     return res.json_response()
 
-        created = srv_dataset.create(
+        # the creation calls neo4j, cataloguing and psql with blocking
+        # clients, so keep it off the event loop
+        created = await run_in_threadpool(
+            srv_dataset.create,
             request_payload.username,
             request_payload.code,
             request_payload.title,
@@ -116,7 +120,7 @@ class DatasetRestful:
 
         dataset_gotten = None
 
-        response_dataset_node = srv_dataset.get_bygeid(dataset_geid)
+        response_dataset_node = await srv_dataset.get_bygeid_async(dataset_geid)
         if response_dataset_node.status_code == 200:
             if len(response_dataset_node.json()) > 0:
                 dataset_gotten = response_dataset_node.json()[0]
@@ -146,7 +150,7 @@ class DatasetRestful:
 
         dataset_gotten = None
 
-        response_dataset_node = srv_dataset.get_bycode(code)
+        response_dataset_node = await srv_dataset.get_bycode_async(code)
         if response_dataset_node.status_code == 200:
             if len(response_dataset_node.json()) > 0:
                 dataset_gotten = response_dataset_node.json()[0]
@@ -172,7 +176,8 @@ class DatasetRestful:
         dataset_geid = payload['dataset_geid']
         verify_type = payload['type']
 
-        dataset_res = http_query_node(
+        # the helpers and the validator are blocking, run them in thread pool
+        dataset_res = await run_in_threadpool(http_query_node,
             'Dataset', {'global_entity_id': dataset_geid})
 
         if dataset_res.status_code != 200:
@@ -188,7 +193,7 @@ class DatasetRestful:
 
         dataset_info = dataset_info[0]
         dataset_code = dataset_info['code']
-        nodes = get_related_nodes(dataset_geid)
+        nodes = await run_in_threadpool(get_related_nodes, dataset_geid)
 
         files_info = []
         TEMP_FOLDER = 'temp/'
@@ -201,7 +206,7 @@ class DatasetRestful:
                     {"file_path": TEMP_FOLDER + dataset_code + file_path, "file_size": node['file_size']})
 
             if 'Folder' in node['labels']:
-                files = get_files_recursive(node['global_entity_id'])
+                files = await run_in_threadpool(get_files_recursive, node['global_entity_id'])
                 for file in files:
                     file_path = get_node_relative_path(
                         dataset_code, file['location'])
@@ -209,14 +214,14 @@ class DatasetRestful:
                         {"file_path": TEMP_FOLDER + dataset_code + file_path, "file_size": file['file_size']})
 
         try:
-            make_temp_folder(files_info)
+            await run_in_threadpool(make_temp_folder, files_info)
         except Exception as e:
             res.code = EAPIResponseCode.internal_error
             res.result = "failed to create temp folder for bids"
             return res.json_response()
 
         try:
-            result = subprocess.run(['bids-validator', TEMP_FOLDER + dataset_code, '--json',
+            result = await run_in_threadpool(subprocess.run, ['bids-validator', TEMP_FOLDER + dataset_code, '--json',
                                      '--ignoreNiftiHeaders', '--ignoreSubjectConsistency'], stdout=subprocess.PIPE)
         except Exception as e:
             res.code = EAPIResponseCode.internal_error
@@ -224,7 +229,7 @@ class DatasetRestful:
             return res.json_response()
 
         try:
-            shutil.rmtree(TEMP_FOLDER + dataset_code)
+            await run_in_threadpool(shutil.rmtree, TEMP_FOLDER + dataset_code)
         except Exception as e:
             res.code = EAPIResponseCode.internal_error
             res.result = "failed to remove temp bids folder"
@@ -242,7 +247,7 @@ class DatasetRestful:
         dataset_geid = payload['dataset_geid']
         verify_type = payload['type']
 
-        dataset_res = http_query_node(
+        dataset_res = await run_in_threadpool(http_query_node,
             'Dataset', {'global_entity_id': dataset_geid})
 
         if dataset_res.status_code != 200:
@@ -264,7 +269,8 @@ class DatasetRestful:
         }
         url = ConfigClass.SEND_MESSAGE_URL
         self.__logger.info("Sending Message To Queue: " + str(payload))
-        msg_res = requests.post(
+        msg_res = await run_in_threadpool(
+            requests.post,
             url=url,
             json=payload,
             headers={"Content-type": "application/json; charset=utf-8"}
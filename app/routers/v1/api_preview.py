@@ -26,9 +26,11 @@ from fastapi_utils import cbv
 from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
 from app.models.base_models import APIResponse, EAPIResponseCode
 from app.models.preview_model import PreviewResponse
-from app.commons.service_connection.minio_client import Minio_Client, Minio_Client_
+from app.commons.service_connection.minio_client import Minio_Client, get_minio_client
 from app.config import ConfigClass
+from app.commons.service_connection.http_client import get_async_client, NEO4J
 from app.resources.error_handler import catch_internal
+from starlette.concurrency import run_in_threadpool
 import requests
 import csv
 from io import StringIO
@@ -50,18 +52,21 @@ class Preview:
         api_response = APIResponse()
 
         # Get neo4j file node
-        file_node = self.get_file_by_geid(file_geid)
+        file_node = await self.get_file_by_geid_async(file_geid)
         if not file_node:
             api_response.error_msg = "File not found"
             api_response.code = EAPIResponseCode.not_found
             return api_response.json_response()
 
         result = {}
-        mc = Minio_Client_(Authorization, refresh_token)
         file_data = self.parse_location(file_node["location"])
         file_type = file_node["name"].split(".")[1]
 
-        response = mc.client.get_object(file_data["bucket"], file_data["path"], length=ConfigClass.MAX_PREVIEW_SIZE)
+        # minio sdk is blocking(include the token exchange) so move it out of event loop
+        def get_preview_object():
+            mc = get_minio_client(Authorization, refresh_token)
+            return mc.client.get_object(file_data["bucket"], file_data["path"], length=ConfigClass.MAX_PREVIEW_SIZE)
+        response = await run_in_threadpool(get_preview_object)
         if file_type in ["csv", "tsv"]:
             result["content"] = self.parse_csv_response(response.data.decode('utf-8-sig'))
         else:
@@ -144,3 +149,13 @@ class Preview:
             return None
         return response.json()[0]
 
+    async def get_file_by_geid_async(self, file_geid):
+        payload = {
+            "global_entity_id": file_geid,
+        }
+        client = get_async_client(NEO4J)
+        response = await client.post(ConfigClass.NEO4J_SERVICE + "nodes/File/query", json=payload)
+        if not response.json():
+            return None
+        return response.json()[0]
+
@@ -26,11 +26,11 @@ from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
 from app.models.base_models import APIResponse, EAPIResponseCode
 from app.config import ConfigClass
 from app.models.version_models import PublishResponse, PublishRequest, VersionResponse, \
-        VersionRequest, VersionListRequest
-from app.models.version_sql import DatasetVersion
+        VersionRequest, VersionListRequest, VersionManifestRequest
+from app.models.version_sql import DatasetVersion, DatasetVersionManifest
 from app.resources.error_handler import APIException
 from app.resources.token_manager import generate_token
-from .publish_version import PublishVersion, get_dataset_by_geid, parse_minio_location
+from .publish_version import PublishVersion, get_dataset_by_geid_async, parse_minio_location
 
 from redis import Redis
 import requests
@@ -42,6 +42,10 @@ import math
 logger = SrvLoggerFactory("api_version").get_logger()
 router = APIRouter()
 
+# the manifest columns which can be used to sort
+MANIFEST_SORTING = ["id", "path", "size", "etag", "source_geid", "header_offset", \
+    "compress_size", "compress_type"]
+
 
 @cbv.cbv(router)
 class VersionAPI:
@@ -92,7 +96,7 @@ class VersionAPI:
             api_response.result = "Duplicate version found for dataset"
             return api_response.json_response()
 
-        dataset_node = get_dataset_by_geid(dataset_geid)
+        dataset_node = await get_dataset_by_geid_async(dataset_geid)
         client = PublishVersion(
             dataset_node=dataset_node,
             operator=data.operator,
@@ -111,7 +115,7 @@ class VersionAPI:
     async def publish_status(self, dataset_geid: str, status_id: str):
         api_response = APIResponse()
 
-        dataset_node = get_dataset_by_geid(dataset_geid)
+        dataset_node = await get_dataset_by_geid_async(dataset_geid)
         self.redis_client = Redis(
             host=ConfigClass.REDIS_HOST,
             port=ConfigClass.REDIS_PORT,
@@ -145,6 +149,51 @@ class VersionAPI:
         api_response.num_of_pages = math.ceil(total / data.page_size)
         return api_response.json_response()
 
+    @router.get("/v1/dataset/{dataset_geid}/versions/manifest", tags=["version"], response_model=VersionResponse, summary="Get files of dataset version")
+    async def version_manifest(self, dataset_geid: str, data: VersionManifestRequest = Depends(VersionManifestRequest)):
+        """
+            Page through the files in version archive(latest version if
+            version is not given), filter by the path prefix. Each file has
+            the offset and compressed size of the member in archive
+        """
+        api_response = VersionResponse()
+        if data.sorting not in MANIFEST_SORTING:
+            api_response.code = EAPIResponseCode.bad_request
+            api_response.error_msg = f"Invalid sorting, must be one of {MANIFEST_SORTING}"
+            return api_response.json_response()
+
+        try:
+            query = {"dataset_geid": dataset_geid}
+            if data.version:
+                query["version"] = data.version
+            dataset_version = db.session.query(DatasetVersion).filter_by(**query) \
+                .order_by(DatasetVersion.created_at.desc()).first()
+            if not dataset_version:
+                api_response.code = EAPIResponseCode.not_found
+                api_response.error_msg = "No published version found"
+                return api_response.json_response()
+
+            files = db.session.query(DatasetVersionManifest).filter_by(version_id=dataset_version.id)
+            if data.path:
+                files = files.filter(DatasetVersionManifest.path.startswith(data.path, autoescape=True))
+            sort_field = getattr(DatasetVersionManifest, data.sorting)
+            sort_field = sort_field.desc() if data.order == "desc" else sort_field.asc()
+            total = files.count()
+            files = files.order_by(sort_field).offset(data.page * data.page_size).limit(data.page_size)
+        except Exception as e:
+            logger.error("Psql Error: " + str(e))
+            api_response.code = EAPIResponseCode.internal_error
+            api_response.result = "Psql Error: " + str(e)
+            return api_response.json_response()
+        api_response.result = {
+            "version": dataset_version.to_dict(),
+            "files": [x.to_dict() for x in files],
+        }
+        api_response.page = data.page
+        api_response.total = total
+        api_response.num_of_pages = math.ceil(total / data.page_size)
+        return api_response.json_response()
+
     @router.delete("/v1/dataset/{dataset_geid}/version/{version_id}", tags=["version"], summary="Only used for unit tests, delete a version from psql")
     async def delete_version(self, dataset_geid: str, version_id: str):
         api_response = APIResponse()
@@ -167,7 +216,7 @@ class VersionAPI:
             Get download url for dataset version
         """
         api_response = APIResponse()
-        dataset_node = get_dataset_by_geid(dataset_geid)
+        dataset_node = await get_dataset_by_geid_async(dataset_geid)
         try:
             if version:
                 query = {
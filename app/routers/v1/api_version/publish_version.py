@@ -21,13 +21,17 @@
 from app.config import ConfigClass
 from fastapi_sqlalchemy import db
 from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
-from app.commons.service_connection.minio_client import Minio_Client
-from app.models.version_sql import DatasetVersion
+from app.commons.service_connection.minio_client import Minio_Client, MultipartUploadStream, \
+    prefetch_objects
+from app.models.version_sql import DatasetVersion, DatasetVersionManifest
 
 from app.resources.error_handler import APIException
 from app.resources.helpers import get_geid
-from app.resources.neo4j_helper import get_children_nodes
-from app.resources.locks import recursive_lock_publish, unlock_resource
+from app.resources.tree_walker import get_subtree_by_root
+from app.resources.version_archive import read_archive_members, plan_reuse, \
+    append_raw_members, list_object_stats, build_zip_info, zip_folder
+from app.resources.locks import recursive_lock_publish, bulk_unlock_resource
+from app.commons.service_connection.http_client import get_async_client, NEO4J
 
 from app.models.schema_sql import DatasetSchema
 
@@ -35,9 +39,11 @@ from redis import Redis
 from datetime import datetime
 import requests
 import time
-import shutil
 import json
 import os
+import math
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 logger = SrvLoggerFactory("api_version").get_logger()
 
@@ -58,6 +64,17 @@ def get_dataset_by_geid(dataset_geid):
     return response.json()[0]
 
 
+async def get_dataset_by_geid_async(dataset_geid):
+    payload = {
+        "global_entity_id": dataset_geid
+    }
+    client = get_async_client(NEO4J)
+    response = await client.post(ConfigClass.NEO4J_SERVICE + "nodes/Dataset/query", json=payload)
+    if not response.json():
+        raise APIException(status_code=404, error_msg="Dataset not found")
+    return response.json()[0]
+
+
 class PublishVersion(object):
     def __init__(self, dataset_node, operator, notes, status_id, version):
         self.operator = operator
@@ -80,20 +97,29 @@ class PublishVersion(object):
         self.version = version
 
     def publish(self):
+        locked_node = []
         try:
-            # TODO some merge needed here since get_children_nodes and 
-            # get_dataset_files_recursive both get the nodes under the dataset
+            # snapshot the dataset tree once, the lock and the file
+            # list below are both from the same snapshot
+            level1_nodes, tree = get_subtree_by_root(self.dataset_geid, root_label="Dataset")
 
             # lock file here
-            level1_nodes = get_children_nodes(self.dataset_geid, start_label="Dataset")
-            locked_node, err = recursive_lock_publish(level1_nodes)
+            locked_node, err = recursive_lock_publish(level1_nodes, tree=tree, \
+                dataset_code=self.dataset_node["code"])
             if err: raise err
 
-            self.get_dataset_files_recursive(self.dataset_geid)
-            self.download_dataset_files()
-            self.add_schemas()
-            self.zip_files()
-            minio_location = self.upload_version()
+            self.dataset_files += tree.get_files(level1_nodes, skip_archived=True)
+            self.file_stats = self.get_file_stats()
+            if ConfigClass.VERSION_PUBLISH_INCREMENTAL:
+                # reuse the unchanged files from the archive of last version
+                minio_location = self.stream_version(reuse=self.get_reusable_archive())
+            elif ConfigClass.VERSION_PUBLISH_STREAMING:
+                minio_location = self.stream_version()
+            else:
+                self.download_dataset_files()
+                self.add_schemas()
+                self.zip_files()
+                minio_location = self.upload_version()
             try:
                 dataset_version = DatasetVersion(
                     dataset_code=self.dataset_node["code"],
@@ -104,6 +130,9 @@ class PublishVersion(object):
                     notes=self.notes,
                 )
                 db.session.add(dataset_version)
+                # the manifest is saved in same transaction with the version
+                db.session.flush()
+                self.save_manifest(dataset_version.id, minio_location)
                 db.session.commit()
             except Exception as e:
                 logger.error("Psql Error: " + str(e))
@@ -118,8 +147,9 @@ class PublishVersion(object):
             self.update_status("failed", error_msg=error_msg)
         finally:
             # unlock the nodes if we got blocked
-            for resource_key, operation in locked_node:
-                unlock_resource(resource_key, operation)
+            failed_unlock = bulk_unlock_resource(locked_node)
+            if failed_unlock:
+                logger.error(f"Failed to unlock resources of {self.dataset_geid}: {failed_unlock}")
 
         return
 
@@ -170,50 +200,49 @@ class PublishVersion(object):
         """
         get all files from dataset
         """
-        query = {
-            "start_label": start_label,
-            "end_labels": ["File", "Folder"],
-            "query": {
-                "start_params": {
-                    "global_entity_id": geid,
-                },
-                "end_params": {
-                    "archived": False,
-                }
-            }
-        }
-        resp = requests.post(ConfigClass.NEO4J_SERVICE_V2 + "relations/query", json=query)
-        for node in resp.json()["results"]:
-            if "File" in node["labels"]:
-                self.dataset_files.append(node)
-            else:
-                self.get_dataset_files_recursive(node["global_entity_id"], start_label="Folder")
+        level1_nodes, tree = get_subtree_by_root(geid, root_label=start_label, skip_archived=True)
+        self.dataset_files += tree.get_files(level1_nodes)
         return self.dataset_files
 
     def download_dataset_files(self):
         """
             Download files from minio 
         """
-        file_paths = []
-        for file in self.dataset_files:
-            location_data = parse_minio_location(file["location"])
-            try:
-                self.mc.client.fget_object(
-                    location_data["bucket"], 
-                    location_data["path"], 
-                    self.tmp_folder + "/" + location_data["path"]
-                )
-                file_paths.append(self.tmp_folder + "/" + location_data["path"])
-            except Exception as e:
-                error_msg = f"Error download files from minio: {str(e)}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+        def download(location_data):
+            self.mc.client.fget_object(
+                location_data["bucket"], 
+                location_data["path"], 
+                self.tmp_folder + "/" + location_data["path"]
+            )
+            return self.tmp_folder + "/" + location_data["path"]
+
+        # the files are downloaded in parallel
+        locations = [parse_minio_location(x["location"]) for x in self.dataset_files]
+        try:
+            with ThreadPoolExecutor(max_workers=ConfigClass.VERSION_DOWNLOAD_WORKERS) as executor:
+                file_paths = list(executor.map(download, locations))
+        except Exception as e:
+            error_msg = f"Error download files from minio: {str(e)}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
         return file_paths 
 
     def zip_files(self):
-        shutil.make_archive(self.zip_path, "zip", self.tmp_folder)
+        zip_folder(self.zip_path + ".zip", self.tmp_folder)
         return self.zip_path
 
+    def get_schema_files(self):
+        """
+            Return the schema json files of dataset -> [(<file name>, <content>)]
+        """
+        schema_files = []
+        for standard, prefix in [("default", "default_"), ("open_minds", "openMINDS_")]:
+            schemas = db.session.query(DatasetSchema).filter_by(dataset_geid=self.dataset_geid, standard=standard, is_draft=False).all()
+            for schema in schemas:
+                content = json.dumps(schema.content, indent=4, ensure_ascii=False)
+                schema_files.append((prefix + schema.name, content))
+        return schema_files
+
     def add_schemas(self):
         """ 
             Saves schema json files to folder that will zipped
@@ -222,14 +251,9 @@ class PublishVersion(object):
             os.mkdir(self.tmp_folder)
             os.mkdir(self.tmp_folder + "/data")
 
-        schemas = db.session.query(DatasetSchema).filter_by(dataset_geid=self.dataset_geid, standard="default", is_draft=False).all()
-        for schema in schemas:
-            with open(self.tmp_folder + "/default_" + schema.name, 'w') as w:
-                w.write(json.dumps(schema.content, indent=4, ensure_ascii=False))
-        schemas = db.session.query(DatasetSchema).filter_by(dataset_geid=self.dataset_geid, standard="open_minds", is_draft=False).all()
-        for schema in schemas:
-            with open(self.tmp_folder + "/openMINDS_" + schema.name, 'w') as w:
-                w.write(json.dumps(schema.content, indent=4, ensure_ascii=False))
+        for name, content in self.get_schema_files():
+            with open(self.tmp_folder + "/" + name, 'w') as w:
+                w.write(content)
 
     def upload_version(self):
         """
@@ -243,12 +267,168 @@ class PublishVersion(object):
                 path,
                 self.zip_path + ".zip",
             )
-            minio_http = ("https://" if ConfigClass.MINIO_HTTPS else "http://") + ConfigClass.MINIO_ENDPOINT
-            minio_location = f"minio://{minio_http}/{bucket}/{path}"
+            minio_location = self.get_minio_location(bucket, path)
         except Exception as e:
             error_msg = f"Error uploading files to minio: {str(e)}"
             logger.error(error_msg)
             raise Exception(error_msg)
         return minio_location
 
+    def get_minio_location(self, bucket, path):
+        minio_http = ("https://" if ConfigClass.MINIO_HTTPS else "http://") + ConfigClass.MINIO_ENDPOINT
+        return f"minio://{minio_http}/{bucket}/{path}"
 
+    def get_file_stats(self):
+        """
+            Return the size and etag of dataset files -> {<path>: (<size>, <etag>)}
+        """
+        bucket = self.dataset_node["code"]
+        listed = {}
+        # the etag is only used to find the unchanged files in incremental
+        # publish, so the bucket is not listed otherwise
+        if ConfigClass.VERSION_PUBLISH_INCREMENTAL:
+            try:
+                listed = list_object_stats(self.mc.client, bucket, ConfigClass.DATASET_FILE_FOLDER + "/")
+            except Exception as e:
+                # without etag nothing is reused by next publish but it still works
+                logger.warning(f"Cannot list the files of {bucket}: {str(e)}")
+
+        file_stats = {}
+        self.file_geids = {}
+        for file in self.dataset_files:
+            location_data = parse_minio_location(file["location"])
+            file_stats[location_data["path"]] = listed.get(location_data["path"], \
+                (file.get("file_size"), None))
+            self.file_geids[location_data["path"]] = file.get("global_entity_id")
+        return file_stats
+
+    def save_manifest(self, version_id, minio_location):
+        """
+            Save the files of version with where they are in the archive.
+            The next publish diffs with it and the clients can fetch single
+            file by the range instead of whole archive
+        """
+        try:
+            location_data = parse_minio_location(minio_location)
+            members, _ = read_archive_members(self.mc.client, location_data["bucket"], \
+                location_data["path"])
+            members = {x.filename: x for x in members}
+        except Exception as e:
+            logger.warning(f"Cannot read the archive {minio_location}: {str(e)}")
+            members = {}
+
+        rows = []
+        for path, (size, etag) in self.file_stats.items():
+            zinfo = members.get(path)
+            rows.append({
+                "version_id": version_id,
+                "dataset_geid": self.dataset_geid,
+                "path": path,
+                "size": size,
+                "etag": etag,
+                "source_geid": self.file_geids.get(path),
+                "header_offset": zinfo.header_offset if zinfo else None,
+                "compress_size": zinfo.compress_size if zinfo else None,
+                "compress_type": zinfo.compress_type if zinfo else None,
+            })
+        db.session.bulk_insert_mappings(DatasetVersionManifest, rows)
+
+    def get_reusable_archive(self):
+        """
+            Diff the files with the manifest of last version. Return the
+            archive of last version and the runs of unchanged members in it,
+            None if nothing can be reused so the archive is fully rebuilt
+        """
+        previous = db.session.query(DatasetVersion).filter_by(dataset_geid=self.dataset_geid) \
+            .order_by(DatasetVersion.created_at.desc()).first()
+        if not previous:
+            return None
+
+        manifest = db.session.query(DatasetVersionManifest).filter_by(version_id=previous.id).all()
+        manifest = {x.path: (x.size, x.etag) for x in manifest}
+        unchanged = set(path for path, stat in self.file_stats.items() \
+            if stat[1] and manifest.get(path) == stat)
+        if not unchanged:
+            return None
+
+        location_data = parse_minio_location(previous.location)
+        try:
+            members, start_dir = read_archive_members(self.mc.client, location_data["bucket"], \
+                location_data["path"])
+        except Exception as e:
+            logger.warning(f"Cannot read version {previous.version}, fully rebuild: {str(e)}")
+            return None
+
+        runs = plan_reuse(members, start_dir, unchanged)
+        logger.info(f"Reuse {sum(len(x[2]) for x in runs)} files from version {previous.version}")
+        return location_data["bucket"], location_data["path"], runs
+
+    def stream_version(self, reuse=None):
+        """
+            Read the files from minio and write them into a zip stream which
+            is uploaded to minio by parts at the same time. Nothing is staged
+            on local disk and the memory is bounded by the upload parts.
+            With reuse the unchanged members are copied from the archive of
+            last version on server side instead of download and recompress
+        """
+        bucket = self.dataset_node["code"]
+        path = "versions/" + self.zip_path.split("/")[-1] + ".zip"
+
+        # s3 allow max 10000 parts so the part grows with the dataset
+        total_size = sum(x.get("file_size") or 0 for x in self.dataset_files)
+        part_size = max(ConfigClass.VERSION_UPLOAD_PART_SIZE, math.ceil(total_size * 1.1 / 9000))
+        upload = MultipartUploadStream(self.mc.client, bucket, path, part_size, \
+            workers=ConfigClass.VERSION_UPLOAD_WORKERS, content_type="application/zip")
+        try:
+            date_time = time.localtime()[:6]
+            # the small files are downloaded ahead in parallel but written in
+            # the order of file list so the layout of archive is reproducible
+            source_bucket, source_path, runs = reuse or (None, None, [])
+            reused = set(zinfo.filename for _, _, members in runs for zinfo in members)
+            objects = []
+            for file in self.dataset_files:
+                location_data = parse_minio_location(file["location"])
+                if location_data["path"] in reused:
+                    continue
+                objects.append((location_data["bucket"], location_data["path"], file.get("file_size")))
+            prefetched = prefetch_objects(self.mc.client, objects, ConfigClass.VERSION_DOWNLOAD_WORKERS, \
+                ConfigClass.VERSION_PREFETCH_BYTES)
+
+            with zipfile.ZipFile(upload, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                for start, end, members in runs:
+                    append_raw_members(archive, upload, source_bucket, source_path, start, end, members)
+
+                for (file_bucket, file_path, file_size), data in prefetched:
+                    zinfo = build_zip_info(file_path, date_time)
+                    if data is None:
+                        # the large file is streamed instead of held in memory
+                        zinfo.file_size = file_size or 0
+                        self.stream_file(archive, zinfo, {"bucket": file_bucket, "path": file_path})
+                    else:
+                        archive.writestr(zinfo, data)
+
+                for name, content in self.get_schema_files():
+                    zinfo = build_zip_info(name, date_time)
+                    archive.writestr(zinfo, content)
+            upload.close()
+        except Exception as e:
+            upload.abort()
+            error_msg = f"Error streaming version to minio: {str(e)}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+        return self.get_minio_location(bucket, path)
+
+    def stream_file(self, archive, zinfo, location_data):
+        """
+            Copy one object from minio into the archive chunk by chunk
+        """
+        response = self.mc.client.get_object(location_data["bucket"], location_data["path"])
+        try:
+            # the size in node may be out of date so always allow zip64
+            with archive.open(zinfo, "w", force_zip64=True) as dest:
+                for chunk in response.stream(ConfigClass.VERSION_STREAM_CHUNK_SIZE):
+                    dest.write(chunk)
+        finally:
+            response.close()
+            response.release_conn()
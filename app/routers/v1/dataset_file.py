@@ -31,16 +31,25 @@ from ...models.import_data_model import ImportDataPost, DatasetFileDelete, \
     DatasetFileMove, DatasetFileRename, SrvDatasetFileMgr
 from ...models.base_models import APIResponse, EAPIResponseCode
 from ...models.models_dataset import SrvDatasetMgr
-from ...resources.locks import lock_resource, unlock_resource, recursive_lock_import, \
+from ...resources.locks import bulk_unlock_resource, recursive_lock_import, \
     recursive_lock_delete, recursive_lock_move_rename
 
 from ...commons.logger_services.logger_factory_service import SrvLoggerFactory
-from ...commons.service_connection.minio_client import Minio_Client
+from ...commons.service_connection.minio_client import Minio_Client, MinioCopyPool, \
+    get_minio_client
 
 from ...resources.error_handler import catch_internal
 from ...resources.neo4j_helper import get_node_by_geid, get_parent_node, \
     get_children_nodes, delete_relation_bw_nodes, delete_node, create_file_node, \
-    create_folder_node
+    create_folder_node, get_node_by_geid_async, get_nodes_by_geids_async, \
+    get_connected_geids_async, get_parent_node_async, get_children_nodes_async, \
+    build_file_attribute, build_folder_attribute, get_geid_batch, create_nodes_with_parent_batch, \
+    bulk_create_supported
+
+from ...resources.tree_walker import get_subtree
+from ...resources.job_status import open_pipeline, get_pipeline, close_pipeline, \
+    CREATE, UPDATE, NOTIFY
+from ...commons.service_connection.http_client import get_async_client, NEO4J
 
 from ...config import ConfigClass
 
@@ -80,7 +89,7 @@ class APIImportData:
         api_response = APIResponse()
 
         # if dataset not found return 404
-        dataset_obj = get_node_by_geid(dataset_geid, "Dataset")
+        dataset_obj = await get_node_by_geid_async(dataset_geid, "Dataset")
         if dataset_obj == None:
             api_response.code = EAPIResponseCode.not_found
             api_response.error_msg = "Invalid geid for dataset"
@@ -97,8 +106,8 @@ class APIImportData:
 
         # check if file is from source project or exist
         # and check if file has been under the dataset
-        import_list, wrong_file = self.validate_files_folders(import_list, source_project, "Container")
-        duplicate, import_list = self.remove_duplicate_file(import_list, dataset_geid, "Dataset")
+        import_list, wrong_file = await self.validate_files_folders(import_list, source_project, "Container")
+        duplicate, import_list = await self.remove_duplicate_file(import_list, dataset_geid, "Dataset")
         import_list, not_core_file = self.check_core_file(import_list)
 
         # fomutate the result
@@ -128,7 +137,7 @@ class APIImportData:
         minio_refresh_token = refresh_token
 
         # validate the dataset if exists
-        dataset_obj = get_node_by_geid(dataset_geid, "Dataset")
+        dataset_obj = await get_node_by_geid_async(dataset_geid, "Dataset")
         if dataset_obj == None:
             api_response.code = EAPIResponseCode.not_found
             api_response.error_msg = "Invalid geid for dataset"
@@ -136,7 +145,7 @@ class APIImportData:
 
         # validate the file IS from the dataset 
         delete_list = request_payload.source_list
-        delete_list, wrong_file = self.validate_files_folders(delete_list, dataset_geid, "Dataset")
+        delete_list, wrong_file = await self.validate_files_folders(delete_list, dataset_geid, "Dataset")
         # fomutate the result
         api_response.result = {
             "processing": delete_list,
@@ -164,7 +173,7 @@ class APIImportData:
         api_response = APIResponse()
 
         # validate the dataset if exists
-        dataset_obj = get_node_by_geid(dataset_geid, "Dataset")
+        dataset_obj = await get_node_by_geid_async(dataset_geid, "Dataset")
         if dataset_obj == None:
             api_response.code = EAPIResponseCode.not_found
             api_response.error_msg = "Invalid geid for dataset"
@@ -188,14 +197,15 @@ class APIImportData:
             },
         }
 
-        response = requests.post(ConfigClass.NEO4J_SERVICE_V2 + "relations/query", json=relation_payload)
+        client = get_async_client(NEO4J)
+        response = await client.post(ConfigClass.NEO4J_SERVICE_V2 + "relations/query", json=relation_payload)
         file_folder_nodes = response.json().get("results", [])
         # print(file_folder_nodes)
 
         # then get the routing this will return as parent level
         # like admin->folder1->file1 in UI
         node_query_url = ConfigClass.NEO4J_SERVICE + "relations/connected/"+root_geid
-        response = requests.get(node_query_url, params={"direction":"input"})
+        response = await client.get(node_query_url, params={"direction":"input"})
         file_routing = response.json().get("result", [])
         ret_routing = [x for x in file_routing if "User" not in x.get("labels")]
 
@@ -221,7 +231,7 @@ class APIImportData:
         minio_refresh_token = refresh_token
 
         # validate the dataset if exists
-        dataset_obj = get_node_by_geid(dataset_geid, "Dataset")
+        dataset_obj = await get_node_by_geid_async(dataset_geid, "Dataset")
         if dataset_obj == None:
             api_response.code = EAPIResponseCode.not_found
             api_response.error_msg = "Invalid geid for dataset"
@@ -236,7 +246,7 @@ class APIImportData:
             target_minio_path = ""
             root_label = "Dataset"
         else:
-            target_folder = get_node_by_geid(request_payload.target_geid, "Folder")
+            target_folder = await get_node_by_geid_async(request_payload.target_geid, "Folder")
             if len(target_folder) == 0:
                 api_response.code = EAPIResponseCode.not_found
                 api_response.error_msg = "The target folder does not exist"
@@ -257,8 +267,8 @@ class APIImportData:
 
         # validate the file if it is under the dataset
         move_list = request_payload.source_list
-        move_list, wrong_file = self.validate_files_folders(move_list, dataset_geid, "Dataset")
-        duplicate, move_list = self.remove_duplicate_file(move_list, request_payload.target_geid, root_label)
+        move_list, wrong_file = await self.validate_files_folders(move_list, dataset_geid, "Dataset")
+        duplicate, move_list = await self.remove_duplicate_file(move_list, request_payload.target_geid, root_label)
         # fomutate the result
         api_response.result = {
             "processing": move_list,
@@ -289,7 +299,7 @@ class APIImportData:
         minio_access_token = Authorization
 
         # validate the dataset if exists
-        dataset_obj = get_node_by_geid(dataset_geid, "Dataset")
+        dataset_obj = await get_node_by_geid_async(dataset_geid, "Dataset")
         if dataset_obj == None:
             api_response.code = EAPIResponseCode.not_found
             api_response.error_msg = "Invalid geid for dataset"
@@ -299,12 +309,12 @@ class APIImportData:
 
         # validate the file IS from the dataset 
         # rename to same name will be blocked
-        rename_list, wrong_file = self.validate_files_folders([target_file], dataset_geid, "Dataset")
+        rename_list, wrong_file = await self.validate_files_folders([target_file], dataset_geid, "Dataset")
         # check if there is a file under the folder
-        parent_node = get_parent_node(get_node_by_geid(target_file))
+        parent_node = await get_parent_node_async(await get_node_by_geid_async(target_file))
         pgeid = parent_node.get("global_entity_id")
         root_label = parent_node.get("labels")[0]
-        duplicate, _ = self.remove_duplicate_file([{"name":new_name}], pgeid, root_label)
+        duplicate, _ = await self.remove_duplicate_file([{"name":new_name}], pgeid, root_label)
 
         # cannot rename to self
         if len(duplicate) > 0:
@@ -338,7 +348,7 @@ class APIImportData:
     # function will return two list: 
     # - passed_file is the validated file
     # - not_passed_file is not under the target node
-    def validate_files_folders(self, ff_list, root_geid, root_label):
+    async def validate_files_folders(self, ff_list, root_geid, root_label):
 
         passed_file = []
         not_passed_file = []
@@ -347,9 +357,15 @@ class APIImportData:
         # and in the duplicate_in_batch_dict it will be {"geid": array_index}
         # and this can help to trace back when duplicate occur
         array_index = 0
+
+        # fetch all the nodes and check the connection to root in bulk
+        # instead of two neo4j calls for each geid in the list
+        node_map = {x.get("global_entity_id"):x for x in await get_nodes_by_geids_async(ff_list)}
+        connected_geids = await get_connected_geids_async(root_geid, root_label, list(node_map.keys()))
+
         for ff in ff_list:
             # fetch the current node
-            current_node = get_node_by_geid(ff)
+            current_node = node_map.get(ff)
             # if not exist skip the node
             if not current_node:
                 not_passed_file.append({
@@ -357,22 +373,12 @@ class APIImportData:
                     "feedback": "not exists"
                 })
                 continue
-
-            relation_payload={
-                "label": "own*",
-                "start_label": root_label,
-                "end_label": current_node.get("labels", []),
-                "start_params": {"global_entity_id":root_geid},
-                "end_params": {"global_entity_id":current_node.get("global_entity_id", None)}
-            }
-
-            response = requests.post(ConfigClass.NEO4J_SERVICE + "relations/query", json=relation_payload)
-            file_folder_nodes = response.json()
-
+            # copy here since the same geid can be in the list twice
+            current_node = dict(current_node)
 
             # if there is no connect then the node is not correct
             # else it is correct
-            if len(file_folder_nodes) == 0:
+            if ff not in connected_geids:
                 not_passed_file.append({
                     "global_entity_id": ff,
                     "feedback": "unauthorized"
@@ -429,10 +435,25 @@ class APIImportData:
     # the function will reuse the <validate_files_folders> to check 
     # if the file already exist directly under the root node
     # return True if duplicate else false
-    def remove_duplicate_file(self, ff_list, root_geid, root_label):
+    # - with bulk=True the children names of root node will be fetched
+    #   once and the check is done in memory
+    # - with bulk=False it will query neo4j for each name
+    async def remove_duplicate_file(self, ff_list, root_geid, root_label, bulk=True):
 
         duplic_file = []
         not_duplic_file = []
+
+        if bulk:
+            children_names = set([x.get("name") for x in await get_children_nodes_async(root_geid, root_label)])
+            for current_node in ff_list:
+                if current_node.get("name", None) not in children_names:
+                    not_duplic_file.append(current_node)
+                else:
+                    current_node.update({"feedback":"duplicate or unauthorized"})
+                    duplic_file.append(current_node)
+
+            return duplic_file, not_duplic_file
+
         for current_node in ff_list:
             # here we dont check if node is None since
             # the previous function already check it
@@ -446,8 +467,9 @@ class APIImportData:
                 }
             }
 
-            response = requests.post(ConfigClass.NEO4J_SERVICE + "relations/query", 
-                data=json.dumps(relation_payload).encode('utf-8'),
+            client = get_async_client(NEO4J)
+            response = await client.post(ConfigClass.NEO4J_SERVICE + "relations/query", 
+                content=json.dumps(relation_payload).encode('utf-8'),
                 headers={"Content-Type": "application/json"})
             file_folder_nodes = response.json()
 
@@ -465,7 +487,7 @@ class APIImportData:
     # match (n)-[r:own*]->(f) where n.global_entity_id="9ff8382d-f476-4cdf-a357-66c4babf8320-1626104650" delete 
     # FOREACH(r), f
     def send_notification(self, session_id, source_list, action, \
-        status, dataset_geid, operator, task_id, payload={}):
+        status, dataset_geid, operator, task_id, payload={}, pipeline_id=None):
         
         url = ConfigClass.QUEUE_SERVICE + "broker/pub"
         post_json = {
@@ -489,6 +511,13 @@ class APIImportData:
                 "type": "fanout"
             }
         }
+
+        # the buffered task will send the notification in background
+        pipeline = get_pipeline(pipeline_id)
+        if pipeline:
+            pipeline.add(NOTIFY, source_list.get("global_entity_id"), post_json)
+            return
+
         res = requests.post(url, json=post_json)
         if res.status_code != 200:
             raise Exception('send_notification() {}: {}'.format(res.status_code, res.text))
@@ -497,12 +526,13 @@ class APIImportData:
 
     # 
     def create_job_status(self, session_id, source_file, action, \
-        status, dataset, operator, task_id, payload={}):
+        status, dataset, operator, task_id, payload={}, pipeline_id=None):
 
         # first send the notification
         dataset_geid = dataset.get("global_entity_id")
         dataset_code = dataset.get("code")
-        self.send_notification(session_id, source_file, action, status, dataset_geid, operator, task_id)
+        self.send_notification(session_id, source_file, action, status, dataset_geid, operator, task_id, \
+            pipeline_id=pipeline_id)
 
         # also save to redis for display
         source_geid = source_file.get("global_entity_id")
@@ -520,6 +550,12 @@ class APIImportData:
             "operator": operator,
             "payload": source_file,
         }
+
+        pipeline = get_pipeline(pipeline_id)
+        if pipeline:
+            pipeline.add(CREATE, job_id, post_json)
+            return {source_geid:job_id}
+
         res = requests.post(task_url, json=post_json)
         if res.status_code != 200:
             raise Exception('save redis error {}: {}'.format(res.status_code, res.text))
@@ -528,12 +564,12 @@ class APIImportData:
 
 
     def update_job_status(self, session_id, source_file, action, \
-        status, dataset, operator, task_id, job_id, payload={}):
+        status, dataset, operator, task_id, job_id, payload={}, pipeline_id=None):
 
         # first send the notification
         dataset_geid = dataset.get("global_entity_id")
         self.send_notification(session_id, source_file, action, status, dataset_geid, \
-            operator, task_id, payload)
+            operator, task_id, payload, pipeline_id=pipeline_id)
 
         # also save to redis for display
         task_url = ConfigClass.DATA_UTILITY_SERVICE + "tasks"
@@ -545,6 +581,12 @@ class APIImportData:
             "status": status,
             "add_payload":payload,
         }
+
+        pipeline = get_pipeline(pipeline_id)
+        if pipeline:
+            pipeline.add(UPDATE, job_id, post_json)
+            return
+
         res = requests.put(task_url, json=post_json)
         if res.status_code != 200:
             raise Exception('save redis error {}: {}'.format(res.status_code, res.text))
@@ -568,11 +610,17 @@ class APIImportData:
             "session_id": session_id,
             "task_id": task_id, 
             "action": action,
-            "job_id":{}
+            "job_id":{},
+            "pipeline_id": None,
         }
+        # buffer the status of this task, the worker closes it when done.
+        # the task id is not unique(same action in the same second) so the
+        # pipeline is tracked by its own id
+        if ConfigClass.JOB_STATUS_BUFFERED:
+            job_tracker["pipeline_id"] = open_pipeline(task_id)
         for file_object in batch_list:
             tracker = self.create_job_status(session_id, file_object, action, \
-                "INIT", dataset_obj, oper, task_id)
+                "INIT", dataset_obj, oper, task_id, pipeline_id=job_tracker["pipeline_id"])
             job_tracker["job_id"].update(tracker)
 
         return job_tracker
@@ -580,84 +628,265 @@ class APIImportData:
 ###########################################################################################
 
     def recursive_copy(self, currenct_nodes, dataset, oper, current_root_path, \
-        parent_node, access_token, refresh_token, job_tracker=None, new_name=None):
+        parent_node, access_token, refresh_token, job_tracker=None, new_name=None, tree=None, \
+        copy_pool=None):
+
+        # create the whole tree in batches if bulk mode is on and
+        # the neo4j service has the batch apis
+        if ConfigClass.NEO4J_BULK_CREATE and copy_pool is None and bulk_create_supported():
+            return self.bulk_copy(currenct_nodes, dataset, oper, current_root_path, parent_node, \
+                access_token, refresh_token, job_tracker, new_name, tree)
+
+        # fetch the whole source tree once if caller doesnot provide it
+        if tree is None:
+            tree = get_subtree(currenct_nodes)
+
+        # the top level call owns the copy pool. the minio copies of the
+        # whole tree run in the pool and are waited at the end
+        owns_pool = copy_pool is None
+        if owns_pool:
+            copy_pool = MinioCopyPool(access_token, refresh_token)
 
         num_of_files = 0
         total_file_size = 0
         # this variable DOESNOT contain the child nodes
         new_lv1_nodes = []
+        # the first level file/folder to be marked as finished after copy
+        finished = []
+        copied = False
 
-        # copy the files under the project neo4j node to dataset node
-        for ff_object in currenct_nodes:
-            ff_geid = ff_object.get("global_entity_id")
-            new_node = None
+        try:
+            # copy the files under the project neo4j node to dataset node
+            for ff_object in currenct_nodes:
+                ff_geid = ff_object.get("global_entity_id")
+                new_node = None
+
+                # update here if the folder/file is archieved then skip
+                if ff_object.get("archived", False):
+                    continue
+
+                # here ONLY the first level file/folder will trigger the notification&job status
+                if job_tracker:
+                    job_id = job_tracker["job_id"].get(ff_geid)
+                    self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
+                        "RUNNING", dataset, oper, job_tracker["task_id"], job_id, pipeline_id=job_tracker.get("pipeline_id"))
+
+                # the copies under this node will be reported to its job
+                if owns_pool:
+                    copy_pool.group = ff_geid
+
+                ################################################################################################
+                # recursive logic below
+
+                if 'File' in ff_object.get("labels"):
+                    # create the copied node, the minio copy is sent to the pool
+                    new_node, _ = create_file_node(dataset.get("code"), ff_object, oper, parent_node.get('id'), \
+                        current_root_path, access_token, refresh_token, new_name, copy_pool=copy_pool)
+                    # update for number and size
+                    num_of_files += 1; total_file_size += ff_object.get("file_size", 0)
+                    new_lv1_nodes.append(new_node)
+
+                # else it is folder will trigger the recursive
+                elif 'Folder' in ff_object.get("labels"):
+
+                    # first create the folder
+                    new_node, _ = create_folder_node(dataset.get("code"), ff_object, oper, \
+                        parent_node, current_root_path, new_name)
+                    new_lv1_nodes.append(new_node)
+
+                    # seconds recursively go throught the folder/subfolder by same proccess
+                    # also if we want the folder to be renamed if new_name is not None
+                    next_root = current_root_path+"/"+(new_name if new_name else ff_object.get("name"))
+                    children_nodes = tree.get_children(ff_geid)
+                    num_of_child_files, num_of_child_size, _ = \
+                        self.recursive_copy(children_nodes, dataset, oper, next_root, new_node, \
+                            access_token, refresh_token, tree=tree, copy_pool=copy_pool)
+
+                    # append the log together
+                    num_of_files += num_of_child_files
+                    total_file_size += num_of_child_size
+                ##########################################################################################################
+
+                finished.append((ff_object, new_node))
+
+            if not owns_pool:
+                return num_of_files, total_file_size, new_lv1_nodes
+
+            failures = copy_pool.wait()
+            copied = not failures
+        finally:
+            if owns_pool:
+                copy_pool.shutdown()
+                if not copied and not job_tracker:
+                    self.remove_copied_nodes(new_lv1_nodes, dataset, oper, parent_node, \
+                        access_token, refresh_token)
 
-            # update here if the folder/file is archieved then skip
-            if ff_object.get("archived", False):
-                continue
+        self.report_copy_jobs(finished, failures, dataset, oper, job_tracker)
 
-            # here ONLY the first level file/folder will trigger the notification&job status
-            if job_tracker:
+        return num_of_files, total_file_size, new_lv1_nodes
+
+
+    def remove_copied_nodes(self, new_nodes, dataset, oper, parent_node, access_token, refresh_token):
+        '''
+        Summary:
+            without job tracker(move/rename) the failed copy will stop the
+            job before the source is deleted. Remove the nodes and objects
+            created in the target so the half copied tree is not left there
+        Parameter:
+            - new_nodes: the first level nodes created by the copy
+            - parent_node: the target folder/dataset node
+        '''
+        if not new_nodes:
+            return
+
+        try:
+            self.recursive_delete(new_nodes, dataset, oper, parent_node, access_token, refresh_token)
+        except Exception as e:
+            self.__logger.error("error when removing the copied nodes: %s"%str(e))
+
+
+    def report_copy_jobs(self, finished, failures, dataset, oper, job_tracker=None):
+        '''
+        Summary:
+            mark the first level file/folder of copy as done after all
+            the minio copies are finished
+        Parameter:
+            - finished: list of tuple(<source node>, <new node>)
+            - failures: the failed copies by first level geid from copy pool
+        '''
+        # without job tracker(move/rename) the source will be deleted after
+        # copy, so stop here if any of the file is not copied
+        if failures and not job_tracker:
+            raise Exception("Failed to copy the files: %s"%failures)
+
+        # here after all use the geid to mark the job done for either first level folder/file
+        # the file failed in copy will be cancelled and the folder will include the failed
+        # files in the payload
+        if job_tracker:
+            for ff_object, new_node in finished:
+                ff_geid = ff_object.get("global_entity_id")
                 job_id = job_tracker["job_id"].get(ff_geid)
+                failed_files = failures.get(ff_geid)
+                if failed_files and 'File' in ff_object.get("labels"):
+                    self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
+                        "CANCELLED", dataset, oper, job_tracker["task_id"], job_id, \
+                        payload={"err_message": failed_files[0].get("err_message")}, pipeline_id=job_tracker.get("pipeline_id"))
+                    continue
+
+                payload = dict(new_node, failed_files=failed_files) if failed_files else new_node
                 self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
-                    "RUNNING", dataset, oper, job_tracker["task_id"], job_id)
-            
-            ################################################################################################
-            # recursive logic below
-            
-            if 'File' in ff_object.get("labels"):
-                # TODO simplify here
-                minio_path = ff_object.get('location').split("//")[-1]
-                _, bucket, old_path = tuple(minio_path.split("/", 2))
-                
-                # create the copied node
-                new_node, _ = create_file_node(dataset.get("code"), ff_object, oper, parent_node.get('id'), \
-                    current_root_path, access_token, refresh_token, new_name) 
-                # update for number and size
-                num_of_files += 1; total_file_size += ff_object.get("file_size", 0)
-                new_lv1_nodes.append(new_node)
+                    "FINISH", dataset, oper, job_tracker["task_id"], job_id, payload=payload, pipeline_id=job_tracker.get("pipeline_id"))
 
-            # else it is folder will trigger the recursive
-            elif 'Folder' in ff_object.get("labels"):
-                
-                # first create the folder
-                new_node, _ = create_folder_node(dataset.get("code"), ff_object, oper, \
-                    parent_node, current_root_path, new_name)
-                new_lv1_nodes.append(new_node)
-
-                # seconds recursively go throught the folder/subfolder by same proccess
-                # also if we want the folder to be renamed if new_name is not None
-                next_root = current_root_path+"/"+(new_name if new_name else ff_object.get("name"))
-                children_nodes = get_children_nodes(ff_geid)
-                num_of_child_files, num_of_child_size, _ = \
-                    self.recursive_copy(children_nodes, dataset, oper, next_root, new_node, \
-                        access_token, refresh_token)
 
-                # append the log together
-                num_of_files += num_of_child_files
-                total_file_size += num_of_child_size
-            ##########################################################################################################
+    def bulk_copy(self, currenct_nodes, dataset, oper, current_root_path, parent_node, \
+        access_token, refresh_token, job_tracker=None, new_name=None, tree=None):
+        '''
+        Summary:
+            the bulk version of recursive_copy(NEO4J_BULK_CREATE). The copied
+            tree is built level by level, for each level the geids, nodes and
+            "own" relations are created in batches instead of 3 calls per node
+        Return:
+            same as recursive_copy
+        '''
+        if tree is None:
+            tree = get_subtree(currenct_nodes)
 
+        code = dataset.get("code")
+        num_of_files = 0
+        total_file_size = 0
+        # old geid -> new node, used for the first level payload
+        new_nodes = {}
+        first_level = [x for x in currenct_nodes if not x.get("archived", False)]
 
-            # here after all use the geid to mark the job done for either first level folder/file
-            # if the geid is not in the tracker then it is child level ff. ignore them
-            if job_tracker:
-                job_id = job_tracker["job_id"].get(ff_geid)
+        # here ONLY the first level file/folder will trigger the notification&job status
+        if job_tracker:
+            for ff_object in first_level:
+                job_id = job_tracker["job_id"].get(ff_object.get("global_entity_id"))
                 self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
-                    "FINISH", dataset, oper, job_tracker["task_id"], job_id, payload=new_node)
+                    "RUNNING", dataset, oper, job_tracker["task_id"], job_id, pipeline_id=job_tracker.get("pipeline_id"))
 
-        return num_of_files, total_file_size, new_lv1_nodes
+        copy_pool = MinioCopyPool(access_token, refresh_token)
+        copied = False
+        try:
+            # each item is tuple(<source node>, <new parent node>, <relative path>,
+            # <new name>, <first level geid for the job>)
+            level = [(x, parent_node, current_root_path, new_name, x.get("global_entity_id")) \
+                for x in first_level]
+            while level:
+                geids = get_geid_batch(len(level))
+                files, folders = [], []
+                for (ff_object, parent, path, name, group), geid in zip(level, geids):
+                    if 'File' in ff_object.get("labels"):
+                        attribute = build_file_attribute(code, ff_object, oper, path, geid, name)
+                        files.append((ff_object, parent, attribute, group))
+                    elif 'Folder' in ff_object.get("labels"):
+                        attribute = build_folder_attribute(code, ff_object, oper, parent, path, geid, name)
+                        folders.append((ff_object, parent, attribute, group))
+
+                next_level = []
+                if folders:
+                    created = create_nodes_with_parent_batch("Folder", [x[2] for x in folders], \
+                        [x[1].get("id") for x in folders])
+                    for (ff_object, _, attribute, group), new_node in zip(folders, created):
+                        new_nodes[ff_object.get("global_entity_id")] = new_node
+                        next_root = attribute.get("display_path")
+                        for child in tree.get_children(ff_object.get("global_entity_id")):
+                            if not child.get("archived", False):
+                                next_level.append((child, new_node, next_root, None, group))
+
+                if files:
+                    created = create_nodes_with_parent_batch("File", [x[2] for x in files], \
+                        [x[1].get("id") for x in files])
+                    for (ff_object, _, attribute, group), new_node in zip(files, created):
+                        new_nodes[ff_object.get("global_entity_id")] = new_node
+                        num_of_files += 1; total_file_size += ff_object.get("file_size", 0)
+
+                        # minio location is minio://http://<end_point>/bucket/user/object_path
+                        minio_path = ff_object.get('location').split("//")[-1]
+                        _, bucket, obj_path = tuple(minio_path.split("/", 2))
+                        copy_pool.group = group
+                        copy_pool.copy_object(code, attribute.get("display_path"), bucket, obj_path, \
+                            ff_object.get("file_size", -1))
+
+                level = next_level
+
+            failures = copy_pool.wait()
+            copied = not failures
+        finally:
+            copy_pool.shutdown()
+            if not copied and not job_tracker:
+                self.remove_copied_nodes([new_nodes[x.get("global_entity_id")] for x in first_level \
+                    if x.get("global_entity_id") in new_nodes], dataset, oper, parent_node, \
+                    access_token, refresh_token)
+
+        finished = [(x, new_nodes.get(x.get("global_entity_id"))) for x in first_level]
+        self.report_copy_jobs(finished, failures, dataset, oper, job_tracker)
+
+        return num_of_files, total_file_size, [x[1] for x in finished if x[1]]
 
 
     def recursive_delete(self, currenct_nodes, dataset, oper, parent_node, \
-        access_token, refresh_token, job_tracker=None):
+        access_token, refresh_token, job_tracker=None, tree=None, object_keys=None):
+
+        # fetch the whole tree once if caller doesnot provide it
+        if tree is None:
+            tree = get_subtree(currenct_nodes)
+
+        # the top level call collects the minio objects of whole tree
+        # and removes them in batch at the end
+        owns_keys = object_keys is None
+        if owns_keys:
+            object_keys = []
 
         num_of_files = 0
         total_file_size = 0
+        # the first level file/folder with the range of its objects in object_keys
+        finished = []
 
         # copy the files under the project neo4j node to dataset node
         for ff_object in currenct_nodes:
             ff_geid = ff_object.get("global_entity_id")
+            first_key = len(object_keys)
 
             # update here if the folder/file is archieved then skip
             if ff_object.get("archived", False):
@@ -667,21 +896,17 @@ class APIImportData:
             if job_tracker:
                 job_id = job_tracker["job_id"].get(ff_geid)
                 self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
-                    "RUNNING", dataset, oper, job_tracker["task_id"], job_id)
+                    "RUNNING", dataset, oper, job_tracker["task_id"], job_id, pipeline_id=job_tracker.get("pipeline_id"))
             
             ################################################################################################
             # recursive logic below
             if 'File' in ff_object.get("labels"):
 
-                # lock the resource
-                # minio location is minio://http://<end_point>/bucket/user/object_path
-                minio_path = ff_object.get('location').split("//")[-1]
-                _, bucket, obj_path = tuple(minio_path.split("/", 2))
-
                 # for file we can just disconnect and delete
+                # the minio object is collected into object_keys
                 # TODO MOVE OUTSIDE <=============================================================
                 delete_relation_bw_nodes(parent_node.get("id"), ff_object.get("id"))
-                delete_node(ff_object, access_token, refresh_token)
+                delete_node(ff_object, access_token, refresh_token, object_keys=object_keys)
                 
                 # update for number and size
                 num_of_files += 1; total_file_size += ff_object.get("file_size", 0)
@@ -691,9 +916,10 @@ class APIImportData:
                 
                 # for folder, we have to disconnect all child node then
                 # disconnect it from parent
-                children_nodes = get_children_nodes(ff_object.get("global_entity_id"))
+                children_nodes = tree.get_children(ff_object.get("global_entity_id"))
                 num_of_child_files, num_of_child_size = \
-                    self.recursive_delete(children_nodes, dataset, oper, ff_object, access_token, refresh_token)
+                    self.recursive_delete(children_nodes, dataset, oper, ff_object, access_token, \
+                        refresh_token, tree=tree, object_keys=object_keys)
 
                 # after the child has been deleted then we disconnect current node
                 delete_relation_bw_nodes(parent_node.get("id"), ff_object.get("id"))
@@ -704,12 +930,39 @@ class APIImportData:
                 total_file_size += num_of_child_size
             ##########################################################################################
 
-            # here after all use the geid to mark the job done for either first level folder/file
-            # if the geid is not in the tracker then it is child level ff. ignore them
-            if job_tracker:
-                job_id = job_tracker["job_id"].get(ff_geid)
+            finished.append((ff_object, first_key, len(object_keys)))
+
+        if not owns_keys:
+            return num_of_files, total_file_size
+
+        # remove all the minio objects with multi-object delete. The nodes
+        # are deleted already, so the error is reported with the files
+        # instead of stopping the job
+        try:
+            mc = get_minio_client(access_token, refresh_token)
+            failed = {x.get("target"): x for x in mc.delete_objects(object_keys)}
+        except Exception as e:
+            failed = {"%s/%s"%x: {"target": "%s/%s"%x, "err_message": str(e)} for x in object_keys}
+        if failed:
+            self.__logger.error("error when deleting: %s"%list(failed.values()))
+
+        # here after all use the geid to mark the job done for either first level folder/file
+        # the file failed to be removed will be cancelled and the folder will include the
+        # failed files in the payload
+        if job_tracker:
+            for ff_object, first_key, last_key in finished:
+                job_id = job_tracker["job_id"].get(ff_object.get("global_entity_id"))
+                failed_files = [failed.get("%s/%s"%x) for x in object_keys[first_key:last_key] \
+                    if "%s/%s"%x in failed]
+                if failed_files and 'File' in ff_object.get("labels"):
+                    self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
+                        "CANCELLED", dataset, oper, job_tracker["task_id"], job_id, \
+                        payload={"err_message": failed_files[0].get("err_message")}, pipeline_id=job_tracker.get("pipeline_id"))
+                    continue
+
+                payload = {"failed_files": failed_files} if failed_files else {}
                 self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
-                    "FINISH", dataset, oper, job_tracker["task_id"], job_id)
+                    "FINISH", dataset, oper, job_tracker["task_id"], job_id, payload=payload, pipeline_id=job_tracker.get("pipeline_id"))
 
         return num_of_files, total_file_size
 
@@ -722,15 +975,21 @@ class APIImportData:
         action = "dataset_file_import"
         job_tracker = self.initialize_file_jobs(session_id, action, import_list, dataset_obj, oper)
         root_path = ConfigClass.DATASET_FILE_FOLDER
+        locked_node = []
 
         try:
+            # snapshot the source tree once so the lock and the copy
+            # go through exactly the same nodes
+            tree = get_subtree(import_list)
+
             # mark the source tree as read, destination as write
-            locked_node, err = recursive_lock_import(dataset_obj.get("code"), import_list, root_path)
+            locked_node, err = recursive_lock_import(dataset_obj.get("code"), import_list, \
+                root_path, tree=tree)
             if err: raise err
 
             # recursively go throught the folder level by level
             num_of_files, total_file_size, _ = self.recursive_copy(import_list, dataset_obj, \
-                oper, root_path, dataset_obj, access_token, refresh_token, job_tracker)
+                oper, root_path, dataset_obj, access_token, refresh_token, job_tracker, tree=tree)
 
             # after all update the file number/total size/project geid
             srv_dataset = SrvDatasetMgr()
@@ -754,11 +1013,14 @@ class APIImportData:
             for ff_object in import_list:
                 job_id = job_tracker["job_id"].get(ff_object.get("global_entity_id"))
                 self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
-                    "CANCELLED", dataset_obj, oper, job_tracker["task_id"], job_id, payload=error_message)
+                    "CANCELLED", dataset_obj, oper, job_tracker["task_id"], job_id, payload=error_message, pipeline_id=job_tracker.get("pipeline_id"))
         finally:
             # unlock the nodes if we got blocked
-            for resource_key, operation in locked_node:
-                unlock_resource(resource_key, operation)
+            failed_unlock = bulk_unlock_resource(locked_node)
+            if failed_unlock:
+                self.__logger.error("Failed to unlock resources of task %s: %s"%(job_tracker["task_id"], failed_unlock))
+            # send out the buffered job status
+            close_pipeline(job_tracker["pipeline_id"])
 
         return
 
@@ -776,23 +1038,28 @@ class APIImportData:
         parent_node = target_folder
         parent_path = parent_node.get("folder_relative_path", None)
         parent_path = parent_path+"/"+parent_node.get("name") if parent_path else ConfigClass.DATASET_FILE_FOLDER
+        locked_node = []
 
         try:
+            # snapshot the source tree once and share it with lock/copy/delete
+            tree = get_subtree(move_list)
+
             # then we mark both source node tree and target nodes as write
-            locked_node, err = recursive_lock_move_rename(move_list, parent_path)
+            locked_node, err = recursive_lock_move_rename(move_list, parent_path, tree=tree)
             if err: raise err
 
             # but note here the job tracker is not pass into the function
             # we only let the delete to state the finish
             _, _, _ = self.recursive_copy(move_list, dataset_obj, oper, parent_path, parent_node, \
-                access_token, refresh_token)
+                access_token, refresh_token, tree=tree)
 
             # delete the old one 
             self.recursive_delete(move_list, dataset_obj, oper, parent_node, \
-                access_token, refresh_token, job_tracker=job_tracker)
+                access_token, refresh_token, job_tracker=job_tracker, tree=tree)
 
-            # generate the activity log
+            # generate the activity log, all the moves are sent in one message
             dff = ConfigClass.DATASET_FILE_FOLDER+"/"
+            act_batch = self.file_act_notifier.batch()
             for ff_geid in move_list:
                 if "File" in ff_geid.get("labels"):
                     # minio location is minio://http://<end_point>/bucket/user/object_path
@@ -813,7 +1080,8 @@ class APIImportData:
                     new_path = new_path.replace(dff, "", 1)
                 
                 # send to the es for logging
-                self.file_act_notifier.on_move_event(dataset_geid, oper, old_path, new_path)
+                act_batch.on_move_event(dataset_geid, oper, old_path, new_path)
+            act_batch.send()
 
         except Exception as e:
             # here batch deny the operation
@@ -822,11 +1090,14 @@ class APIImportData:
             for ff_object in move_list:
                 job_id = job_tracker["job_id"].get(ff_object.get("global_entity_id"))
                 self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
-                    "CANCELLED", dataset_obj, oper, job_tracker["task_id"], job_id, payload=error_message)
+                    "CANCELLED", dataset_obj, oper, job_tracker["task_id"], job_id, payload=error_message, pipeline_id=job_tracker.get("pipeline_id"))
         finally:
             # unlock the nodes if we got blocked
-            for resource_key, operation in locked_node:
-                unlock_resource(resource_key, operation)
+            failed_unlock = bulk_unlock_resource(locked_node)
+            if failed_unlock:
+                self.__logger.error("Failed to unlock resources of task %s: %s"%(job_tracker["task_id"], failed_unlock))
+            # send out the buffered job status
+            close_pipeline(job_tracker["pipeline_id"])
 
         return
 
@@ -837,14 +1108,18 @@ class APIImportData:
         deleted_files = [] # for logging action
         action = "dataset_file_delete"
         job_tracker = self.initialize_file_jobs(session_id, action, delete_list, dataset_obj, oper)
+        locked_node = []
 
         try:
+            # snapshot the tree once so the locked nodes are the deleted nodes
+            tree = get_subtree(delete_list)
+
             # mark both source&destination as write lock
-            locked_node, err = recursive_lock_delete(delete_list)
+            locked_node, err = recursive_lock_delete(delete_list, tree=tree)
             if err: raise err
 
             num_of_files, total_file_size = self.recursive_delete(delete_list, dataset_obj, \
-                oper, dataset_obj, access_token, refresh_token, job_tracker)
+                oper, dataset_obj, access_token, refresh_token, job_tracker, tree=tree)
 
             # TODO try to embed with the notification&job status
             # generate log path
@@ -892,11 +1167,14 @@ class APIImportData:
             for ff_object in delete_list:
                 job_id = job_tracker["job_id"].get(ff_object.get("global_entity_id"))
                 self.update_job_status(job_tracker["session_id"], ff_object, job_tracker["action"], \
-                    "CANCELLED", dataset_obj, oper, job_tracker["task_id"], job_id, payload=error_message)
+                    "CANCELLED", dataset_obj, oper, job_tracker["task_id"], job_id, payload=error_message, pipeline_id=job_tracker.get("pipeline_id"))
         finally:
             # unlock the nodes if we got blocked
-            for resource_key, operation in locked_node:
-                unlock_resource(resource_key, operation)
+            failed_unlock = bulk_unlock_resource(locked_node)
+            if failed_unlock:
+                self.__logger.error("Failed to unlock resources of task %s: %s"%(job_tracker["task_id"], failed_unlock))
+            # send out the buffered job status
+            close_pipeline(job_tracker["pipeline_id"])
 
         return
         
@@ -912,7 +1190,7 @@ class APIImportData:
         # since the renanme will be just one file set to the running now
         job_id = job_tracker["job_id"].get(old_file[0].get("global_entity_id"))
         self.update_job_status(job_tracker["session_id"], old_file[0], job_tracker["action"], \
-            "RUNNING", dataset_obj, oper, job_tracker["task_id"], job_id)
+            "RUNNING", dataset_obj, oper, job_tracker["task_id"], job_id, pipeline_id=job_tracker.get("pipeline_id"))
 
 
         # minio move update the arribute
@@ -920,24 +1198,29 @@ class APIImportData:
         parent_node = get_parent_node(old_file[0])
         parent_path = parent_node.get("folder_relative_path", None)
         parent_path = parent_path+"/"+parent_node.get("name") if parent_path else ConfigClass.DATASET_FILE_FOLDER
+        locked_node = []
 
         try:
+            # snapshot the tree once and share it with lock/copy/delete
+            tree = get_subtree(old_file)
+
             # then we mark both source node tree and target nodes as write
-            locked_node, err = recursive_lock_move_rename(old_file, parent_path, new_name=new_name)
+            locked_node, err = recursive_lock_move_rename(old_file, parent_path, new_name=new_name, \
+                tree=tree)
             if err: raise err
 
             # same here the job tracker is not pass into the function
             # we only let the delete to state the finish
             _, _, new_nodes = self.recursive_copy(old_file, dataset_obj, oper, parent_path, parent_node, \
-                access_token, refresh_token, new_name=new_name)
+                access_token, refresh_token, new_name=new_name, tree=tree)
 
             # delete the old one
             self.recursive_delete(old_file, dataset_obj, oper, parent_node, access_token, \
-                refresh_token)
+                refresh_token, tree=tree)
 
             # after deletion set the status using new node
             self.update_job_status(job_tracker["session_id"], old_file[0], job_tracker["action"], \
-                "FINISH", dataset_obj, oper, job_tracker["task_id"], job_id, new_nodes[0])
+                "FINISH", dataset_obj, oper, job_tracker["task_id"], job_id, new_nodes[0], pipeline_id=job_tracker.get("pipeline_id"))
 
             # update es & log
             dataset_geid = dataset_obj.get("global_entity_id")
@@ -952,11 +1235,14 @@ class APIImportData:
             # send the cannelled
             error_message={"err_message": str(e)}
             self.update_job_status(job_tracker["session_id"], old_file[0], job_tracker["action"], \
-                "CANCELLED", dataset_obj, oper, job_tracker["task_id"], job_id, payload=error_message)
+                "CANCELLED", dataset_obj, oper, job_tracker["task_id"], job_id, payload=error_message, pipeline_id=job_tracker.get("pipeline_id"))
         finally:
             # unlock the nodes if we got blocked
-            for resource_key, operation in locked_node:
-                unlock_resource(resource_key, operation)
+            failed_unlock = bulk_unlock_resource(locked_node)
+            if failed_unlock:
+                self.__logger.error("Failed to unlock resources of task %s: %s"%(job_tracker["task_id"], failed_unlock))
+            # send out the buffered job status
+            close_pipeline(job_tracker["pipeline_id"])
 
         return
 
@@ -0,0 +1,129 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import threading
+from collections import namedtuple
+from urllib.parse import unquote
+from minio.deleteobjects import DeleteError
+
+FakeStat = namedtuple("FakeStat", ["size", "content_type"])
+
+
+class FakeResponse:
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    '''
+    In memory minio client with the calls used by the multipart upload
+    stream and the version archive. The completed upload checks the s3
+    rule that every part except the last one is at least min_part_size
+    '''
+
+    def __init__(self, min_part_size):
+        self.min_part_size = min_part_size
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.reads = []
+        self.content_types = {}
+        self.copies = []
+        # the multi object delete: keys of each request, the error code
+        # by key and the bucket failing the whole request
+        self.delete_requests = []
+        self.delete_errors = {}
+        self.unavailable_buckets = set()
+        self.mutex = threading.Lock()
+
+    def put(self, bucket, obj, data, content_type=None):
+        self.objects[(bucket, obj)] = bytes(data)
+        self.content_types[(bucket, obj)] = content_type
+
+    def stat_object(self, bucket, obj):
+        return FakeStat(len(self.objects[(bucket, obj)]), self.content_types.get((bucket, obj)))
+
+    def copy_object(self, bucket, obj, source):
+        self.copies.append((bucket, obj))
+        self.put(bucket, obj, self.objects[(source.bucket_name, source.object_name)])
+
+    def remove_objects(self, bucket, delete_object_list):
+        # same as minio the request is sent when iterating the errors
+        names = [x._name for x in delete_object_list]
+        with self.mutex:
+            self.delete_requests.append((bucket, names))
+        if bucket in self.unavailable_buckets:
+            raise Exception("bucket %s is unavailable"%bucket)
+        for name in names:
+            code = self.delete_errors.get((bucket, name))
+            if code:
+                yield DeleteError(code, "delete failed", name, None)
+            else:
+                self.objects.pop((bucket, name), None)
+
+    def get_object(self, bucket, obj, offset=0, length=0):
+        data = self.objects[(bucket, obj)]
+        end = offset+length if length else len(data)
+        with self.mutex:
+            self.reads.append((bucket, obj, offset, end-offset))
+        return FakeResponse(data[offset:end])
+
+    def _create_multipart_upload(self, bucket, obj, headers):
+        upload_id = "upload-%d"%len(self.uploads)
+        self.uploads[upload_id] = {}
+        self.content_types[(bucket, obj)] = headers.get("Content-Type")
+        return upload_id
+
+    def _upload_part(self, bucket, obj, data, headers, upload_id, part_number):
+        with self.mutex:
+            self.uploads[upload_id][part_number] = bytes(data)
+        return "etag-%d"%part_number
+
+    def _upload_part_copy(self, bucket, obj, upload_id, part_number, headers):
+        source_bucket, source_obj = unquote(headers["x-amz-copy-source"]).lstrip("/").split("/", 1)
+        start, end = headers["x-amz-copy-source-range"].replace("bytes=", "").split("-")
+        data = self.objects[(source_bucket, source_obj)][int(start):int(end)+1]
+        with self.mutex:
+            self.uploads[upload_id][part_number] = data
+        return "etag-%d"%part_number, None
+
+    def _complete_multipart_upload(self, bucket, obj, upload_id, parts):
+        uploaded = self.uploads.pop(upload_id)
+        numbers = [x.part_number for x in parts]
+        if numbers != list(range(1, len(uploaded)+1)):
+            raise Exception("invalid part list %s"%numbers)
+        for number in numbers[:-1]:
+            if len(uploaded[number]) < self.min_part_size:
+                raise Exception("part %d is too small: %d"%(number, len(uploaded[number])))
+        self.objects[(bucket, obj)] = b"".join(uploaded[x] for x in numbers)
+
+    def _abort_multipart_upload(self, bucket, obj, upload_id):
+        self.uploads.pop(upload_id, None)
+        self.aborted.append(upload_id)
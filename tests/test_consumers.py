@@ -0,0 +1,318 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import json
+import threading
+import unittest
+from unittest import mock
+from app.consumer import consumers, consumer_dynamic
+from app.consumer.consumers import message_to_docs, bulk_callback
+from app.consumer.consumer_dynamic import ConsumerDynamic
+from app.models import import_data_model
+from app.models.import_data_model import SrvDatasetFileMgr, BATCH_EVENT_TYPE
+
+
+class TestActivityLogBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.published = []
+        patcher = mock.patch.object(SrvDatasetFileMgr, "_publish",
+            lambda mgr, event_type, payload: self.published.append((event_type, payload)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_01_events_packed_in_messages(self):
+        act_batch = SrvDatasetFileMgr().batch()
+        for i in range(5):
+            act_batch.on_move_event("dataset-geid", "admin", "a/%d"%i, "b/%d"%i)
+        act_batch.on_rename_event("dataset-geid", "admin", "c", "d")
+
+        with mock.patch.object(import_data_model.ConfigClass, "ACTIVITY_LOG_BATCH_SIZE", 4):
+            act_batch.send()
+
+        self.assertEqual([x[0] for x in self.published], [BATCH_EVENT_TYPE, BATCH_EVENT_TYPE])
+        events = self.published[0][1]["events"] + self.published[1][1]["events"]
+        self.assertEqual(len(events), 6)
+        self.assertEqual(len(set(x["act_geid"] for x in events)), 6)
+        self.assertEqual(events[0]["event_type"], "DATASET_FILE_MOVE_SUCCEED")
+        self.assertEqual(events[0]["action"], "MOVE")
+        self.assertEqual(events[-1]["detail"], {"from": "c", "to": "d"})
+        # nothing left to send
+        self.assertEqual(act_batch.send(), [])
+
+    def test_02_batch_message_expanded(self):
+        act_batch = SrvDatasetFileMgr().batch()
+        act_batch.on_delete_event("dataset-geid", "admin", ["a", "b"])
+        act_batch.on_move_event("dataset-geid", "admin", "c", "d")
+        act_batch.send()
+        msg = {"event_type": BATCH_EVENT_TYPE, "payload": self.published[0][1], "create_timestamp": 100.5}
+
+        docs = message_to_docs(msg)
+        self.assertEqual([x[0] for x in docs], [x["act_geid"] for x in msg["payload"]["events"]])
+        self.assertEqual(docs[0][1]["event_type"], "DATASET_FILE_DELETE_SUCCEED")
+        self.assertEqual(docs[0][1]["create_timestamp"], 100)
+        self.assertEqual(docs[1][1]["detail"], {"from": "c", "to": "d"})
+
+    def test_03_single_message(self):
+        payload = {"act_geid": "act-1", "operator": "admin", "dataset_geid": "dataset-geid", \
+            "action": "ADD", "resource": "Dataset", "detail": {}}
+        msg = {"event_type": "DATASET_FILE_IMPORT_SUCCEED", "payload": payload, "create_timestamp": 1}
+        docs = message_to_docs(msg)
+        self.assertEqual(len(docs), 1)
+        self.assertEqual(docs[0][0], "act-1")
+        self.assertEqual(docs[0][1]["event_type"], "DATASET_FILE_IMPORT_SUCCEED")
+
+
+def log_message(act_geid):
+    payload = {"act_geid": act_geid, "operator": "admin", "dataset_geid": "dataset-geid", \
+        "action": "ADD", "resource": "Dataset", "detail": {}}
+    return json.dumps({"event_type": "DATASET_FILE_IMPORT_SUCCEED", "payload": payload, \
+        "create_timestamp": 1})
+
+
+class TestBulkCallback(unittest.TestCase):
+
+    def test_01_one_bulk_request(self):
+        items = [{"create": {"status": 201}}, {"create": {"status": 409}}]
+        with mock.patch.object(consumers, "bulk_create", return_value={"items": items}) as bulk:
+            bulk_callback(None, [log_message("act-1"), "not json", log_message("act-2")], {})
+        self.assertEqual(bulk.call_count, 1)
+        self.assertEqual([x[0] for x in bulk.call_args[0][1]], ["act-1", "act-2"])
+
+    def test_02_retry_when_es_unavailable(self):
+        items = [{"create": {"status": 201}}, {"create": {"status": 429}}]
+        with mock.patch.object(consumers, "bulk_create", return_value={"items": items}):
+            with self.assertRaises(Exception):
+                bulk_callback(None, [log_message("act-1"), log_message("act-2")], {})
+        with mock.patch.object(consumers, "bulk_create", return_value={"error": "down"}):
+            with self.assertRaises(Exception):
+                bulk_callback(None, [log_message("act-1")], {})
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.timers = {}
+        self.next_id = 0
+
+    def call_later(self, delay, callback):
+        self.next_id += 1
+        self.timers[self.next_id] = (delay, callback)
+        return self.next_id
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+    def remove_timeout(self, timer_id):
+        self.timers.pop(timer_id, None)
+
+    def fire(self):
+        timers, self.timers = self.timers, {}
+        for _, callback in timers.values():
+            callback()
+
+
+class TestBatchConsumer(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.threads = []
+        self.fail = False
+        self.connection = FakeConnection()
+        self.channel = mock.Mock()
+
+        def callback(ch, bodies, context):
+            self.batches.append(bodies)
+            self.threads.append(threading.current_thread())
+            if self.fail:
+                raise Exception("elastic search is down")
+
+        consumer = ConsumerDynamic("test", "queue", "", "exchange", "fanout")
+        consumer.set_batch_callback(callback, batch_size=3, batch_timeout=1.0)
+        self.executor = consumer._consume_batch(self.connection, self.channel, "queue")
+        self.on_message = self.channel.basic_consume.call_args[1]["on_message_callback"]
+
+    def deliver(self, *tags, headers=None):
+        for tag in tags:
+            properties = mock.Mock(headers=headers)
+            self.on_message(self.channel, mock.Mock(delivery_tag=tag), properties, "msg-%d"%tag)
+        # wait for the worker
+        self.executor.submit(lambda: None).result()
+
+    def fire(self):
+        self.connection.fire()
+        self.executor.submit(lambda: None).result()
+
+    def published(self):
+        return [(x[1]["routing_key"], x[1]["body"], x[1]["properties"].headers) \
+            for x in self.channel.basic_publish.call_args_list]
+
+    def test_01_ack_by_size_and_timeout(self):
+        self.deliver(1, 2, 3, 4)
+        self.assertEqual(self.batches, [["msg-1", "msg-2", "msg-3"]])
+        self.channel.basic_ack.assert_called_with(delivery_tag=3, multiple=True)
+
+        self.fire()
+        self.assertEqual(self.batches[-1], ["msg-4"])
+        self.channel.basic_ack.assert_called_with(delivery_tag=4, multiple=True)
+        self.assertEqual(self.connection.timers, {})
+
+    def test_02_callback_in_worker(self):
+        # the bulk request does not block the heartbeats of connection
+        self.deliver(1, 2, 3)
+        self.assertEqual(len(self.threads), 1)
+        self.assertIsNot(self.threads[0], threading.current_thread())
+
+    def test_03_retry_with_header_after_backoff(self):
+        self.fail = True
+        with mock.patch.object(consumer_dynamic.ConfigClass, "CONSUMER_RETRY_DELAY", 2), \
+            mock.patch.object(consumer_dynamic.ConfigClass, "CONSUMER_RETRY_MAX_DELAY", 5):
+            self.deliver(1, 2, 3, headers={"trace": "a"})
+            # the batch is held until the backoff
+            self.channel.basic_publish.assert_not_called()
+            self.channel.basic_ack.assert_not_called()
+            self.channel.basic_nack.assert_not_called()
+            self.assertEqual([x[0] for x in self.connection.timers.values()], [2])
+
+            # no flush during the backoff
+            self.deliver(4, 5, 6)
+            self.assertEqual(len(self.batches), 1)
+
+            self.fire()
+            self.assertEqual(self.published(), [
+                ("queue", "msg-%d"%x, {"trace": "a", "x-retry": 1}) for x in (1, 2, 3)])
+            self.channel.basic_ack.assert_called_with(delivery_tag=3, multiple=True)
+            # the messages arrived during backoff are flushed and failed again
+            self.assertEqual(self.batches[-1], ["msg-4", "msg-5", "msg-6"])
+            self.assertEqual([x[0] for x in self.connection.timers.values()], [4])
+
+            self.fire()
+            self.deliver(7, 8, 9)
+            self.assertEqual([x[0] for x in self.connection.timers.values()], [5])
+
+            # the failure count is reset after success
+            self.fail = False
+            self.fire()
+            self.deliver(10, 11, 12)
+            self.channel.basic_ack.assert_called_with(delivery_tag=12, multiple=True)
+            self.fail = True
+            self.deliver(13, 14, 15)
+            self.assertEqual([x[0] for x in self.connection.timers.values()], [2])
+
+    def test_04_dead_letter_after_max_retries(self):
+        self.fail = True
+        with mock.patch.object(consumer_dynamic.ConfigClass, "CONSUMER_MAX_RETRIES", 3):
+            self.deliver(1, 2, headers={"x-retry": 3})
+            self.deliver(3, headers={"x-retry": 1})
+            self.fire()
+        self.assertEqual(self.published(), [
+            ("queue.dead", "msg-1", {"x-retry": 3, "x-error": "elastic search is down"}),
+            ("queue.dead", "msg-2", {"x-retry": 3, "x-error": "elastic search is down"}),
+            ("queue", "msg-3", {"x-retry": 2}),
+        ])
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=3, multiple=True)
+        self.channel.queue_declare.assert_called_with(queue="queue.dead")
+
+
+class TestManualAckConsumer(unittest.TestCase):
+
+    def setUp(self):
+        self.fail = False
+        self.connection = FakeConnection()
+        self.channel = mock.Mock()
+
+        def callback(ch, method, properties, body, context):
+            if self.fail:
+                raise Exception("elastic search is down")
+
+        consumer = ConsumerDynamic("test", "queue", "", "exchange", "fanout")
+        consumer.set_callback(callback, manual_ack=True, workers=1)
+        self.executor = consumer._consume_manual(self.connection, self.channel, "queue")
+        self.on_message = self.channel.basic_consume.call_args[1]["on_message_callback"]
+
+    def deliver(self, tag, headers=None, redelivered=False):
+        method = mock.Mock(delivery_tag=tag, redelivered=redelivered)
+        properties = mock.Mock(headers=headers)
+        self.on_message(self.channel, method, properties, "msg-%d"%tag)
+        # wait for the worker
+        self.executor.submit(lambda: None).result()
+
+    def published(self):
+        return [(x[1]["routing_key"], x[1]["properties"].headers) \
+            for x in self.channel.basic_publish.call_args_list]
+
+    def test_01_ack_after_callback(self):
+        # the message redelivered after broker restart is processed as usual
+        self.deliver(1, redelivered=True)
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=1)
+        self.channel.basic_publish.assert_not_called()
+
+    def test_02_retry_with_header(self):
+        self.fail = True
+        with mock.patch.object(consumer_dynamic.ConfigClass, "CONSUMER_RETRY_DELAY", 1):
+            self.deliver(1, headers={"trace": "a"})
+            # held until the backoff
+            self.channel.basic_ack.assert_not_called()
+            self.assertEqual([x[0] for x in self.connection.timers.values()], [1])
+
+            self.connection.fire()
+            self.assertEqual(self.published(), [("queue", {"trace": "a", "x-retry": 1})])
+            self.channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+            self.deliver(2, headers={"x-retry": 1})
+            self.assertEqual([x[0] for x in self.connection.timers.values()], [2])
+
+    def test_03_dead_letter_after_max_retries(self):
+        self.fail = True
+        with mock.patch.object(consumer_dynamic.ConfigClass, "CONSUMER_MAX_RETRIES", 3):
+            self.deliver(1, headers={"x-retry": 3})
+        self.assertEqual(self.connection.timers, {})
+        routing_key, headers = self.published()[0]
+        self.assertEqual(routing_key, "queue.dead")
+        self.assertEqual(headers["x-error"], "elastic search is down")
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
+class TestDatasetConsumer(unittest.TestCase):
+
+    def start(self, mode, batch_size=500):
+        with mock.patch.object(consumers.ConfigClass, "ACTIVITY_LOG_CONSUMER_MODE", mode), \
+            mock.patch.object(consumers.ConfigClass, "ACTIVITY_LOG_CONSUMER_BATCH_SIZE", batch_size), \
+            mock.patch.object(consumers, "ConsumerDynamic") as consumer_cls:
+            consumers.dataset_consumer()
+        return consumer_cls.return_value
+
+    def test_01_batch_mode(self):
+        consumer = self.start("batch", batch_size=1)
+        consumer.set_batch_callback.assert_called_once()
+        self.assertEqual(consumer.set_batch_callback.call_args[1]["batch_size"], 1)
+        consumer.set_callback.assert_not_called()
+        consumer.start.assert_called_once_with()
+
+    def test_02_manual_mode(self):
+        # the batch size does not switch the mode
+        consumer = self.start("manual", batch_size=500)
+        consumer.set_callback.assert_called_once()
+        self.assertTrue(consumer.set_callback.call_args[1]["manual_ack"])
+        consumer.set_batch_callback.assert_not_called()
+
+    def test_03_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.start("auto")
@@ -0,0 +1,243 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import unittest
+from unittest import mock
+from app.routers.v1 import dataset_file
+from app.routers.v1.dataset_file import APIImportData
+from app.resources.tree_walker import NodeTree
+
+
+def folder(geid, name, archived=False):
+    return {"global_entity_id": geid, "name": name, "labels": ["Folder"], "archived": archived}
+
+
+def file(geid, name, size=10):
+    return {"global_entity_id": geid, "name": name, "labels": ["File"], "file_size": size, \
+        "location": "minio://http://minio/project/%s"%name}
+
+
+class FakeCopyPool:
+
+    def __init__(self, access_token, refresh_token):
+        self.group = None
+        self.copies = []
+        self.failures = {}
+        self.closed = False
+        FakeCopyPool.last = self
+
+    def copy_object(self, bucket, obj, source_bucket, source_obj, size=-1):
+        self.copies.append((self.group, "%s/%s"%(bucket, obj), source_obj))
+
+    def wait(self):
+        return self.failures
+
+    def shutdown(self):
+        self.closed = True
+
+
+class TestBulkCopy(unittest.TestCase):
+
+    def setUp(self):
+        # source
+        # ├── f1
+        # │   ├── a.txt
+        # │   └── f2
+        # │       └── b.txt
+        # ├── old(archived)
+        # └── d.txt
+        self.tree = NodeTree()
+        self.tree.children = {
+            "f1": [file("a", "a.txt"), folder("f2", "f2")],
+            "f2": [file("b", "b.txt")],
+        }
+        self.nodes = [folder("f1", "f1"), folder("old", "old", archived=True), file("d", "d.txt")]
+        self.dataset = {"code": "dataset", "id": 1, "global_entity_id": "dataset-geid"}
+
+        self.created = []
+        self.fail_level = None
+
+        def create_nodes(label, attributes, parent_ids):
+            self.created.append((label, [x["display_path"] for x in attributes], parent_ids))
+            if self.fail_level == len(self.created):
+                raise Exception("neo4j error")
+            return [dict(x, id=x["global_entity_id"], labels=[label]) for x in attributes]
+
+        self.geid = 0
+        def get_geid_batch(number):
+            geids = ["new-%d"%x for x in range(self.geid, self.geid+number)]
+            self.geid += number
+            return geids
+
+        patchers = [
+            mock.patch.object(dataset_file, "create_nodes_with_parent_batch", create_nodes),
+            mock.patch.object(dataset_file, "get_geid_batch", get_geid_batch),
+            mock.patch.object(dataset_file, "MinioCopyPool", FakeCopyPool),
+            mock.patch.object(APIImportData, "remove_copied_nodes"),
+            mock.patch.object(APIImportData, "update_job_status"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.api = APIImportData()
+
+    def test_01_copy_level_by_level(self):
+        num_of_files, total_size, new_nodes = self.api.bulk_copy(self.nodes, self.dataset, "admin", \
+            "data", self.dataset, "token", "refresh", tree=self.tree)
+
+        self.assertEqual((num_of_files, total_size), (3, 30))
+        self.assertEqual([x["display_path"] for x in new_nodes], ["data/f1", "data/d.txt"])
+        new_f1 = new_nodes[0]["id"]
+        self.assertEqual(self.created, [
+            ("Folder", ["data/f1"], [1]),
+            ("File", ["data/d.txt"], [1]),
+            ("Folder", ["data/f1/f2"], [new_f1]),
+            ("File", ["data/f1/a.txt"], [new_f1]),
+            ("File", ["data/f1/f2/b.txt"], ["new-3"]),
+        ])
+        # the copies are grouped by the first level node
+        self.assertEqual(FakeCopyPool.last.copies, [
+            ("d", "dataset/data/d.txt", "d.txt"),
+            ("f1", "dataset/data/f1/a.txt", "a.txt"),
+            ("f1", "dataset/data/f1/f2/b.txt", "b.txt"),
+        ])
+        self.assertTrue(FakeCopyPool.last.closed)
+        self.api.remove_copied_nodes.assert_not_called()
+
+    def test_02_rename(self):
+        _, _, new_nodes = self.api.bulk_copy(self.nodes[:1], self.dataset, "admin", "data", \
+            self.dataset, "token", "refresh", new_name="renamed", tree=self.tree)
+        self.assertEqual(new_nodes[0]["name"], "renamed")
+        self.assertEqual(self.created[1], ("Folder", ["data/renamed/f2"], [new_nodes[0]["id"]]))
+
+    def test_03_create_failed(self):
+        # the second level fails, the first level is removed
+        self.fail_level = 3
+        with self.assertRaises(Exception):
+            self.api.bulk_copy(self.nodes, self.dataset, "admin", "data", self.dataset, \
+                "token", "refresh", tree=self.tree)
+        removed = self.api.remove_copied_nodes.call_args[0][0]
+        self.assertEqual([x["display_path"] for x in removed], ["data/f1", "data/d.txt"])
+
+    def test_04_copy_failed(self):
+        with mock.patch.object(FakeCopyPool, "wait", return_value={"f1": [{"err_message": "error"}]}):
+            with self.assertRaises(Exception):
+                self.api.bulk_copy(self.nodes, self.dataset, "admin", "data", self.dataset, \
+                    "token", "refresh", tree=self.tree)
+        self.assertEqual(len(self.api.remove_copied_nodes.call_args[0][0]), 2)
+
+    def test_05_copy_failed_with_job(self):
+        job_tracker = {"session_id": "session", "task_id": "task", "action": "dataset_file_import", \
+            "job_id": {"f1": "job-1", "d": "job-2"}, "pipeline_id": None}
+        with mock.patch.object(FakeCopyPool, "wait", return_value={"d": [{"err_message": "error"}]}):
+            self.api.bulk_copy(self.nodes, self.dataset, "admin", "data", self.dataset, \
+                "token", "refresh", job_tracker=job_tracker, tree=self.tree)
+
+        # the imported nodes are kept, the failed file is cancelled
+        self.api.remove_copied_nodes.assert_not_called()
+        statuses = [(x[0][1]["global_entity_id"], x[0][3]) for x in self.api.update_job_status.call_args_list]
+        self.assertEqual(statuses, [("f1", "RUNNING"), ("d", "RUNNING"), ("f1", "FINISH"), ("d", "CANCELLED")])
+
+
+class TestRecursiveCopy(unittest.TestCase):
+    '''
+    the node by node copy, the minio copies of whole tree are waited
+    at the end by the top level call
+    '''
+
+    def setUp(self):
+        self.tree = NodeTree()
+        self.tree.children = {"f1": [file("a", "a.txt")]}
+        self.nodes = [folder("f1", "f1"), file("d", "d.txt")]
+        self.dataset = {"code": "dataset", "id": 1, "global_entity_id": "dataset-geid"}
+        self.fail_on = None
+
+        def create_file_node(code, source, oper, parent_id, root_path, access_token, \
+            refresh_token, new_name=None, copy_pool=None):
+            if self.fail_on == source["global_entity_id"]:
+                raise Exception("neo4j error")
+            copy_pool.copy_object(code, root_path+"/"+source["name"], "project", source["name"])
+            return dict(source, global_entity_id="new-"+source["global_entity_id"]), None
+
+        def create_folder_node(code, source, oper, parent_node, root_path, new_name=None):
+            return dict(source, global_entity_id="new-"+source["global_entity_id"]), None
+
+        patchers = [
+            mock.patch.object(dataset_file.ConfigClass, "NEO4J_BULK_CREATE", False),
+            mock.patch.object(dataset_file, "create_file_node", create_file_node),
+            mock.patch.object(dataset_file, "create_folder_node", create_folder_node),
+            mock.patch.object(dataset_file, "MinioCopyPool", FakeCopyPool),
+            mock.patch.object(APIImportData, "recursive_delete"),
+            mock.patch.object(APIImportData, "update_job_status"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.api = APIImportData()
+
+    def copy(self, job_tracker=None):
+        return self.api.recursive_copy(self.nodes, self.dataset, "admin", "data", self.dataset, \
+            "token", "refresh", job_tracker=job_tracker, tree=self.tree)
+
+    def removed(self):
+        return [[x["global_entity_id"] for x in call[0][0]] \
+            for call in self.api.recursive_delete.call_args_list]
+
+    def test_01_one_pool_for_tree(self):
+        self.assertEqual(self.copy()[:2], (2, 20))
+        self.assertEqual(FakeCopyPool.last.copies, [
+            ("f1", "dataset/data/f1/a.txt", "a.txt"),
+            ("d", "dataset/data/d.txt", "d.txt"),
+        ])
+        self.assertTrue(FakeCopyPool.last.closed)
+        self.api.recursive_delete.assert_not_called()
+
+    def test_02_copy_failed(self):
+        with mock.patch.object(FakeCopyPool, "wait", return_value={"f1": [{"err_message": "error"}]}):
+            with self.assertRaises(Exception):
+                self.copy()
+        # the first level nodes created in target are removed
+        self.assertEqual(self.removed(), [["new-f1", "new-d"]])
+        self.assertTrue(FakeCopyPool.last.closed)
+
+    def test_03_create_failed(self):
+        # the node created before the error is removed
+        self.fail_on = "d"
+        with self.assertRaises(Exception):
+            self.copy()
+        self.assertEqual(self.removed(), [["new-f1"]])
+        self.assertTrue(FakeCopyPool.last.closed)
+
+    def test_04_copy_failed_with_job(self):
+        job_tracker = {"session_id": "session", "task_id": "task", "action": "dataset_file_import", \
+            "job_id": {"f1": "job-1", "d": "job-2"}, "pipeline_id": None}
+        with mock.patch.object(FakeCopyPool, "wait", return_value={"f1": [{"err_message": "error"}]}):
+            self.copy(job_tracker=job_tracker)
+        # the import keeps the copied nodes and reports the failed files
+        self.api.recursive_delete.assert_not_called()
+        finished = [x for x in self.api.update_job_status.call_args_list if x[0][3] == "FINISH"]
+        self.assertEqual(finished[0][1]["payload"]["failed_files"], [{"err_message": "error"}])
+
+    def test_05_remove_error_is_logged(self):
+        self.api.recursive_delete.side_effect = Exception("neo4j error")
+        # the error of cleanup does not hide the copy error
+        with mock.patch.object(FakeCopyPool, "wait", return_value={"d": [{"err_message": "copy error"}]}):
+            with self.assertRaisesRegex(Exception, "copy error"):
+                self.copy()
@@ -0,0 +1,87 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import unittest
+from unittest import mock
+from app.routers.v1 import dataset_file
+from app.routers.v1.dataset_file import APIImportData
+from app.resources.tree_walker import NodeTree
+
+
+def file(geid, name, id):
+    return {"global_entity_id": geid, "name": name, "labels": ["File"], "file_size": 10, "id": id, \
+        "location": "minio://http://minio/dataset/data/%s"%name}
+
+
+class TestRecursiveDelete(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = NodeTree()
+        self.tree.children = {"f1": [file("b", "f1/b.txt", 3)]}
+        self.nodes = [
+            {"global_entity_id": "f1", "name": "f1", "labels": ["Folder"], "id": 2},
+            file("a", "a.txt", 1),
+        ]
+        self.dataset = {"code": "dataset", "id": 0, "global_entity_id": "dataset-geid"}
+        self.job_tracker = {"session_id": "session", "task_id": "task", "action": "dataset_file_delete", \
+            "job_id": {"f1": "job-1", "a": "job-2"}, "pipeline_id": None}
+
+        def delete_node(node, access_token, refresh_token, object_keys=None):
+            location = node.get("location")
+            if object_keys is not None and location:
+                object_keys.append(tuple(location.split("//")[-1].split("/", 2)[1:]))
+
+        patchers = [
+            mock.patch.object(dataset_file, "delete_relation_bw_nodes"),
+            mock.patch.object(dataset_file, "delete_node", side_effect=delete_node),
+            mock.patch.object(dataset_file, "get_minio_client"),
+            mock.patch.object(APIImportData, "update_job_status"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.api = APIImportData()
+
+    def statuses(self):
+        return [(x[0][1]["global_entity_id"], x[0][3], x[1].get("payload")) \
+            for x in self.api.update_job_status.call_args_list if x[0][3] != "RUNNING"]
+
+    def test_01_objects_removed_in_batch(self):
+        mc = dataset_file.get_minio_client.return_value
+        mc.delete_objects.return_value = []
+        result = self.api.recursive_delete(self.nodes, self.dataset, "admin", self.dataset, \
+            None, None, job_tracker=self.job_tracker, tree=self.tree)
+
+        self.assertEqual(result, (2, 20))
+        mc.delete_objects.assert_called_once_with([("dataset", "data/f1/b.txt"), ("dataset", "data/a.txt")])
+        self.assertEqual(self.statuses(), [("f1", "FINISH", {}), ("a", "FINISH", {})])
+
+    def test_02_minio_client_failed(self):
+        # the nodes are gone, the job is finished with the objects reported
+        dataset_file.get_minio_client.side_effect = Exception("token exchange failed")
+        result = self.api.recursive_delete(self.nodes, self.dataset, "admin", self.dataset, \
+            None, None, job_tracker=self.job_tracker, tree=self.tree)
+
+        self.assertEqual(result, (2, 20))
+        self.assertEqual(self.statuses(), [
+            ("f1", "FINISH", {"failed_files": [{"target": "dataset/data/f1/b.txt", \
+                "err_message": "token exchange failed"}]}),
+            ("a", "CANCELLED", {"err_message": "token exchange failed"}),
+        ])
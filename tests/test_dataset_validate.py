@@ -0,0 +1,143 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import asyncio
+import json
+import unittest
+from unittest import mock
+from app.routers.v1 import dataset_file
+from app.routers.v1.dataset_file import APIImportData
+
+
+def node(geid, name, label="File", display_path=None):
+    return {"global_entity_id": geid, "name": name, "labels": [label], \
+        "display_path": display_path or name}
+
+
+class FakeResponse:
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeNeo4j:
+    '''
+    the async neo4j helpers of dataset_file, `children` is the direct
+    children of root and `nodes` -> {<geid>: <node>} is connected to
+    root unless the geid is in `unauthorized`
+    '''
+
+    def __init__(self, children=(), nodes=None, unauthorized=()):
+        self.children = list(children)
+        self.nodes = nodes or {}
+        self.unauthorized = set(unauthorized)
+        self.calls = []
+
+    async def get_children_nodes(self, start_geid, start_label="Folder"):
+        self.calls.append(("children", start_geid, start_label))
+        return self.children
+
+    async def get_nodes_by_geids(self, geids):
+        self.calls.append(("nodes", list(geids)))
+        return [self.nodes[x] for x in dict.fromkeys(geids) if x in self.nodes]
+
+    async def get_connected_geids(self, root_geid, root_label, geids):
+        self.calls.append(("connected", root_geid, root_label, list(geids)))
+        return set(geids) - self.unauthorized
+
+    async def post(self, url, content=None, headers=None):
+        # the per name relation query
+        name = json.loads(content)["end_params"]["name"]
+        return FakeResponse([{"end_node": x} for x in self.children if x["name"] == name])
+
+
+class TestDuplicateAndValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.neo4j = FakeNeo4j()
+        patchers = [
+            mock.patch.object(dataset_file, "get_children_nodes_async", self.neo4j.get_children_nodes),
+            mock.patch.object(dataset_file, "get_nodes_by_geids_async", self.neo4j.get_nodes_by_geids),
+            mock.patch.object(dataset_file, "get_connected_geids_async", self.neo4j.get_connected_geids),
+            mock.patch.object(dataset_file, "get_async_client", return_value=self.neo4j),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.api = APIImportData()
+
+    def remove_duplicate(self, ff_list, bulk=True):
+        duplicated, passed = asyncio.run(self.api.remove_duplicate_file( \
+            [dict(x) for x in ff_list], "root", "Dataset", bulk=bulk))
+        return [x["global_entity_id"] for x in duplicated], [x["global_entity_id"] for x in passed]
+
+    def test_01_name_collision(self):
+        self.neo4j.children = [node("old-a", "a.txt"), node("old-b", "b.txt")]
+        ff_list = [node("a", "a.txt"), node("c", "c.txt")]
+
+        self.assertEqual(self.remove_duplicate(ff_list), (["a"], ["c"]))
+        # one children query for the whole list
+        self.assertEqual(self.neo4j.calls, [("children", "root", "Dataset")])
+        self.assertEqual(self.remove_duplicate(ff_list, bulk=False), (["a"], ["c"]))
+
+    def test_02_folder_file_collision(self):
+        # the name is unique under the parent whatever the node type is
+        self.neo4j.children = [node("old-a", "a", label="Folder")]
+        ff_list = [node("a", "a"), node("f", "a.txt", label="Folder")]
+
+        self.assertEqual(self.remove_duplicate(ff_list), (["a"], ["f"]))
+        self.assertEqual(self.remove_duplicate(ff_list, bulk=False), (["a"], ["f"]))
+
+    def test_03_empty_target(self):
+        ff_list = [node("a", "a.txt"), node("f", "f", label="Folder")]
+
+        self.assertEqual(self.remove_duplicate(ff_list), ([], ["a", "f"]))
+        self.assertEqual(self.remove_duplicate(ff_list, bulk=False), ([], ["a", "f"]))
+        self.assertEqual(self.remove_duplicate([]), ([], []))
+
+    def test_04_validate_files_folders(self):
+        self.neo4j.nodes = {
+            "a": node("a", "a.txt", display_path="f1/a.txt"),
+            "b": node("b", "a.txt", display_path="f2/a.txt"),
+            "c": node("c", "c.txt"),
+        }
+        self.neo4j.unauthorized = {"c"}
+        passed, not_passed = asyncio.run(self.api.validate_files_folders( \
+            ["a", "missing", "b", "c"], "root", "Dataset"))
+
+        # the same name in batch is renamed by the display path
+        self.assertEqual([(x["global_entity_id"], x["name"]) for x in passed], \
+            [("a", "f1_a.txt"), ("b", "f2_a.txt")])
+        self.assertEqual(not_passed, [
+            {"global_entity_id": "missing", "feedback": "not exists"},
+            {"global_entity_id": "c", "feedback": "unauthorized"},
+        ])
+        # the connection is checked once for the found nodes
+        self.assertEqual(self.neo4j.calls, [
+            ("nodes", ["a", "missing", "b", "c"]),
+            ("connected", "root", "Dataset", ["a", "b", "c"]),
+        ])
+
+    def test_05_validate_empty(self):
+        passed, not_passed = asyncio.run(self.api.validate_files_folders([], "root", "Dataset"))
+        self.assertEqual((passed, not_passed), ([], []))
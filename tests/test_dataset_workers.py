@@ -0,0 +1,95 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import unittest
+from unittest import mock
+from app.routers.v1 import dataset_file
+from app.routers.v1.dataset_file import APIImportData
+
+
+class TestWorkerTreeSnapshot(unittest.TestCase):
+    '''
+    the lock phase and the mutation phase of each worker go through the
+    same snapshot of the source tree
+    '''
+
+    def setUp(self):
+        self.tree = object()
+        self.file = {"global_entity_id": "a", "name": "a.txt", "labels": ["File"], \
+            "display_path": "a.txt", "location": "minio://http://minio/dataset/data/a.txt"}
+        self.dataset = {"code": "dataset", "id": 0, "global_entity_id": "dataset-geid"}
+        self.folder = {"global_entity_id": "f1", "name": "f1", "labels": ["Folder"], \
+            "folder_relative_path": "data"}
+        self.locked = []
+
+        def lock(*args, **kwargs):
+            self.locked.append(kwargs.get("tree"))
+            return ["locked"], None
+
+        patchers = [
+            mock.patch.object(dataset_file, "get_subtree", return_value=self.tree),
+            mock.patch.object(dataset_file, "recursive_lock_import", side_effect=lock),
+            mock.patch.object(dataset_file, "recursive_lock_delete", side_effect=lock),
+            mock.patch.object(dataset_file, "recursive_lock_move_rename", side_effect=lock),
+            mock.patch.object(dataset_file, "bulk_unlock_resource", return_value=[]),
+            mock.patch.object(dataset_file, "close_pipeline"),
+            mock.patch.object(dataset_file, "SrvDatasetMgr"),
+            mock.patch.object(dataset_file, "get_node_by_geid", return_value={"code": "project"}),
+            mock.patch.object(dataset_file, "get_parent_node", return_value=self.folder),
+            mock.patch.object(APIImportData, "initialize_file_jobs", return_value={ \
+                "session_id": "session", "task_id": "task", "action": "action", \
+                "job_id": {}, "pipeline_id": None}),
+            mock.patch.object(APIImportData, "update_job_status"),
+            mock.patch.object(APIImportData, "recursive_copy", return_value=(1, 10, [self.file])),
+            mock.patch.object(APIImportData, "recursive_delete", return_value=(1, 10)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.api = APIImportData()
+        self.api.file_act_notifier = mock.Mock()
+
+    def assert_same_tree(self, *phases):
+        dataset_file.get_subtree.assert_called_once()
+        self.assertEqual(self.locked, [self.tree])
+        for phase in phases:
+            for call in phase.call_args_list:
+                self.assertIs(call[1]["tree"], self.tree)
+        # nothing is cancelled and the locked nodes are released
+        self.assertNotIn("CANCELLED", [x[0][3] for x in self.api.update_job_status.call_args_list])
+        dataset_file.bulk_unlock_resource.assert_called_once_with(["locked"])
+
+    def test_01_copy(self):
+        self.api.copy_files_worker([self.file], self.dataset, "admin", "project-geid", \
+            "session", None, None)
+        self.assert_same_tree(APIImportData.recursive_copy)
+
+    def test_02_move(self):
+        self.api.move_file_worker([self.file], self.dataset, "admin", self.folder, "data/f1/", \
+            "session", None, None)
+        self.assert_same_tree(APIImportData.recursive_copy, APIImportData.recursive_delete)
+
+    def test_03_delete(self):
+        self.api.delete_files_work([self.file], self.dataset, "admin", "session", None, None)
+        self.assert_same_tree(APIImportData.recursive_delete)
+
+    def test_04_rename(self):
+        self.api.rename_file_worker([self.file], "b.txt", self.dataset, "admin", "session", None, None)
+        self.assert_same_tree(APIImportData.recursive_copy, APIImportData.recursive_delete)
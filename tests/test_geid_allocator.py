@@ -0,0 +1,111 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import time
+import unittest
+from unittest import mock
+from app.resources import geid_allocator
+from app.resources.geid_allocator import GeidAllocator
+
+
+class FakeAllocator(GeidAllocator):
+    '''
+    the common service returns the sequential ids
+    '''
+
+    def __init__(self, block_size, watermark):
+        super().__init__(block_size, watermark)
+        self.next_id = 0
+        self.fetched = []
+
+    def _fetch_block(self, number):
+        self.fetched.append(number)
+        block = [str(self.next_id+i) for i in range(number)]
+        self.next_id += number
+        return block
+
+    def wait_refill(self):
+        for _ in range(100):
+            if not self.refilling:
+                return
+            time.sleep(0.01)
+
+
+class TestGeidAllocator(unittest.TestCase):
+
+    def test_01_fetch_when_pool_empty(self):
+        allocator = FakeAllocator(block_size=10, watermark=0)
+        self.assertEqual(allocator.get_many(3), ["0", "1", "2"])
+        self.assertEqual(allocator.fetched, [10])
+        # the rest of block is kept in pool
+        self.assertEqual(allocator.get(), "3")
+        self.assertEqual(allocator.fetched, [10])
+
+    def test_02_request_larger_than_block(self):
+        allocator = FakeAllocator(block_size=4, watermark=0)
+        allocator.get()
+        self.assertEqual(allocator.get_many(6), ["1", "2", "3", "4", "5", "6"])
+        self.assertEqual(allocator.fetched, [4, 4])
+        self.assertEqual([x[1] for x in allocator.pool], ["7"])
+
+    def test_03_refill_under_watermark(self):
+        allocator = FakeAllocator(block_size=5, watermark=3)
+        allocator.get_many(3)
+        allocator.wait_refill()
+        self.assertEqual(allocator.fetched, [5, 5])
+        self.assertEqual(len(allocator.pool), 7)
+        # no duplicate ids
+        geids = allocator.get_many(7)
+        self.assertEqual(len(set(geids)), 7)
+        self.assertNotIn("0", geids)
+
+    def test_04_refill_error(self):
+        allocator = FakeAllocator(block_size=5, watermark=10)
+        allocator.get()
+        allocator.wait_refill()
+        with mock.patch.object(allocator, "_fetch_block", side_effect=Exception("down")):
+            allocator.pool.clear()
+            with self.assertRaises(Exception):
+                allocator.get()
+        self.assertFalse(allocator.refilling)
+
+    def test_05_taken_ids_back_on_error(self):
+        allocator = FakeAllocator(block_size=3, watermark=0)
+        allocator.get()
+        with mock.patch.object(allocator, "_fetch_block", side_effect=Exception("down")):
+            with self.assertRaises(Exception):
+                allocator.get_many(5)
+        # the ids taken before the failed fetch are still in order
+        self.assertEqual(allocator.get_many(2), ["1", "2"])
+
+    def test_06_expired_ids_dropped(self):
+        allocator = FakeAllocator(block_size=3, watermark=0)
+        allocator.get()
+        with mock.patch.object(geid_allocator.ConfigClass, "GEID_POOL_MAX_AGE", 60):
+            with mock.patch.object(geid_allocator.time, "time", return_value=time.time()+61):
+                self.assertEqual(allocator.get(), "3")
+        self.assertEqual(allocator.fetched, [3, 3])
+        self.assertEqual([x[1] for x in allocator.pool], ["4", "5"])
+
+    def test_07_local_allocator(self):
+        with mock.patch.object(geid_allocator.ConfigClass, "GEID_ALLOCATOR", geid_allocator.LOCAL):
+            geids = geid_allocator.allocate_geids(3)
+        self.assertEqual(len(set(geids)), 3)
+        self.assertEqual(geid_allocator.allocate_geids(0), [])
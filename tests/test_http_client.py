@@ -0,0 +1,93 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+import requests
+from app.commons.service_connection import http_client
+
+
+class UnavailableHandler(BaseHTTPRequestHandler):
+    '''
+    the service always returns 503 and counts the requests by method
+    '''
+    counts = {}
+
+    def handle_one(self):
+        self.counts[self.command] = self.counts.get(self.command, 0) + 1
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = do_POST = do_PUT = handle_one
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPooledSession(unittest.TestCase):
+
+    def setUp(self):
+        patchers = [
+            mock.patch.object(http_client, "_session", None),
+            mock.patch.object(http_client.ConfigClass, "HTTP_SESSION_RETRIES", 2),
+            mock.patch.object(http_client.ConfigClass, "HTTP_SESSION_BACKOFF", 0),
+            mock.patch.object(http_client.ConfigClass, "HTTP_SESSION_TIMEOUT", 7),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start_server(self):
+        UnavailableHandler.counts = {}
+        server = HTTPServer(("127.0.0.1", 0), UnavailableHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return "http://127.0.0.1:%d/"%server.server_port
+
+    def test_01_post_not_retried(self):
+        url = self.start_server()
+        session = http_client.get_session()
+
+        self.assertEqual(session.post(url, json={"name": "a"}).status_code, 503)
+        self.assertEqual(session.get(url).status_code, 503)
+        self.assertEqual(session.put(url, json={"name": "a"}).status_code, 503)
+        # the idempotent methods are retried, the POST is only sent once
+        self.assertEqual(UnavailableHandler.counts, {"POST": 1, "GET": 3, "PUT": 3})
+
+    def test_02_default_timeout(self):
+        session = http_client.get_session()
+        with mock.patch.object(requests.Session, "request") as request:
+            session.get("http://neo4j/")
+            session.post("http://neo4j/", timeout=30)
+
+        self.assertEqual(request.call_args_list[0][1]["timeout"], 7)
+        # the timeout of caller is kept
+        self.assertEqual(request.call_args_list[1][1]["timeout"], 30)
+
+    def test_03_shared_session(self):
+        self.assertIs(http_client.get_session(), http_client.get_session())
+        self.assertIsInstance(http_client.get_session(), http_client.PooledSession)
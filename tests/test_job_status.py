@@ -0,0 +1,120 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import unittest
+from unittest import mock
+from app.resources import job_status
+from app.resources.job_status import JobStatusPipeline, CREATE, UPDATE, NOTIFY
+
+
+class TestJobStatusPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        self.session.post.return_value = mock.Mock(status_code=200)
+        self.session.put.return_value = mock.Mock(status_code=200)
+        patchers = [
+            mock.patch.object(job_status, "get_session", return_value=self.session),
+            # only flush by close in the test
+            mock.patch.object(job_status.ConfigClass, "JOB_STATUS_FLUSH_INTERVAL", 3600),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_01_first_and_last_of_key(self):
+        pipeline = JobStatusPipeline("task-1")
+        pipeline.add(CREATE, "job-1", {"job_id": "job-1", "target_status": "INIT"})
+        pipeline.add(CREATE, "job-2", {"job_id": "job-2", "target_status": "INIT"})
+        pipeline.add(UPDATE, "job-2", {"job_id": "job-2", "status": "RUNNING"})
+        pipeline.add(UPDATE, "job-1", {"job_id": "job-1", "status": "RUNNING"})
+        pipeline.add(UPDATE, "job-2", {"job_id": "job-2", "status": "UPLOADING"})
+        pipeline.add(UPDATE, "job-2", {"job_id": "job-2", "status": "FINISH"})
+        pipeline.close()
+
+        # one call per item to the same api as the unbuffered mode
+        task_url = job_status.ConfigClass.DATA_UTILITY_SERVICE + "tasks"
+        self.assertEqual([x[0][0] for x in self.session.post.call_args_list], [task_url, task_url])
+        self.assertEqual([x[1]["json"]["job_id"] for x in self.session.post.call_args_list], ["job-1", "job-2"])
+        self.assertEqual([x[1]["json"] for x in self.session.put.call_args_list], [
+            {"job_id": "job-2", "status": "RUNNING"},
+            {"job_id": "job-1", "status": "RUNNING"},
+            {"job_id": "job-2", "status": "FINISH"},
+        ])
+
+    def test_02_notifications_per_item(self):
+        pipeline = JobStatusPipeline("task-1")
+        messages = [
+            {"event_type": "DATASET_FILE_NOTIFICATION", "payload": {"source": "geid-1", "status": "RUNNING"}},
+            {"event_type": "DATASET_FILE_NOTIFICATION", "payload": {"source": "geid-1", "status": "FINISH"}},
+            {"event_type": "DATASET_FILE_NOTIFICATION", "payload": {"source": "geid-2", "status": "FINISH"}},
+        ]
+        for message in messages:
+            pipeline.add(NOTIFY, message["payload"]["source"], message)
+        pipeline.close()
+
+        self.assertEqual([x[1]["json"] for x in self.session.post.call_args_list], messages)
+        self.assertEqual(self.session.post.call_args[0][0], job_status.ConfigClass.QUEUE_SERVICE + "broker/pub")
+
+    def test_03_failed_flush_retried(self):
+        self.session.put.side_effect = [mock.Mock(status_code=500, text="error"), \
+            mock.Mock(status_code=200), mock.Mock(status_code=200)]
+        pipeline = JobStatusPipeline("task-1")
+        pipeline.add(CREATE, "job-1", {"job_id": "job-1", "target_status": "INIT"})
+        pipeline.add(UPDATE, "job-1", {"job_id": "job-1", "status": "RUNNING"})
+        pipeline.add(UPDATE, "job-1", {"job_id": "job-1", "status": "FINISH"})
+        self.assertFalse(pipeline.flush())
+        self.assertEqual(len(pipeline.pending), 2)
+
+        # the later status of same job is coalesced with the kept ones
+        pipeline.add(UPDATE, "job-1", {"job_id": "job-1", "status": "CANCELLED"})
+        self.assertTrue(pipeline.flush())
+        self.assertEqual(self.session.post.call_count, 1)
+        self.assertEqual([x[1]["json"]["status"] for x in self.session.put.call_args_list], \
+            ["RUNNING", "RUNNING", "CANCELLED"])
+        pipeline.close()
+
+    def test_04_dropped_after_max_retries(self):
+        self.session.post.return_value = mock.Mock(status_code=500, text="error")
+        pipeline = JobStatusPipeline("task-1")
+        pipeline.add(CREATE, "job-1", {"job_id": "job-1"})
+        pipeline.add(CREATE, "job-2", {"job_id": "job-2"})
+        with mock.patch.object(job_status.ConfigClass, "JOB_STATUS_MAX_RETRIES", 2), \
+            mock.patch.object(job_status.ConfigClass, "JOB_STATUS_FLUSH_INTERVAL", 0):
+            pipeline.close()
+        # tried once and retried twice
+        self.assertEqual(self.session.post.call_count, 3)
+        self.assertEqual(pipeline.pending, [])
+        self.assertEqual(pipeline.failures, 0)
+
+    def test_05_same_task_id_not_shared(self):
+        first = job_status.open_pipeline("dataset_file_import-1")
+        second = job_status.open_pipeline("dataset_file_import-1")
+        self.assertNotEqual(first, second)
+        first_pipeline = job_status.get_pipeline(first)
+        self.assertIsNot(first_pipeline, job_status.get_pipeline(second))
+
+        job_status.close_pipeline(first)
+        self.assertIsNone(job_status.get_pipeline(first))
+        self.assertTrue(first_pipeline.stopped.is_set())
+        self.assertIsNotNone(job_status.get_pipeline(second))
+        job_status.close_pipeline(second)
+        self.assertIsNone(job_status.get_pipeline(None))
+        job_status.close_pipeline(None)
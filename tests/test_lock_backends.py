@@ -0,0 +1,213 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import unittest
+from unittest import mock
+import fakeredis
+from app.resources import lock_backends
+from app.resources import locks
+from app.resources.lock_backends import LocalLockBackend, RedisLockBackend, DataOpsLockBackend
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+class TestDataOpsLockBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        self.session.delete.return_value = FakeResponse(200)
+        patchers = [
+            mock.patch.object(lock_backends, "get_session", return_value=self.session),
+            mock.patch.object(lock_backends.ConfigClass, "RESOURCE_LOCK_BATCH_SIZE", 2),
+            mock.patch.object(lock_backends.ConfigClass, "RESOURCE_LOCK_BACKEND", lock_backends.DATA_OPS),
+            mock.patch.object(lock_backends.ConfigClass, "RESOURCE_LOCK_LEASE", False),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.backend = DataOpsLockBackend()
+
+    def requests(self, mocked):
+        return [(x[1]["json"]["operation"], x[1]["json"]["resource_keys"]) for x in mocked.call_args_list]
+
+    def test_01_second_batch_failed(self):
+        # the second batch is already locked by other request
+        self.session.post.side_effect = [FakeResponse(200), FakeResponse(409, "in used")]
+        pairs = [("b/a", "write"), ("b/c", "write"), ("b/d", "write"), ("b/e", "read")]
+        with mock.patch.object(locks, "get_lock_backend", return_value=self.backend):
+            with self.assertRaises(Exception):
+                locks.bulk_lock_resource(pairs)
+
+        self.assertEqual(self.requests(self.session.post), [
+            ("write", ["b/a", "b/c"]), ("write", ["b/d"])])
+        # only the first batch is released, the keys of failed batch
+        # and the batch never sent are not touched
+        self.assertEqual(self.requests(self.session.delete), [("write", ["b/a", "b/c"])])
+
+    def test_02_on_locked_per_batch(self):
+        self.session.post.return_value = FakeResponse(200)
+        on_locked = mock.Mock()
+        self.backend.lock({"read": ["b/a", "b/c", "b/d"]}, on_locked=on_locked)
+
+        self.assertEqual(on_locked.call_args_list, [
+            mock.call("read", ["b/a", "b/c"]), mock.call("read", ["b/d"])])
+        self.session.delete.assert_not_called()
+
+    def test_03_unlock_keeps_going(self):
+        self.session.delete.side_effect = [Exception("timeout"), FakeResponse(200)]
+        failed = self.backend.unlock({"write": ["b/a", "b/c", "b/d"]})
+
+        self.assertEqual(failed, [("b/a", "write"), ("b/c", "write")])
+        self.assertEqual(self.requests(self.session.delete), [
+            ("write", ["b/a", "b/c"]), ("write", ["b/d"])])
+
+
+class TestLocalLockBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = LocalLockBackend()
+
+    def test_01_readers_share_writer_excludes(self):
+        self.backend.lock({"read": ["b/a"]})
+        self.backend.lock({"read": ["b/a"]})
+        with self.assertRaises(Exception):
+            self.backend.lock({"write": ["b/a"]})
+        self.assertEqual(self.backend.locks["b/a"], [2, 0])
+
+    def test_02_read_write_same_key_in_one_request(self):
+        with self.assertRaises(Exception):
+            self.backend.lock({"read": ["b/a"], "write": ["b/c", "b/a"]})
+        # the partial acquisition is rolled back
+        self.assertEqual(self.backend.locks, {})
+
+    def test_03_unlock_not_held_does_not_go_negative(self):
+        self.backend.unlock({"write": ["b/a"]})
+        self.backend.lock({"read": ["b/a"]})
+        self.backend.unlock({"write": ["b/a"]})
+        self.assertEqual(self.backend.locks["b/a"], [1, 0])
+        self.backend.unlock({"read": ["b/a"]})
+        self.backend.unlock({"read": ["b/a"]})
+        self.assertEqual(self.backend.locks, {})
+        self.backend.lock({"write": ["b/a"]})
+        self.assertEqual(self.backend.locks["b/a"], [0, 1])
+
+
+class TestRedisLockBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        patcher = mock.patch.object(lock_backends, "Redis",
+            lambda **kwargs: fakeredis.FakeRedis(server=self.server))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backend = RedisLockBackend()
+        self.client = self.backend.client
+
+    def test_01_lock_unlock(self):
+        self.backend.lock({"read": ["b/a", "b/c"]})
+        self.backend.lock({"read": ["b/a"]})
+        self.assertEqual(self.client.hget(self.backend.prefix+"b/a", "r"), b"2")
+        self.assertTrue(self.client.ttl(self.backend.prefix+"b/a") > 0)
+        with self.assertRaises(Exception):
+            self.backend.lock({"write": ["b/a"]})
+        self.assertEqual(self.backend.unlock({"read": ["b/a", "b/c"]}), [])
+        self.assertEqual(self.backend.unlock({"read": ["b/a"]}), [])
+        self.assertEqual(self.client.keys(), [])
+
+    def test_02_rollback_partial_lock(self):
+        self.backend.lock({"write": ["b/x"]})
+        with self.assertRaises(Exception):
+            self.backend.lock({"read": ["b/a"], "write": ["b/c", "b/x"]})
+        self.assertEqual(self.client.keys(), [(self.backend.prefix+"b/x").encode()])
+
+    def test_03_write_unlock_keeps_readers(self):
+        self.backend.lock({"read": ["b/a"]})
+        self.backend.unlock({"write": ["b/a"]})
+        self.assertEqual(self.client.hget(self.backend.prefix+"b/a", "r"), b"1")
+        with self.assertRaises(Exception):
+            self.backend.lock({"write": ["b/a"]})
+
+
+class TestRedisHierarchicalLockBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        patchers = [
+            mock.patch.object(lock_backends, "Redis", lambda **kwargs: fakeredis.FakeRedis(server=self.server)),
+            mock.patch.object(lock_backends.ConfigClass, "RESOURCE_LOCK_HIERARCHICAL", True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # two workers sharing the same redis
+        self.worker1 = RedisLockBackend()
+        self.worker2 = RedisLockBackend()
+
+    def test_01_subtree_across_workers(self):
+        self.worker1.lock({"read": ["code"]})
+        with self.assertRaises(Exception):
+            self.worker2.lock({"write": ["code/folder/file"]})
+        self.worker2.lock({"read": ["code/folder/file"]})
+        self.worker1.unlock({"read": ["code"]})
+        with self.assertRaises(Exception):
+            self.worker1.lock({"write": ["code"]})
+        self.worker2.unlock({"read": ["code/folder/file"]})
+        self.worker1.lock({"write": ["code"]})
+
+    def test_02_conflict_within_batch(self):
+        with self.assertRaises(Exception):
+            self.worker1.lock({"write": ["code/a", "code/a/b"]})
+        self.assertEqual(self.worker1.client.keys(), [])
+
+    def test_03_unlock_not_held(self):
+        self.worker1.lock({"write": ["code/a/b"]})
+        self.worker2.unlock({"write": ["code/a"], "read": ["code/a/b"]})
+        with self.assertRaises(Exception):
+            self.worker2.lock({"read": ["code"]})
+        self.worker1.unlock({"write": ["code/a/b"]})
+        self.assertEqual(self.worker1.client.keys(), [])
+
+    def test_04_renew_parent_paths(self):
+        self.worker1.lock({"read": ["code/a/b"]})
+        client = self.worker1.client
+        for key in client.keys():
+            client.persist(key)
+        self.worker1.renew({"read": ["code/a/b"]})
+        self.assertEqual(len(client.keys()), 3)
+        self.assertTrue(all(client.ttl(x) > 0 for x in client.keys()))
+
+    def test_05_dataops_not_supported(self):
+        with mock.patch.object(lock_backends, "_backend", None), \
+            mock.patch.object(lock_backends.ConfigClass, "RESOURCE_LOCK_BACKEND", lock_backends.DATA_OPS):
+            with self.assertRaises(Exception):
+                lock_backends.get_lock_backend()
+
+    def test_06_local_backend_uses_trie(self):
+        backend = LocalLockBackend()
+        backend.lock({"read": ["code"]})
+        with self.assertRaises(Exception):
+            backend.lock({"write": ["code/a"]})
+        backend.unlock({"read": ["code"]})
+        backend.lock({"write": ["code/a"]})
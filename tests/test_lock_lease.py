@@ -0,0 +1,152 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import time
+import unittest
+from unittest import mock
+import fakeredis
+from app.resources import lock_lease, lock_backends, locks
+from app.resources.lock_lease import LockLeaseManager, _LEASES_KEY, _LEASE_RECORD
+from app.resources.lock_backends import RedisLockBackend
+
+
+class TestLockLease(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        fake_redis = lambda **kwargs: fakeredis.FakeRedis(server=self.server)
+        patchers = [
+            mock.patch.object(lock_lease, "Redis", fake_redis),
+            mock.patch.object(lock_backends, "Redis", fake_redis),
+            # no heartbeat thread in the test, the renew is called directly
+            mock.patch.object(LockLeaseManager, "_start_heartbeat", lambda self: None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.manager = LockLeaseManager()
+        self.backend = RedisLockBackend()
+        self.client = self.manager.client
+
+    def test_01_open_and_close(self):
+        lease_id = self.manager.open_lease()
+        self.manager.add_locks(lease_id, "read", ["b/a", "b/c"])
+        self.manager.add_locks(lease_id, "write", ["b/x"])
+        self.assertEqual(self.manager._read_record(lease_id), {"read": ["b/a", "b/c"], "write": ["b/x"]})
+        self.assertIsNotNone(self.client.zscore(_LEASES_KEY, lease_id))
+
+        self.assertTrue(self.manager.close_lease(lease_id))
+        self.assertEqual(self.client.zcard(_LEASES_KEY), 0)
+        self.assertFalse(self.client.exists(_LEASE_RECORD.format(lease_id)))
+        self.assertEqual(self.manager.held, {})
+        # closed twice
+        self.assertFalse(self.manager.close_lease(lease_id))
+
+    def test_02_renew(self):
+        lease_id = self.manager.open_lease()
+        self.backend.lock({"read": ["b/a"]}, on_locked=lambda op, keys: self.manager.add_locks(lease_id, op, keys))
+        # about to expire
+        expiry = time.time()+1
+        self.client.zadd(_LEASES_KEY, {lease_id: expiry})
+        self.client.persist(self.backend.prefix+"b/a")
+
+        self.manager.renew(self.backend)
+        self.assertGreater(self.client.zscore(_LEASES_KEY, lease_id), expiry)
+        self.assertGreater(self.client.ttl(self.backend.prefix+"b/a"), 0)
+
+    def test_03_renew_swept_lease(self):
+        lease_id = self.manager.open_lease()
+        self.client.zrem(_LEASES_KEY, lease_id)
+        self.manager.renew(self.backend)
+        self.assertIsNone(self.client.zscore(_LEASES_KEY, lease_id))
+
+    def test_04_renew_expired_lease(self):
+        lease_id = self.manager.open_lease()
+        # expired but not swept yet
+        self.client.zadd(_LEASES_KEY, {lease_id: time.time()-1})
+        backend = mock.Mock()
+        self.manager.renew(backend)
+        backend.renew.assert_not_called()
+        self.assertLess(self.client.zscore(_LEASES_KEY, lease_id), time.time())
+
+    def test_05_sweep_expired(self):
+        expired = self.manager.open_lease()
+        self.backend.lock({"write": ["b/a"]}, on_locked=lambda op, keys: self.manager.add_locks(expired, op, keys))
+        alive = self.manager.open_lease()
+        self.backend.lock({"read": ["b/c"]}, on_locked=lambda op, keys: self.manager.add_locks(alive, op, keys))
+        self.client.zadd(_LEASES_KEY, {expired: time.time()-1})
+
+        self.assertEqual(self.manager.sweep(self.backend), 1)
+        self.assertFalse(self.client.exists(_LEASE_RECORD.format(expired)))
+        self.assertIsNotNone(self.client.zscore(_LEASES_KEY, alive))
+        # the redis keys are left to expire by TTL
+        self.assertGreater(self.client.ttl(self.backend.prefix+"b/a"), 0)
+        # the lease is claimed by the sweeper, the unlock should skip it
+        self.assertFalse(self.manager.close_lease(expired))
+        self.assertEqual(self.manager.sweep(self.backend), 0)
+
+    def test_06_sweep_only_locked_keys(self):
+        # the key held by other job
+        self.backend.lock({"read": ["b/x"]})
+        with mock.patch.object(locks, "get_lease_manager", return_value=self.manager), \
+            mock.patch.object(locks, "get_lock_backend", return_value=self.backend), \
+            mock.patch.object(locks, "_use_lease", return_value=True), \
+            mock.patch.object(self.manager, "close_lease", return_value=True):
+            with self.assertRaises(Exception):
+                locks.bulk_lock_resource([("b/a", "read"), ("b/x", "write")])
+
+        lease_id = self.client.zrange(_LEASES_KEY, 0, -1)[0].decode()
+        self.assertEqual(self.manager._read_record(lease_id), {"read": ["b/a"]})
+        self.client.zadd(_LEASES_KEY, {lease_id: time.time()-1})
+        self.manager.sweep(self.backend)
+        # the read lock of other job is still there
+        self.assertEqual(self.client.hget(self.backend.prefix+"b/x", "r"), b"1")
+
+    def test_07_sweep_unlocks_other_backend(self):
+        lease_id = self.manager.open_lease()
+        self.manager.add_locks(lease_id, "write", ["b/a"])
+        self.client.zadd(_LEASES_KEY, {lease_id: time.time()-1})
+        backend = mock.Mock(spec=["unlock"])
+        backend.unlock.return_value = []
+        self.assertEqual(self.manager.sweep(backend), 1)
+        backend.unlock.assert_called_once_with({"write": ["b/a"]})
+
+    def test_08_expired_reacquired_swept(self):
+        lease_a = self.manager.open_lease()
+        self.backend.lock({"write": ["b/a"]}, on_locked=lambda op, keys: self.manager.add_locks(lease_a, op, keys))
+        # the lease and the key of A are expired
+        self.client.zadd(_LEASES_KEY, {lease_a: time.time()-1})
+        self.client.delete(self.backend.prefix+"b/a")
+
+        # B takes the key before the sweeper runs
+        lease_b = self.manager.open_lease()
+        self.backend.lock({"write": ["b/a"]}, on_locked=lambda op, keys: self.manager.add_locks(lease_b, op, keys))
+        self.assertEqual(self.manager.sweep(self.backend), 1)
+
+        # the lock of B is still held and A cannot take it
+        self.assertEqual(self.client.hget(self.backend.prefix+"b/a", "w"), b"1")
+        with self.assertRaises(Exception):
+            self.backend.lock({"write": ["b/a"]})
+        with mock.patch.object(locks, "get_lease_manager", return_value=self.manager), \
+            mock.patch.object(locks, "get_lock_backend", return_value=self.backend):
+            pairs = locks.LeasedLocks([("b/a", "write")])
+            pairs.lease_id = lease_a
+            self.assertEqual(locks.bulk_unlock_resource(pairs), [])
+        self.assertEqual(self.client.hget(self.backend.prefix+"b/a", "w"), b"1")
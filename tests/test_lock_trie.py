@@ -0,0 +1,68 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import unittest
+from app.resources.lock_trie import PrefixLockTrie
+
+
+class TestPrefixLockTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = PrefixLockTrie()
+
+    def test_01_read_on_parent_blocks_write_on_child(self):
+        self.assertTrue(self.trie.acquire([("b/a", "read")]))
+        self.assertTrue(self.trie.acquire([("b/a/x", "read")]))
+        self.assertFalse(self.trie.acquire([("b/a/x", "write")]))
+        self.assertFalse(self.trie.acquire([("b", "write")]))
+        self.assertTrue(self.trie.acquire([("b/c", "write")]))
+
+    def test_02_write_on_child_blocks_parent(self):
+        self.assertTrue(self.trie.acquire([("b/a/x/y", "write")]))
+        self.assertFalse(self.trie.acquire([("b/a", "read")]))
+        self.assertFalse(self.trie.acquire([("b/a/x/y/z", "read")]))
+        self.assertTrue(self.trie.acquire([("b/a/z", "read")]))
+
+    def test_03_all_or_nothing(self):
+        self.assertTrue(self.trie.acquire([("b/x", "write")]))
+        self.assertFalse(self.trie.acquire([("b/a", "write"), ("b/x/1", "read")]))
+        # b/a was rolled back
+        self.assertTrue(self.trie.acquire([("b/a", "write")]))
+        # the pairs in the same request conflict with each other
+        self.assertFalse(self.trie.acquire([("c/a", "read"), ("c/a/1", "write")]))
+        self.assertNotIn("c", self.trie.root.children)
+
+    def test_04_release_cleans_up(self):
+        pairs = [("b/a/x", "write"), ("b/c", "read")]
+        self.assertTrue(self.trie.acquire(pairs))
+        self.trie.release(pairs)
+        self.assertEqual(self.trie.root.children, {})
+        self.assertTrue(self.trie.acquire([("b", "write")]))
+
+    def test_05_release_not_held(self):
+        self.assertTrue(self.trie.acquire([("b/a/x", "read")]))
+        # neither the unknown path nor the wrong operation is released
+        self.trie.release([("b/z", "read"), ("b/a/x", "write"), ("b/a", "read")])
+        node = self.trie.root.children["b"]
+        self.assertEqual((node.sub_readers, node.sub_writers), (1, 0))
+        self.assertNotIn("z", node.children)
+        self.assertFalse(self.trie.acquire([("b/a", "write")]))
+        self.trie.release([("b/a/x", "read")])
+        self.assertEqual(self.trie.root.children, {})
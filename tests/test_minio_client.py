@@ -0,0 +1,274 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import io
+import threading
+import time
+import zipfile
+import unittest
+from unittest import mock
+from app.commons.service_connection import minio_client
+from app.commons.service_connection.minio_client import MultipartUploadStream, prefetch_objects, \
+    multipart_copy, bulk_remove_objects
+from tests.fake_minio import FakeMinio
+
+PART_SIZE = 1024
+
+
+class TestMultipartUploadStream(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(minio_client, "MIN_PART_SIZE", PART_SIZE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = FakeMinio(PART_SIZE)
+
+    def test_01_write_in_parts(self):
+        data = bytes(range(256)) * 20
+        stream = MultipartUploadStream(self.client, "bucket", "obj", PART_SIZE, workers=2)
+        for i in range(0, len(data), 300):
+            stream.write(data[i:i+300])
+        self.assertEqual(stream.tell(), len(data))
+        stream.close()
+        self.assertEqual(self.client.objects[("bucket", "obj")], data)
+
+    def test_02_part_size_at_least_min(self):
+        stream = MultipartUploadStream(self.client, "bucket", "obj", 10)
+        self.assertEqual(stream.part_size, PART_SIZE)
+        stream.abort()
+
+    def test_03_empty_object(self):
+        stream = MultipartUploadStream(self.client, "bucket", "obj", PART_SIZE)
+        stream.close()
+        self.assertEqual(self.client.objects[("bucket", "obj")], b"")
+
+    def test_04_zip_streaming(self):
+        stream = MultipartUploadStream(self.client, "bucket", "archive.zip", PART_SIZE)
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("a.txt", b"a" * 5000)
+            archive.writestr("folder/b.bin", bytes(range(256)) * 10)
+        stream.close()
+
+        with zipfile.ZipFile(io.BytesIO(self.client.objects[("bucket", "archive.zip")])) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read("a.txt"), b"a" * 5000)
+
+    def test_05_failed_part_aborts(self):
+        stream = MultipartUploadStream(self.client, "bucket", "obj", PART_SIZE)
+        with mock.patch.object(self.client, "_upload_part", side_effect=Exception("network")):
+            stream.write(b"x" * PART_SIZE)
+            with self.assertRaises(Exception):
+                stream.close()
+        self.assertEqual(self.client.aborted, [stream.upload_id])
+        self.assertNotIn(("bucket", "obj"), self.client.objects)
+
+
+class TestMultipartCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeMinio(PART_SIZE)
+        patchers = [
+            mock.patch.object(minio_client.ConfigClass, "MINIO_MULTIPART_COPY_THRESHOLD", 2*PART_SIZE),
+            mock.patch.object(minio_client.ConfigClass, "MINIO_MULTIPART_PART_SIZE", PART_SIZE),
+            mock.patch.object(minio_client.ConfigClass, "MINIO_MULTIPART_WORKERS", 2),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.data = bytes(range(256)) * 13
+        self.client.put("project", "dir/source file.bin", self.data, content_type="image/tiff")
+
+    def test_01_copy_in_parts(self):
+        multipart_copy(self.client, "dataset", "target.bin", "project", "dir/source file.bin")
+
+        self.assertEqual(self.client.objects[("dataset", "target.bin")], self.data)
+        self.assertEqual(self.client.content_types[("dataset", "target.bin")], "image/tiff")
+        self.assertEqual(self.client.copies, [])
+        self.assertEqual(self.client.uploads, {})
+
+    def test_02_small_object_single_copy(self):
+        # the real size is below the threshold
+        self.client.put("project", "small", b"data")
+        multipart_copy(self.client, "dataset", "small", "project", "small")
+
+        self.assertEqual(self.client.copies, [("dataset", "small")])
+        self.assertEqual(self.client.objects[("dataset", "small")], b"data")
+
+    def test_03_failed_part_aborts(self):
+        copy_part = self.client._upload_part_copy
+        def upload_part_copy(bucket, obj, upload_id, part_number, headers):
+            if part_number == 2:
+                raise Exception("part failed")
+            return copy_part(bucket, obj, upload_id, part_number, headers)
+
+        with mock.patch.object(self.client, "_upload_part_copy", upload_part_copy):
+            with self.assertRaises(Exception):
+                multipart_copy(self.client, "dataset", "target.bin", "project", "dir/source file.bin")
+        self.assertEqual(self.client.aborted, ["upload-0"])
+        self.assertNotIn(("dataset", "target.bin"), self.client.objects)
+
+
+class TestBulkRemoveObjects(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeMinio(PART_SIZE)
+        self.keys = [("dataset", "data/file-%d"%i) for i in range(2500)] + [("other", "data/a")]
+        for bucket, obj in self.keys:
+            self.client.put(bucket, obj, b"")
+
+    def test_01_chunk_by_bucket(self):
+        self.assertEqual(bulk_remove_objects(self.client, self.keys), [])
+
+        requests = sorted((bucket, len(names), names[0]) for bucket, names in self.client.delete_requests)
+        self.assertEqual(requests, [
+            ("dataset", 500, "data/file-2000"),
+            ("dataset", 1000, "data/file-0"),
+            ("dataset", 1000, "data/file-1000"),
+            ("other", 1, "data/a"),
+        ])
+        self.assertEqual(self.client.objects, {})
+
+    def test_02_error_per_key(self):
+        self.client.delete_errors[("dataset", "data/file-1500")] = "AccessDenied"
+        failed = bulk_remove_objects(self.client, self.keys)
+
+        self.assertEqual(failed, [{"target": "dataset/data/file-1500", \
+            "err_message": "AccessDenied: delete failed"}])
+        self.assertEqual(list(self.client.objects), [("dataset", "data/file-1500")])
+
+    def test_03_failed_request(self):
+        # all the keys of the failed request are reported
+        self.client.unavailable_buckets.add("other")
+        failed = bulk_remove_objects(self.client, self.keys)
+
+        self.assertEqual(failed, [{"target": "other/data/a", "err_message": "bucket other is unavailable"}])
+        self.assertEqual(bulk_remove_objects(self.client, []), [])
+
+
+class TestPrefetchObjects(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeMinio(PART_SIZE)
+        for i in range(6):
+            self.client.put("bucket", "file-%d"%i, b"%d"%i * 4)
+
+    def test_01_same_order(self):
+        objects = [("bucket", "file-%d"%i, 4) for i in range(6)]
+        result = list(prefetch_objects(self.client, objects, workers=3, byte_budget=100))
+        self.assertEqual([x[0] for x in result], objects)
+        self.assertEqual([x[1] for x in result], [b"%d"%i * 4 for i in range(6)])
+
+    def test_02_budget(self):
+        objects = [("bucket", "file-%d"%i, 4) for i in range(6)]
+        prefetched = prefetch_objects(self.client, objects, workers=6, byte_budget=10)
+        next(prefetched)
+        time.sleep(0.1)
+        # only two objects fit in the budget before the first one is consumed
+        self.assertEqual(len(self.client.reads), 2)
+        self.assertEqual(len(list(prefetched)), 5)
+
+    def test_03_large_or_unknown_size_streamed(self):
+        objects = [("bucket", "file-0", 4), ("bucket", "file-1", 40), ("bucket", "file-2", None), \
+            ("bucket", "file-3", 4)]
+        result = list(prefetch_objects(self.client, objects, workers=2, byte_budget=10))
+        self.assertEqual([x[1] for x in result], [b"0000", None, None, b"3333"])
+        self.assertEqual(sorted(x[1] for x in self.client.reads), ["file-0", "file-3"])
+
+
+class TestGetMinioClient(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(minio_client, "Minio_Client_")
+        self.client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client_class.side_effect = lambda *args, **kwargs: mock.Mock()
+        minio_client._client_cache.clear()
+        self.addCleanup(minio_client._client_cache.clear)
+
+    def test_01_cached_by_token(self):
+        client = minio_client.get_minio_client("Bearer token", "refresh")
+        self.assertIs(minio_client.get_minio_client("Bearer token", "refresh"), client)
+        self.assertIsNot(minio_client.get_minio_client("Bearer other", "refresh"), client)
+        self.assertEqual(self.client_class.call_count, 2)
+
+    def test_02_no_token(self):
+        first = minio_client.get_minio_client(None, None)
+        self.assertIsNot(minio_client.get_minio_client(None, None), first)
+        self.assertEqual(len(minio_client._client_cache), 0)
+        # the copy pool of internal call can be created too
+        pool = minio_client.MinioCopyPool(None, None, max_workers=1)
+        pool.shutdown()
+
+
+class SlowCopyClient:
+    '''
+    the minio client which records the max copies running at same time
+    '''
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def copy_object(self, bucket, obj, source_bucket, source_obj, size=-1):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.05)
+            if obj in self.fail:
+                raise Exception("copy %s failed"%obj)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class TestMinioCopyPool(unittest.TestCase):
+
+    def create_pool(self, client, max_workers):
+        with mock.patch.object(minio_client, "get_minio_client", return_value=client):
+            pool = minio_client.MinioCopyPool("token", "refresh", max_workers=max_workers)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_01_bounded(self):
+        client = SlowCopyClient()
+        pool = self.create_pool(client, 2)
+        for i in range(6):
+            pool.copy_object("dataset", "obj-%d"%i, "project", "src-%d"%i)
+
+        self.assertEqual(pool.wait(), {})
+        self.assertEqual(client.max_active, 2)
+        self.assertEqual(pool.futures, [])
+
+    def test_02_failures_by_group(self):
+        client = SlowCopyClient(fail={"f1/b", "d"})
+        pool = self.create_pool(client, 4)
+        pool.group = "f1"
+        pool.copy_object("dataset", "f1/a", "project", "f1/a")
+        pool.copy_object("dataset", "f1/b", "project", "f1/b")
+        pool.group = "d"
+        pool.copy_object("dataset", "d", "project", "d")
+
+        self.assertEqual(pool.wait(), {
+            "f1": [{"target": "dataset/f1/b", "err_message": "copy f1/b failed"}],
+            "d": [{"target": "dataset/d", "err_message": "copy d failed"}],
+        })
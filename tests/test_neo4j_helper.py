@@ -0,0 +1,317 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import asyncio
+import unittest
+from unittest import mock
+from app.resources import neo4j_helper
+from app.resources.error_handler import APIException
+from app.resources.neo4j_helper import create_nodes_with_parent_batch
+
+
+class FakeResponse:
+
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeNeo4j:
+    '''
+    the pooled session of neo4j service. The created nodes get the next
+    id. The api fails by `fail` -> {<path>: [<nth call to fail>, <error>]}
+    '''
+
+    def __init__(self):
+        self.calls = []
+        self.deleted = []
+        self.fail = {}
+        self.next_id = 100
+        # the batch api returns the nodes in reversed order
+        self.reverse = True
+
+    def request(self, method, url, **kwargs):
+        path = url.replace(neo4j_helper.ConfigClass.NEO4J_SERVICE, "")
+        self.calls.append((method, path, kwargs.get("json")))
+        fail = self.fail.get(path)
+        if fail and fail[0] <= 1:
+            return FakeResponse(fail[1], status_code=500)
+        if fail:
+            fail[0] -= 1
+
+        if path.startswith("nodes/") and path.endswith("/batch"):
+            nodes = []
+            for attribute in kwargs["json"]["data"]:
+                nodes.append(dict(attribute, id=self.next_id))
+                self.next_id += 1
+            return FakeResponse(list(reversed(nodes)) if self.reverse else nodes)
+        return FakeResponse([])
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        self.deleted.append(url.replace(neo4j_helper.ConfigClass.NEO4J_SERVICE, ""))
+        return FakeResponse([])
+
+
+class TestCreateNodesWithParentBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.neo4j = FakeNeo4j()
+        patchers = [
+            mock.patch.object(neo4j_helper, "get_session", return_value=self.neo4j),
+            mock.patch.object(neo4j_helper.ConfigClass, "NEO4J_BATCH_SIZE", 2),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.nodes = [{"global_entity_id": "geid-%d"%i, "name": "file-%d"%i} for i in range(3)]
+
+    def test_01_create_in_batches(self):
+        created = create_nodes_with_parent_batch("File", self.nodes, [1, 1, 2])
+
+        # mapped back to the order of request
+        self.assertEqual([x["global_entity_id"] for x in created], ["geid-0", "geid-1", "geid-2"])
+        self.assertEqual([x[1] for x in self.neo4j.calls], ["nodes/File/batch", "relations/own/batch", \
+            "nodes/File/batch", "relations/own/batch"])
+        relations = self.neo4j.calls[1][2]["data"] + self.neo4j.calls[3][2]["data"]
+        self.assertEqual(relations, [
+            {"start_id": 1, "end_id": created[0]["id"]},
+            {"start_id": 1, "end_id": created[1]["id"]},
+            {"start_id": 2, "end_id": created[2]["id"]},
+        ])
+
+    def test_02_parents_not_match(self):
+        with self.assertRaises(APIException):
+            create_nodes_with_parent_batch("File", self.nodes, [1, 1])
+        self.assertEqual(self.neo4j.calls, [])
+
+    def test_03_missing_node(self):
+        self.neo4j.request = mock.Mock(return_value=FakeResponse([dict(self.nodes[0], id=1)]))
+        with self.assertRaises(APIException):
+            create_nodes_with_parent_batch("File", self.nodes[:2], [1, 1])
+        # the created one is removed
+        self.assertEqual(self.neo4j.deleted, ["nodes/File/node/1"])
+
+    def test_04_relation_failed(self):
+        # the second relation batch fails
+        self.neo4j.fail["relations/own/batch"] = [2, "error"]
+        with self.assertRaises(APIException):
+            create_nodes_with_parent_batch("Folder", self.nodes, [1, 1, 2])
+        # the nodes of both batches are removed, none is left without parent
+        self.assertEqual(sorted(self.neo4j.deleted), ["nodes/Folder/node/%d"%i for i in range(100, 103)])
+
+    def test_05_node_batch_failed(self):
+        self.neo4j.fail["nodes/File/batch"] = [1, "error"]
+        with self.assertRaises(APIException):
+            create_nodes_with_parent_batch("File", self.nodes, [1, 1, 2])
+        self.assertEqual(self.neo4j.deleted, [])
+
+
+class TestBulkCreateSupported(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        patchers = [
+            mock.patch.object(neo4j_helper, "get_session", return_value=self.session),
+            mock.patch.object(neo4j_helper, "_bulk_create_supported", None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_01_supported(self):
+        # the empty batch may be rejected but the api exists
+        self.session.post.return_value = FakeResponse([], status_code=422)
+        self.assertTrue(neo4j_helper.bulk_create_supported())
+        self.assertTrue(neo4j_helper.bulk_create_supported())
+        self.assertEqual(self.session.post.call_count, 2)
+
+    def test_02_not_supported(self):
+        self.session.post.side_effect = [FakeResponse([]), FakeResponse("not found", status_code=404)]
+        self.assertFalse(neo4j_helper.bulk_create_supported())
+        # the result is kept
+        self.assertFalse(neo4j_helper.bulk_create_supported())
+        self.assertEqual(self.session.post.call_count, 2)
+
+    def test_03_service_down(self):
+        self.session.post.side_effect = Exception("connection refused")
+        self.assertFalse(neo4j_helper.bulk_create_supported())
+        self.assertIsNone(neo4j_helper._bulk_create_supported)
+
+
+class TestGetNodeByGeid(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        patcher = mock.patch.object(neo4j_helper, "get_session", return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_01_found(self):
+        self.session.request.return_value = FakeResponse([{"global_entity_id": "geid-1"}])
+        self.assertEqual(neo4j_helper.get_node_by_geid("geid-1", "File"), {"global_entity_id": "geid-1"})
+        method, url = self.session.request.call_args[0]
+        self.assertEqual((method, url), ("POST", neo4j_helper.ConfigClass.NEO4J_SERVICE + "nodes/File/query"))
+
+    def test_02_not_found_of_any_status(self):
+        self.session.request.return_value = FakeResponse([], status_code=404)
+        self.assertIsNone(neo4j_helper.get_node_by_geid("geid-1"))
+        self.session.request.return_value = FakeResponse([])
+        self.assertIsNone(neo4j_helper.get_node_by_geid("geid-1", "File"))
+
+    def test_03_error(self):
+        self.session.request.side_effect = Exception("connection refused")
+        with self.assertRaises(APIException):
+            neo4j_helper.get_node_by_geid("geid-1")
+        self.session.request.side_effect = None
+        self.session.request.return_value = FakeResponse({"error_msg": "error"}, status_code=500)
+        with self.assertRaises(APIException):
+            neo4j_helper.get_node_by_geid("geid-1")
+
+
+class TestGetChildrenNodesBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        patchers = [
+            mock.patch.object(neo4j_helper, "get_session", return_value=self.session),
+            mock.patch.object(neo4j_helper.ConfigClass, "NEO4J_BATCH_SIZE", 2),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def relation(self, parent, child):
+        return {"start_node": {"global_entity_id": parent}, "end_node": {"global_entity_id": child}}
+
+    def test_01_group_by_parent(self):
+        self.session.request.side_effect = [
+            FakeResponse([self.relation("a", "a-1"), self.relation("b", "b-1"), self.relation("a", "a-2")]),
+            FakeResponse([self.relation("c", "c-1")]),
+        ]
+        children = neo4j_helper.get_children_nodes_batch(["a", "b", "c"])
+
+        self.assertEqual({k: [x["global_entity_id"] for x in v] for k, v in children.items()},
+            {"a": ["a-1", "a-2"], "b": ["b-1"], "c": ["c-1"]})
+        payloads = [x[1]["json"] for x in self.session.request.call_args_list]
+        self.assertEqual([x["start_params"]["global_entity_id"] for x in payloads], [["a", "b"], ["c"]])
+        self.assertEqual(payloads[0]["start_label"], "Folder")
+
+    def test_02_error(self):
+        self.session.request.return_value = FakeResponse({"error_msg": "error"}, status_code=500)
+        with self.assertRaises(APIException):
+            neo4j_helper.get_children_nodes_batch(["a"])
+
+
+class FakeGeidQuery:
+    '''
+    the nodes/query/geids and the "own*" relations/query api of neo4j
+    service, the geid of `nodes` exists and the geid in `connected` is
+    under the root
+    '''
+
+    def __init__(self, nodes, connected):
+        self.nodes = nodes
+        self.connected = connected
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        path = url.replace(neo4j_helper.ConfigClass.NEO4J_SERVICE, "")
+        payload = kwargs["json"]
+        self.calls.append((method, path, payload))
+        if path == "nodes/query/geids":
+            return FakeResponse({"result": [{"global_entity_id": x} \
+                for x in payload["geids"] if x in self.nodes]})
+        return FakeResponse([{"end_node": {"global_entity_id": x}} \
+            for x in payload["end_params"]["global_entity_id"] if x in self.connected])
+
+
+class FakeAsyncClient:
+
+    def __init__(self, session):
+        self.session = session
+
+    async def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+
+class TestGeidBatchQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.neo4j = FakeGeidQuery(nodes={"a", "b", "c"}, connected={"a", "c"})
+        patchers = [
+            mock.patch.object(neo4j_helper, "get_session", return_value=self.neo4j),
+            mock.patch.object(neo4j_helper, "get_async_client", return_value=FakeAsyncClient(self.neo4j)),
+            mock.patch.object(neo4j_helper.ConfigClass, "NEO4J_BATCH_SIZE", 2),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # mixed existing and missing geid, "a" is duplicated
+        self.geids = ["a", "missing", "b", "a", "c"]
+
+    def test_01_nodes_by_geids(self):
+        nodes = neo4j_helper.get_nodes_by_geids(self.geids)
+
+        self.assertEqual([x["global_entity_id"] for x in nodes], ["a", "b", "c"])
+        # chunked by batch size and the duplicate is queried once
+        self.assertEqual(self.neo4j.calls, [
+            ("POST", "nodes/query/geids", {"geids": ["a", "missing"]}),
+            ("POST", "nodes/query/geids", {"geids": ["b", "c"]}),
+        ])
+
+    def test_02_connected_geids(self):
+        connected = neo4j_helper.get_connected_geids("root", "Dataset", self.geids)
+
+        self.assertEqual(connected, {"a", "c"})
+        self.assertEqual([x[2] for x in self.neo4j.calls], [
+            {
+                "label": "own*",
+                "start_label": "Dataset",
+                "start_params": {"global_entity_id": "root"},
+                "end_params": {"global_entity_id": ["a", "missing"]},
+            },
+            {
+                "label": "own*",
+                "start_label": "Dataset",
+                "start_params": {"global_entity_id": "root"},
+                "end_params": {"global_entity_id": ["b", "c"]},
+            },
+        ])
+
+    def test_03_async_same_payload(self):
+        nodes = asyncio.run(neo4j_helper.get_nodes_by_geids_async(self.geids))
+        connected = asyncio.run(neo4j_helper.get_connected_geids_async("root", "Dataset", self.geids))
+        async_calls, self.neo4j.calls = self.neo4j.calls, []
+
+        self.assertEqual(nodes, neo4j_helper.get_nodes_by_geids(self.geids))
+        self.assertEqual(connected, neo4j_helper.get_connected_geids("root", "Dataset", self.geids))
+        self.assertEqual(async_calls, self.neo4j.calls)
+
+    def test_04_empty(self):
+        self.assertEqual(neo4j_helper.get_nodes_by_geids([]), [])
+        self.assertEqual(neo4j_helper.get_connected_geids("root", "Dataset", []), set())
+        self.assertEqual(self.neo4j.calls, [])
@@ -0,0 +1,98 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import unittest
+from unittest import mock
+from app.resources import tree_walker
+
+
+def folder(geid, archived=False):
+    return {"global_entity_id": geid, "labels": ["Folder"], "archived": archived}
+
+
+def file(geid, archived=False):
+    return {"global_entity_id": geid, "labels": ["File"], "archived": archived}
+
+
+# root
+# ├── f1
+# │   ├── a.txt
+# │   └── f2
+# │       └── b.txt
+# ├── old(archived)
+# │   └── c.txt
+# └── d.txt
+TREE = {
+    "root": [folder("f1"), folder("old", archived=True), file("d.txt")],
+    "f1": [file("a.txt"), folder("f2")],
+    "f2": [file("b.txt")],
+    "old": [file("c.txt")],
+}
+
+
+class TestTreeWalker(unittest.TestCase):
+
+    def setUp(self):
+        self.batch_calls = []
+
+        def get_children_nodes_batch(geids, start_label="Folder"):
+            self.batch_calls.append(list(geids))
+            return {x: TREE[x] for x in geids if x in TREE}
+
+        patch_batch = mock.patch.object(tree_walker, "get_children_nodes_batch", get_children_nodes_batch)
+        patch_children = mock.patch.object(tree_walker, "get_children_nodes",
+            lambda geid, start_label="Folder": TREE.get(geid, []))
+        patch_batch.start()
+        patch_children.start()
+        self.addCleanup(patch_batch.stop)
+        self.addCleanup(patch_children.stop)
+
+    def test_01_one_query_per_level(self):
+        tree = tree_walker.get_subtree(TREE["root"])
+        self.assertEqual(self.batch_calls, [["f1", "old"], ["f2"]])
+        self.assertEqual(tree.get_children("f2"), [file("b.txt")])
+
+    def test_02_get_files_in_order(self):
+        tree = tree_walker.get_subtree(TREE["root"])
+        files = [x["global_entity_id"] for x in tree.get_files(TREE["root"])]
+        self.assertEqual(files, ["a.txt", "b.txt", "c.txt", "d.txt"])
+
+    def test_03_skip_archived(self):
+        tree = tree_walker.get_subtree(TREE["root"], skip_archived=True)
+        self.assertEqual(self.batch_calls, [["f1"], ["f2"]])
+        self.assertNotIn("old", tree.children)
+        files = [x["global_entity_id"] for x in tree.get_files(TREE["root"], skip_archived=True)]
+        self.assertEqual(files, ["a.txt", "b.txt", "d.txt"])
+
+    def test_04_visited_folder_fetched_once(self):
+        tree_walker.get_subtree([folder("f1"), folder("f1")])
+        self.assertEqual(self.batch_calls, [["f1"], ["f2"]])
+
+    def test_05_subtree_by_root(self):
+        level1, tree = tree_walker.get_subtree_by_root("root", root_label="Dataset")
+        self.assertEqual(level1, TREE["root"])
+        self.assertEqual(tree.get_children("root"), TREE["root"])
+        files = [x["global_entity_id"] for x in tree.get_files(tree.get_children("root"))]
+        self.assertEqual(files, ["a.txt", "b.txt", "c.txt", "d.txt"])
+
+    def test_06_empty(self):
+        tree = tree_walker.get_subtree([file("d.txt")])
+        self.assertEqual(self.batch_calls, [])
+        self.assertEqual(tree.get_files([file("d.txt")]), [file("d.txt")])
@@ -0,0 +1,133 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import io
+import struct
+import zipfile
+import unittest
+from unittest import mock
+from app.commons.service_connection import minio_client
+from app.commons.service_connection.minio_client import MultipartUploadStream
+from app.resources.version_archive import read_archive_members, plan_reuse, \
+    append_raw_members, strip_zip64_extra
+from tests.fake_minio import FakeMinio
+
+PART_SIZE = 1024
+
+
+class TestVersionArchive(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(minio_client, "MIN_PART_SIZE", PART_SIZE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = FakeMinio(PART_SIZE)
+        self.files = {
+            "a.txt": b"a" * 3000,
+            "b.bin": bytes(range(256)) * 8,
+            "c.txt": b"c" * 10,
+            "d.txt": b"d" * 4000,
+        }
+        previous = io.BytesIO()
+        with zipfile.ZipFile(previous, "w", zipfile.ZIP_STORED) as archive:
+            for name, data in self.files.items():
+                archive.writestr(name, data)
+        self.client.put("bucket", "previous.zip", previous.getvalue())
+
+    def read_archive(self, obj):
+        return zipfile.ZipFile(io.BytesIO(self.client.objects[("bucket", obj)]))
+
+    def test_01_plan_reuse(self):
+        members, start_dir = read_archive_members(self.client, "bucket", "previous.zip")
+        self.assertEqual([x.filename for x in members], list(self.files))
+
+        runs = plan_reuse(members, start_dir, {"a.txt", "b.bin", "d.txt"})
+        self.assertEqual([[x.filename for x in run[2]] for run in runs], [["a.txt", "b.bin"], ["d.txt"]])
+        self.assertEqual(runs[0][:2], (members[0].header_offset, members[2].header_offset))
+        self.assertEqual(runs[1][:2], (members[3].header_offset, start_dir))
+
+    def test_02_append_raw_members(self):
+        members, start_dir = read_archive_members(self.client, "bucket", "previous.zip")
+        runs = plan_reuse(members, start_dir, {"a.txt", "b.bin", "d.txt"})
+
+        upload = MultipartUploadStream(self.client, "bucket", "version.zip", PART_SIZE)
+        with zipfile.ZipFile(upload, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("new.txt", b"n" * 100)
+            for start, end, run in runs:
+                append_raw_members(archive, upload, "bucket", "previous.zip", start, end, run)
+            archive.writestr("c.txt", b"changed")
+        upload.close()
+
+        with self.read_archive("version.zip") as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ["new.txt", "a.txt", "b.bin", "d.txt", "c.txt"])
+            for name in ["a.txt", "b.bin", "d.txt"]:
+                self.assertEqual(archive.read(name), self.files[name])
+            self.assertEqual(archive.read("c.txt"), b"changed")
+
+    def test_03_strip_zip64_extra(self):
+        zip64 = struct.pack("<HHQQ", 1, 16, 1, 2)
+        other = struct.pack("<HH", 0x5455, 5) + b"\x01abcd"
+        self.assertEqual(strip_zip64_extra(zip64 + other), other)
+        self.assertEqual(strip_zip64_extra(other + zip64), other)
+        self.assertEqual(strip_zip64_extra(other), other)
+        self.assertEqual(strip_zip64_extra(b""), b"")
+
+    def test_04_zip64_extra_not_copied(self):
+        members, start_dir = read_archive_members(self.client, "bucket", "previous.zip")
+        other = struct.pack("<HH", 0x5455, 5) + b"\x01abcd"
+        # the zip64 record from the previous archive holds its old offset
+        for zinfo in members:
+            zinfo.extra = struct.pack("<HHQ", 1, 8, 0xFFFFFFFFF) + other
+        runs = plan_reuse(members, start_dir, set(self.files))
+
+        upload = MultipartUploadStream(self.client, "bucket", "version.zip", PART_SIZE)
+        with zipfile.ZipFile(upload, "w") as archive:
+            archive.writestr("new.txt", b"n" * 100)
+            for start, end, run in runs:
+                append_raw_members(archive, upload, "bucket", "previous.zip", start, end, run)
+        upload.close()
+
+        with self.read_archive("version.zip") as archive:
+            self.assertIsNone(archive.testzip())
+            for name, data in self.files.items():
+                self.assertEqual(archive.getinfo(name).extra, other)
+                self.assertEqual(archive.read(name), data)
+
+    def test_05_copy_range_fill_buffer_to_part(self):
+        data = bytes(range(256)) * 16
+        self.client.put("bucket", "source", data)
+        upload = MultipartUploadStream(self.client, "bucket", "obj", PART_SIZE)
+        upload.write(b"x" * 100)
+        # the top up makes the buffer exactly one part, nothing left to flush
+        upload.copy_range("bucket", "source", 0, 3 * PART_SIZE)
+        self.assertEqual(upload.tell(), 100 + 3 * PART_SIZE)
+        upload.close()
+        self.assertEqual(self.client.objects[("bucket", "obj")], b"x" * 100 + data[:3 * PART_SIZE])
+
+    def test_06_copy_range_small(self):
+        data = bytes(range(256)) * 16
+        self.client.put("bucket", "source", data)
+        upload = MultipartUploadStream(self.client, "bucket", "obj", PART_SIZE)
+        upload.write(b"x" * 100)
+        upload.copy_range("bucket", "source", 10, 500)
+        upload.copy_range("bucket", "source", 500, 500 + 2 * PART_SIZE)
+        upload.close()
+        self.assertEqual(self.client.objects[("bucket", "obj")], b"x" * 100 + data[10:500 + 2 * PART_SIZE])
@@ -0,0 +1,46 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import unittest
+from app.models.version_sql import DatasetVersionManifest
+
+
+class TestDatasetVersionManifest(unittest.TestCase):
+
+    def test_01_to_dict_keeps_null(self):
+        row = DatasetVersionManifest(1, "dataset-geid", "data/a.txt", 10, None)
+        result = row.to_dict()
+
+        self.assertIsNone(result["etag"])
+        self.assertIsNone(result["source_geid"])
+        self.assertIsNone(result["header_offset"])
+        self.assertEqual(result["path"], "data/a.txt")
+        self.assertEqual(result["size"], 10)
+
+    def test_02_to_dict_values(self):
+        row = DatasetVersionManifest(1, "dataset-geid", "data/a.txt", 10, "etag-1", \
+            source_geid="geid-1", header_offset=0, compress_size=8, compress_type=8)
+        result = row.to_dict()
+
+        self.assertEqual(result, {
+            "id": None, "version_id": 1, "dataset_geid": "dataset-geid", "path": "data/a.txt",
+            "size": 10, "etag": "etag-1", "source_geid": "geid-1", "header_offset": 0,
+            "compress_size": 8, "compress_type": 8,
+        })
@@ -20,6 +20,7 @@
 
 import unittest
 import json
+import zipfile
 from unittest import mock
 from tests.logger import Logger
 from tests.prepare_test import SetupTest
@@ -60,10 +61,17 @@ class TestVersions(unittest.TestCase):
             cls.log.error(e)
             raise e
 
+    @mock.patch('app.routers.v1.api_version.publish_version.read_archive_members')
     @mock.patch('app.routers.v1.api_version.publish_version.PublishVersion.download_dataset_files')
     @mock.patch('app.routers.v1.api_version.publish_version.PublishVersion.upload_version')
-    def test_01_publish_project(self, mock_upload, mock_download):
+    def test_01_publish_project(self, mock_upload, mock_download, mock_members):
         mock_upload.side_effect = "http://minio://fake_version.zip"
+        # the member of published file in the archive
+        zinfo = zipfile.ZipInfo("version_unittest.csv")
+        zinfo.header_offset = 128
+        zinfo.compress_size = 600
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        mock_members.return_value = ([zinfo], 728)
         self.log.info("\n")
         self.log.info("01 test publish_project".center(80, '-'))
         dataset_geid = self.dataset["global_entity_id"]
@@ -171,3 +179,44 @@ class TestVersions(unittest.TestCase):
         res = self.app.get(f"/v1/dataset/{dataset_geid}/publish/status?status_id={dataset_geid}")
         self.assertEqual(res.status_code, 404)
         self.assertEqual(res.json()["error_msg"], "Status not found")
+
+    def test_09_version_manifest(self):
+        self.log.info("\n")
+        self.log.info("09 test version_manifest".center(80, '-'))
+        dataset_geid = self.dataset["global_entity_id"]
+        payload = {
+            "version": "2.0",
+            "page_size": 10,
+        }
+        res = self.app.get(f"/v1/dataset/{dataset_geid}/versions/manifest", params=payload)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["result"]["version"]["version"], "2.0")
+        files = res.json()["result"]["files"]
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0]["path"], "version_unittest.csv")
+        self.assertEqual(files[0]["size"], 1000)
+        self.assertEqual(files[0]["source_geid"], "version_unittest1")
+        # the etag is only listed for incremental publish
+        self.assertIsNone(files[0]["etag"])
+        self.assertEqual(files[0]["header_offset"], 128)
+        self.assertEqual(files[0]["compress_size"], 600)
+
+        # only the manifest columns can be sorted by
+        res = self.app.get(f"/v1/dataset/{dataset_geid}/versions/manifest", \
+            params={**payload, "sorting": "version_id"})
+        self.assertEqual(res.status_code, 400)
+
+        # filter by the path prefix
+        payload["path"] = "not_exist/"
+        res = self.app.get(f"/v1/dataset/{dataset_geid}/versions/manifest", params=payload)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["result"]["files"], [])
+        self.assertEqual(res.json()["total"], 0)
+
+    def test_10_version_manifest_not_found(self):
+        self.log.info("\n")
+        self.log.info("10 test version_manifest_not_found".center(80, '-'))
+        dataset_geid = self.dataset2["global_entity_id"]
+        res = self.app.get(f"/v1/dataset/{dataset_geid}/versions/manifest")
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.json()["error_msg"], "No published version found")